@@ -0,0 +1,122 @@
+"""
+Тексты ответов участников — на диске (SQLite, answers.db), а не в памяти бота.
+Бот только дописывает ответы по мере поступления и больше их не читает: в user_data остаются
+время ответов и их количество. Тексты нужны только выгрузкам, и те читают их потоком,
+по порядку user_id, отдельным соединением.
+"""
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator
+
+DB_FILE = Path("answers.db")
+
+# Та же таблица, что и в sqlite_storage.py: в режиме STORAGE_BACKEND=sqlite ответы лежат в общей базе
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    user_id INTEGER NOT NULL,
+    question_index INTEGER NOT NULL,
+    answer TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (user_id, question_index)
+) WITHOUT ROWID;
+"""
+
+# Сколько строк выгрузка забирает из базы за раз
+FETCH_SIZE = 1000
+
+
+def iter_answers(path: Path) -> Iterator[tuple[int, int, str, str]]:
+    """
+    (user_id, номер задания, текст, время) всех ответов по возрастанию user_id и номера задания.
+    Читает отдельным соединением: в режиме WAL это не мешает боту дописывать ответы.
+    """
+    conn = sqlite3.connect(Path(path))
+    try:
+        cursor = conn.execute(
+            "SELECT user_id, question_index, answer, timestamp FROM answers ORDER BY user_id, question_index"
+        )
+        while rows := cursor.fetchmany(FETCH_SIZE):
+            yield from rows
+    finally:
+        conn.close()
+
+
+class AnswerTexts:
+    """
+    Тексты ответов одного участника по запросу (выгрузка идёт в порядке user_data, а не по user_id).
+    Поиск идёт по первичному ключу, поэтому в памяти — только ответы текущего участника.
+    """
+
+    def __init__(self, path: Path):
+        self._conn = sqlite3.connect(Path(path)) if Path(path).exists() else None
+
+    def get(self, user_id: int) -> dict[int, str]:
+        """{номер задания: текст}"""
+        if self._conn is None:
+            return {}
+        return dict(self._conn.execute(
+            "SELECT question_index, answer FROM answers WHERE user_id = ?", (user_id,)
+        ).fetchall())
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+
+
+def answers_from_json(user_data: dict) -> Iterator[tuple[int, int, str, str]]:
+    """Тексты ответов, которые ещё лежат в user_data.json или журнале (формат до answers.db)"""
+    for user_id_str, record in user_data.items():
+        for index, answer in (record.get("answers") or {}).items():
+            if "answer" in answer:
+                yield int(user_id_str), int(index), answer["answer"], answer["timestamp"]
+
+
+class AnswerStore:
+    """Append-only хранилище текстов ответов"""
+
+    def __init__(self, path: Path = DB_FILE):
+        self.path = Path(path)
+        # Пишет event loop, переносит старые данные — основной поток при запуске
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Как в sqlite_storage: без fsync на каждый ответ, согласованность сохраняется
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def save_answer(self, user_id: int, question_index: int, answer: str, timestamp: str) -> None:
+        """Сохраняет один ответ (повторный ответ на то же задание заменяет прежний)"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (user_id, question_index, answer, timestamp) VALUES (?, ?, ?, ?)",
+                (user_id, question_index, answer, timestamp),
+            )
+
+    def import_answers(self, answers: Iterable[tuple[int, int, str, str]]) -> int:
+        """
+        Переносит ответы из старых файлов одной транзакцией. Уже сохранённые ответы главнее:
+        они записаны позже, чем старый журнал, который может накатываться повторно.
+        Возвращает количество добавленных ответов.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO answers (user_id, question_index, answer, timestamp) VALUES (?, ?, ?, ?)",
+                    answers,
+                )
+                imported = self._conn.total_changes - before
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return imported
+
+    def iter_answers(self) -> Iterator[tuple[int, int, str, str]]:
+        return iter_answers(self.path)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,91 @@
+"""
+Обработка обновлений, накопившихся за время перезапуска (DROP_PENDING_UPDATES=false), без повторов.
+
+Telegram считает обновление доставленным, только когда бот запросил следующие (polling) или ответил
+на POST (вебхук), поэтому после аварийной остановки часть уже обработанных обновлений приходит снова.
+Обновления одного пользователя обрабатываются по порядку (concurrency.PerUserUpdateProcessor),
+а update_id в Telegram только растут: достаточно помнить для каждого участника update_id
+последнего обработанного обновления — всё, что не новее, уже применено к user_data и пропускается.
+
+update_id хранится в самой записи участника (Participant.last_update_id) и пишется той же записью
+(транзакцией, строкой журнала, снимком), что и изменение, которое сделало это обновление:
+перед сохранением участника вызывается stamp(). Поэтому после остановки не бывает так, что изменение
+сохранилось, а отметка об обновлении нет (или наоборот). Обновления, которые данные участника не меняли,
+отмечаются в памяти (mark()) и попадают на диск со следующей записью участника.
+
+Отметки старше суток не используются: столько Telegram хранит неполученные обновления,
+а после долгого перерыва update_id могут начаться заново.
+"""
+import contextvars
+from collections.abc import Mapping
+
+from concurrency import update_user_key
+from records import Participant, now_timestamp
+
+# Сколько Telegram хранит неполученные обновления, секунд
+MAX_AGE = 24 * 3600
+
+# update_id обновления, которое сейчас обрабатывается (у каждого обновления своя задача asyncio)
+_current_update_id: contextvars.ContextVar = contextvars.ContextVar("current_update_id", default=None)
+
+
+def stamp(participant: Participant) -> None:
+    """Отмечает в записи участника текущее обновление; вызывается перед сохранением записи"""
+    update_id = _current_update_id.get()
+    if update_id is not None:
+        participant.last_update_id = update_id
+        participant.last_update_at = now_timestamp()
+
+
+class UpdateLedger:
+    """
+    Отметки об обработанных обновлениях в записях участников (user_id -> Participant).
+    begin() вызывается до обработчиков, mark() — после них.
+    """
+
+    def __init__(self, participants: Mapping[int, Participant]):
+        self._participants = participants
+        self.skipped = 0
+
+    def _fresh_update_id(self, participant: Participant | None) -> int | None:
+        if participant is None or participant.last_update_id is None:
+            return None
+        if now_timestamp() - participant.last_update_at >= MAX_AGE * 1_000_000:
+            return None
+        return participant.last_update_id
+
+    @property
+    def last_update_id(self) -> int | None:
+        """Самое новое обработанное обновление (для лога при запуске)"""
+        return max(
+            (update_id for update_id in map(self._fresh_update_id, list(self._participants.values()))
+             if update_id is not None),
+            default=None,
+        )
+
+    def begin(self, update: object) -> bool:
+        """
+        Начало обработки обновления. True — оно уже было обработано до перезапуска;
+        иначе его update_id запоминается для stamp() до конца обработки
+        """
+        key = update_user_key(update)
+        applied = self._fresh_update_id(self._participants.get(key)) if key is not None else None
+        if applied is not None and update.update_id <= applied:
+            _current_update_id.set(None)
+            self.skipped += 1
+            return True
+        _current_update_id.set(update.update_id if key is not None else None)
+        return False
+
+    def mark(self, update: object) -> Participant | None:
+        """
+        Конец обработки. Если обработчики не сохраняли участника (stamp() не вызывался), отметка
+        ставится в памяти; возвращает такого участника, чтобы сохранить отметку при случае
+        """
+        _current_update_id.set(None)
+        participant = self._participants.get(update_user_key(update))
+        if participant is None or participant.last_update_id == update.update_id:
+            return None
+        participant.last_update_id = update.update_id
+        participant.last_update_at = now_timestamp()
+        return participant
@@ -0,0 +1,139 @@
+"""
+Завершение квеста: прежний путь — три полные записи файлов подряд (raffle_numbers.json, user_data.json,
+таблица розыгрыша), прежде чем участник получит номер, — против одной записи с fsync в журнал
+завершений (commit_completion), после которой файлы пишет фоновый поток.
+Данные — те же синтетические, что и в bench_hotpaths.py; хранение json.
+
+Меряется, сколько обработчик ждёт до ответа участнику, и сколько fsync уходит на одно завершение
+(у нового пути — вместе с фоновой записью, которая склеивает завершения за интервал).
+
+Запуск:
+    python benchmarks/bench_completion.py [--size 10000] [--completions 20]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_hotpaths import ROOT, write_dataset  # noqa: E402
+
+_fsync = os.fsync
+fsync_calls = {"n": 0}
+
+
+def counting_fsync(fd):
+    fsync_calls["n"] += 1
+    _fsync(fd)
+
+
+def run_worker(size: int, completions: int) -> dict:
+    """Выполняется в отдельном процессе: готовит данные, импортирует bot и меряет оба пути"""
+    workdir = Path(tempfile.mkdtemp(prefix=f"quest-completion-{size}-"))
+    write_dataset(workdir, size)
+    os.chdir(workdir)
+    os.environ.update({"BOT_TOKEN": "123456:BENCH", "STORAGE_BACKEND": "json", "PERSISTENCE_FLUSH_INTERVAL": "1.0",
+                       "RAFFLE_NUMBER_RANGES": "1-1000000"})
+    sys.path.insert(0, str(ROOT))
+
+    import bot
+    import records
+    from persistence import write_json_atomic
+    from raffle_table import raffle_row
+
+    os.fsync = counting_fsync
+    counter = {"n": 0}
+
+    def finisher() -> int:
+        """Новый участник, ответивший на все задания; номер выдаётся как в complete_quest"""
+        counter["n"] += 1
+        user_id = 900_000_000 + counter["n"]
+        now = records.now_timestamp()
+        participant = bot.user_data[user_id] = records.Participant(
+            user_id, username="Бенч", full_name=f"Бенч Бенчев {counter['n']} 🚀", handle="bench",
+            started_at=now, answered_at=[now] * len(bot.QUESTIONS),
+        )
+        participant.raffle_number = bot.generate_raffle_number()
+        bot.raffle_numbers[str(user_id)] = participant.raffle_number
+        participant.completed_at = records.now_timestamp()
+        return user_id
+
+    def three_writes(user_id: int):
+        # Как complete_quest делал раньше при синхронной записи (PERSISTENCE_FLUSH_INTERVAL=0)
+        bot._write_raffle_numbers()
+        write_json_atomic(bot.DATA_FILE, records.participants_to_json(bot.user_data))
+        bot.raffle_table.add(raffle_row(bot.user_data[user_id]))
+        bot._write_raffle_table()
+
+    def run(path) -> tuple[list, int, float]:
+        waits = []
+        fsync_calls["n"] = 0
+        started = time.perf_counter()
+        for _ in range(completions):
+            user_id = finisher()
+            begin = time.perf_counter()
+            path(user_id)
+            waits.append(time.perf_counter() - begin)
+        bot.flusher.stop()
+        return waits, fsync_calls["n"], time.perf_counter() - started
+
+    bot.rebuild_raffle_table()
+    old_waits, old_fsyncs, old_total = run(three_writes)
+
+    bot.flusher.start()
+    new_waits, new_fsyncs, new_total = run(bot.commit_completion)
+
+    os.fsync = _fsync
+    os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    def summary(waits, fsyncs, total):
+        return {
+            "handler_median_ms": round(statistics.median(waits) * 1000, 3),
+            "handler_max_ms": round(max(waits) * 1000, 3),
+            "fsync_per_completion": round(fsyncs / completions, 2),
+            "total_s": round(total, 3),
+        }
+
+    return {
+        "three_writes": summary(old_waits, old_fsyncs, old_total),
+        "single_commit": summary(new_waits, new_fsyncs, new_total),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Завершение квеста: три записи против одной")
+    parser.add_argument("--size", type=int, default=10_000, help="число участников")
+    parser.add_argument("--completions", type=int, default=20, help="сколько участников завершают квест")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.size, args.completions)))
+        return
+
+    completed = subprocess.run(
+        [sys.executable, __file__, "--worker", "--size", str(args.size), "--completions", str(args.completions)],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    if completed.returncode != 0:
+        raise SystemExit(f"Замер упал:\n{completed.stderr[-3000:]}")
+    results = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    print(f"{args.size} участников, {args.completions} завершений")
+    print(f"{'путь':<16}{'ожидание, мс (медиана)':>24}{'максимум, мс':>14}{'fsync/завершение':>18}{'всего, с':>10}")
+    for name, title in (("three_writes", "три записи"), ("single_commit", "одна запись")):
+        value = results[name]
+        print(f"{title:<16}{value['handler_median_ms']:>24.3f}{value['handler_max_ms']:>14.3f}"
+              f"{value['fsync_per_completion']:>18.2f}{value['total_s']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Проверка параллельной обработки обновлений: N пользователей проходят квест
+примерно за то же время, что и один, а сообщения каждого пользователя
+обрабатываются строго по порядку. Обработчик здесь синтетический; порядок и лимит
+параллельности с настоящими обработчиками бота проверяет tests/test_concurrency.py.
+
+Запуск:
+    python benchmarks/bench_concurrency.py [число пользователей]
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram import Chat, Message, Update, User  # noqa: E402
+
+from concurrency import PerUserUpdateProcessor  # noqa: E402
+
+# Как в квесте: /start, две кнопки и шесть ответов
+STEPS_PER_USER = 9
+# Имитация ответа Telegram API и паузы перед следующим заданием
+HANDLER_DELAY = 0.05
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    user = User(id=user_id, first_name=f"user{user_id}", is_bot=False)
+    chat = Chat(id=user_id, type=Chat.PRIVATE)
+    message = Message(message_id=update_id, date=datetime.now(), chat=chat, from_user=user, text=text)
+    return Update(update_id=update_id, message=message)
+
+
+async def run(users: int, max_concurrent: int) -> tuple[float, dict]:
+    processor = PerUserUpdateProcessor(max_concurrent)
+    processed: dict[int, list[int]] = {}
+
+    async def handler(update: Update):
+        await asyncio.sleep(HANDLER_DELAY)
+        processed.setdefault(update.effective_user.id, []).append(int(update.message.text))
+
+    # Обновления приходят вперемешку, как из getUpdates во время наплыва участников
+    updates = [
+        make_update(step * users + user_id, user_id, str(step))
+        for step in range(STEPS_PER_USER)
+        for user_id in range(1, users + 1)
+    ]
+
+    started = time.perf_counter()
+    async with processor:
+        # Так же, как Application: задача на каждое обновление в порядке получения
+        tasks = [asyncio.create_task(processor.process_update(u, handler(u))) for u in updates]
+        await asyncio.gather(*tasks)
+    return time.perf_counter() - started, processed
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    max_concurrent = max(users, 1)
+
+    single_time, _ = asyncio.run(run(1, max_concurrent))
+    many_time, processed = asyncio.run(run(users, max_concurrent))
+
+    in_order = all(steps == list(range(STEPS_PER_USER)) for steps in processed.values())
+    print(f"1 пользователь: {single_time:.3f} с")
+    print(f"{users} пользователей: {many_time:.3f} с ({many_time / single_time:.2f}x)")
+    print(f"Порядок сообщений каждого пользователя сохранён: {'да' if in_order else 'НЕТ'}")
+
+    # Последовательная обработка заняла бы users * single_time
+    if not in_order or many_time > single_time * 2:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Микробенчмарки горячих путей бота на синтетических данных размера мероприятия:
+проверка ответов, расшифровка эмодзи, экранирование MarkdownV2, сохранение user_data
+и таблицы розыгрыша, восстановление состояний и загрузка данных при импорте bot.py.
+
+Каждый размер (по умолчанию 1k, 10k и 100k участников) считается в отдельном процессе:
+bot.py загружает данные при импорте, поэтому для каждого набора нужен чистый импорт.
+
+Запуск:
+    python benchmarks/bench_hotpaths.py [--sizes 1000,10000] [--output results.json]
+    python benchmarks/bench_hotpaths.py --save-baseline        # запомнить текущие результаты
+Сравнение с сохранённым базовым результатом (benchmarks/baseline_hotpaths.json) выполняется всегда,
+если он есть; замедление больше --threshold (по умолчанию 50%, ниже мешает шум) — код возврата 1.
+Лучшее время сравнивается с медианой базового: на виртуальной машине отдельные замеры случайно
+бывают в полтора раза быстрее обычных, и такой замер в базовом результате давал ложные замедления.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+SCRIPT_FILE = Path(__file__).resolve()
+ROOT = SCRIPT_FILE.parent.parent
+BASELINE_FILE = Path(__file__).resolve().parent / "baseline_hotpaths.json"
+DEFAULT_SIZES = (1000, 10000, 100000)
+# Сколько времени крутить один замер микробенчмарка и сколько замеров делать (берётся лучший)
+TARGET_TIME = 0.2
+REPEATS = 5
+# bot.py загружает данные при импорте, поэтому каждый замер импорта — отдельный процесс
+IMPORT_REPEATS = 3
+
+FIRST_NAMES = ["Анна", "Мария", "Иван", "Дмитрий", "Екатерина", "Алексей", "Ольга", "Сергей", "Наталья",
+               "Андрей", "Юлия", "Павел", "Ксения", "Михаил", "Татьяна", "Artem", "Kate", "Ёжик"]
+LAST_NAMES = ["Иванова", "Петров", "Смирнова", "Кузнецов", "Соколова", "Попов", "Лебедева", "Новиков",
+              "Морозова", "Волков", "Orlova", "Д'Артаньян"]
+NAME_DECORATIONS = ["", "", "", " 🚀", " ✨", " (AI)", " 🤖", "_dev", " [PM]"]
+INTERESTS = ["pro ai", "горные лыжи", "настольные игры", "кофе ☕", "бег по утрам", "python", "котиков 🐱",
+             "фантастику", "путешествия ✈️", "джаз"]
+EXPECTATIONS = ["узнать, как внедрять ИИ в работу", "найти единомышленников 🤝", "послушать доклады про LLM",
+                "понять, куда развивается рынок", "выиграть в розыгрыше 🎁", "задать вопросы спикерам"]
+EMOJI_ANSWERS = [
+    "искусственный интеллект, машинное обучение, нейросеть, компьютерное зрение",
+    "ИИ\nМЛ\nнейронная сеть\nкомпьютерное зрение",
+    "🤖🧠 - AI; 🚗📖 - ML; 🧠📶 - neural network; 🖥️👁️ - computer vision",
+    "искусственный интеллект и что-то про машины",
+    "нейросети, машинноеобучение... а дальше не знаю 🤷",
+    "Artificial Intelligence, Machine Learning, NN, CV",
+]
+GREETINGS = ["Привет, {name}! Рад(а) знакомству 👋", "Здравствуйте, {name}, спасибо за доклад!",
+             "Hello {name}! See you next time", "{name}, приветствую от всей команды 🙌",
+             "{name}, было круто пообщаться"]
+SKILLS = ["умеет собирать кубик-Рубика за минуту", "может жонглировать пятью мячами 🤹",
+          "гордится тем, что пробежал марафон", "навык: печёт идеальные круассаны 🥐",
+          "свободно говорит на пяти языках"]
+AUGMENTATIONS = [
+    "Аугментация — это когда из имеющихся данных делают новые примеры для обучения модели",
+    "Это искусственное расширение датасета: повороты, шум, обрезка картинок 🖼️",
+    "Простыми словами: из одной фотки котика делаем десять немного разных",
+]
+
+
+def _name(rnd: random.Random) -> tuple[str, str]:
+    first = rnd.choice(FIRST_NAMES)
+    return first, f"{first} {rnd.choice(LAST_NAMES)}{rnd.choice(NAME_DECORATIONS)}"
+
+
+def make_answers(rnd: random.Random, count: int, started: datetime) -> dict:
+    friend = rnd.choice(FIRST_NAMES)
+    texts = [
+        f"Я и {friend} вместе любим {rnd.choice(INTERESTS)}",
+        f"На митапе PRO AI я хочу {rnd.choice(EXPECTATIONS)}",
+        rnd.choice(EMOJI_ANSWERS[:3]),
+        rnd.choice(GREETINGS).format(name=friend),
+        f"{rnd.choice(FIRST_NAMES)} {rnd.choice(SKILLS)}",
+        rnd.choice(AUGMENTATIONS),
+    ]
+    return {
+        str(i): {"answer": texts[i], "timestamp": (started + timedelta(minutes=2 * i + 1)).isoformat()}
+        for i in range(count)
+    }
+
+
+def make_dataset(size: int, seed: int = 42) -> tuple[dict, dict]:
+    """user_data и raffle_numbers: ~60% прошли квест, остальные на разных заданиях или только нажали /start"""
+    rnd = random.Random(seed)
+    user_data = {}
+    raffle_numbers = {}
+    next_number = 1
+    base = datetime(2025, 11, 20, 14, 0)
+    for n in range(size):
+        user_id = str(100_000_000 + n)
+        first, full_name = _name(rnd)
+        started = base + timedelta(seconds=rnd.randint(0, 3 * 3600))
+        roll = rnd.random()
+        answered = 6 if roll < 0.6 else rnd.randint(0, 5)
+        record = {
+            "username": first,
+            "full_name": full_name,
+            "telegram_id": int(user_id),
+            "handle": f"user{n}" if rnd.random() < 0.8 else "",
+            "started_at": started.isoformat() if roll < 0.95 else None,
+            "answers": make_answers(rnd, answered, started) if roll < 0.95 else {},
+            "raffle_number": None,
+            "completed_at": None,
+        }
+        if answered == 6 and roll < 0.6:
+            record["raffle_number"] = next_number
+            record["completed_at"] = (started + timedelta(minutes=13)).isoformat()
+            raffle_numbers[user_id] = next_number
+            next_number += 1
+        user_data[user_id] = record
+    return user_data, {"numbers": raffle_numbers, "next_number": next_number}
+
+
+def write_dataset(workdir: Path, size: int) -> None:
+    """
+    Данные в том виде, в каком их оставляет работающий бот: тексты ответов — в answers.db,
+    user_data.json — без них и без отступов. Перенос текстов из файлов старого формата делается
+    один раз при обновлении и в замер запуска не входит
+    """
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    from answer_store import AnswerStore, answers_from_json
+
+    user_data, raffle = make_dataset(size)
+    store = AnswerStore(workdir / "answers.db")
+    store.import_answers(answers_from_json(user_data))
+    store.close()
+    for record in user_data.values():
+        for answer in record["answers"].values():
+            del answer["answer"]
+    with open(workdir / "user_data.json", "w", encoding="utf-8") as f:
+        json.dump(user_data, f, ensure_ascii=False)
+    with open(workdir / "raffle_numbers.json", "w", encoding="utf-8") as f:
+        json.dump(raffle, f, ensure_ascii=False, indent=2)
+
+
+def measure(func, target_time: float = TARGET_TIME, repeats: int = REPEATS, number: int | None = None) -> dict:
+    """Время одного вызова: лучший и медианный из repeats замеров по number вызовов"""
+    if number is None:
+        # Подбираем число вызовов, чтобы замер шёл около target_time
+        number = 1
+        while True:
+            started = time.perf_counter()
+            for _ in range(number):
+                func()
+            elapsed = time.perf_counter() - started
+            if elapsed >= target_time / 5 or number >= 1_000_000:
+                number = max(1, int(number * target_time / max(elapsed, 1e-9)))
+                break
+            number *= 10
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - started) / number)
+    samples.sort()
+    return {"best_us": round(samples[0] * 1e6, 3), "median_us": round(samples[len(samples) // 2] * 1e6, 3),
+            "calls": number * repeats}
+
+
+def import_bot() -> float:
+    """Импортирует bot из текущего каталога; возвращает время импорта в секундах"""
+    sys.path.insert(0, str(ROOT))
+    # Библиотеки и модули бота импортируем заранее, чтобы в замер импорта bot попала только загрузка данных
+    for module in sorted(ROOT.glob("*.py")):
+        if module.stem not in ("bot", "export_data"):
+            importlib.import_module(module.stem)
+    started = time.perf_counter()
+    import bot  # noqa: F401
+    return time.perf_counter() - started
+
+
+def run_worker(size: int) -> dict:
+    """Выполняется в отдельном процессе: готовит данные, импортирует bot и меряет"""
+    workdir = Path(tempfile.mkdtemp(prefix=f"quest-bench-{size}-"))
+    write_dataset(workdir, size)
+    os.chdir(workdir)
+    os.environ.update({"BOT_TOKEN": "123456:BENCH", "STORAGE_BACKEND": "json", "PERSISTENCE_FLUSH_INTERVAL": "0",
+                       "RAFFLE_NUMBER_RANGES": "1-1000000"})
+
+    def load_json():
+        with open("user_data.json", "r", encoding="utf-8") as f:
+            json.load(f)
+
+    results = {"json_load_user_data": measure(load_json, repeats=3)}
+
+    # Один импорт на этом размере данных — десятки миллисекунд и сильно зависит от шума: берём лучший из нескольких
+    import_times = [
+        float(subprocess.run(
+            [sys.executable, str(SCRIPT_FILE), "--import-only"], capture_output=True, text=True, check=True,
+        ).stdout.strip().splitlines()[-1])
+        for _ in range(IMPORT_REPEATS - 1)
+    ]
+    import_times.append(import_bot())
+    import_times.sort()
+    results["import_bot"] = {"best_us": round(import_times[0] * 1e6, 3),
+                             "median_us": round(import_times[len(import_times) // 2] * 1e6, 3),
+                             "calls": len(import_times)}
+    import bot
+    import records
+
+    rnd = random.Random(7)
+    samples = []
+    for _ in range(200):
+        answers = make_answers(rnd, 6, datetime(2025, 11, 20, 14, 0))
+        index = rnd.randrange(6)
+        samples.append((answers[str(index)]["answer"], index))
+    samples += [("ок", 0), ("Я и Маша", 0), ("да", 3), ("Мы просто стояли рядом", 3)]
+    state = {"i": 0}
+
+    def validate():
+        text, index = samples[state["i"] % len(samples)]
+        state["i"] += 1
+        bot.validate_answer(text, bot.QUESTIONS[index], index)
+
+    emoji_texts = [t.lower() for t in EMOJI_ANSWERS]
+
+    def check_emoji():
+        bot.check_emoji_answer(emoji_texts[state["i"] % len(emoji_texts)])
+        state["i"] += 1
+
+    names = [_name(rnd)[1] for _ in range(50)] + [bot.QUESTIONS[0]["text"], bot.QUESTIONS[2]["text"]]
+
+    def escape():
+        bot.escape_markdown_v2(names[state["i"] % len(names)])
+        state["i"] += 1
+
+    results["validate_answer"] = measure(validate)
+    results["check_emoji_answer"] = measure(check_emoji)
+    results["escape_markdown_v2"] = measure(escape)
+
+    # Тяжёлые операции: время растёт с числом участников, поэтому вызовов мало
+    heavy = {"number": 1, "repeats": 3 if size >= 100_000 else 5}
+    # Запись user_data после ответа одного участника: заново сериализуется только его запись
+    changed_ids = list(bot.user_data)[:1000]
+    bot.save_user_data()
+
+    def save_after_answer():
+        bot.participants_json.mark_dirty(changed_ids[state["i"] % len(changed_ids)])
+        state["i"] += 1
+        bot.save_user_data()
+
+    results["save_user_data"] = measure(save_after_answer, **heavy)
+
+    def restore():
+        bot.user_states.clear()
+        bot.restore_user_states()
+
+    results["restore_user_states"] = measure(restore, **heavy)
+
+    # Первое сообщение участника после запуска: состояние собирается из user_data
+    user_ids = [int(user_id_str) for user_id_str in list(bot.user_data)[:1000]]
+
+    def get_state():
+        user_id = user_ids[state["i"] % len(user_ids)]
+        state["i"] += 1
+        bot.user_states.pop(user_id, None)
+        bot.get_user_state(user_id)
+
+    results["get_user_state"] = measure(get_state)
+
+    # Завершение квеста: новый участник получает номер, его строка попадает в таблицу
+    bot.rebuild_raffle_table()
+    results["rebuild_raffle_table"] = measure(bot.rebuild_raffle_table, **heavy)
+    counter = {"n": 0}
+
+    def complete_one():
+        counter["n"] += 1
+        user_id = 900_000_000 + counter["n"]
+        now = records.now_timestamp()
+        bot.user_data[user_id] = records.Participant(
+            user_id, username="Бенч", full_name=f"Бенч Бенчев {counter['n']} 🚀", handle="bench",
+            started_at=now, completed_at=now, raffle_number=bot.generate_raffle_number(),
+        )
+        bot.save_raffle_table(user_id)
+
+    results["save_raffle_table"] = measure(complete_one, number=20, repeats=heavy["repeats"])
+
+    bot.flusher.stop()
+    os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def run_size(size: int) -> dict:
+    completed = subprocess.run(
+        [sys.executable, __file__, "--worker", str(size)],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Замер для {size} участников упал:\n{completed.stderr[-3000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Список замедлений больше threshold: лучшее время относительно медианы baseline (или его лучшего)"""
+    regressions = []
+    for size, benches in results["sizes"].items():
+        for name, value in benches.items():
+            base = baseline.get("sizes", {}).get(size, {}).get(name)
+            base_us = base and (base.get("median_us") or base.get("best_us"))
+            if not base_us:
+                continue
+            ratio = value["best_us"] / base_us
+            value["vs_baseline"] = round(ratio, 3)
+            if ratio > 1 + threshold:
+                regressions.append((size, name, base_us, value["best_us"], ratio))
+    return regressions
+
+
+def print_table(results: dict) -> None:
+    for size, benches in results["sizes"].items():
+        print(f"\n{size} участников")
+        print(f"{'замер':<24}{'лучшее, мкс':>16}{'медиана, мкс':>16}{'к базовому':>12}")
+        for name, value in benches.items():
+            ratio = value.get("vs_baseline")
+            print(f"{name:<24}{value['best_us']:>16,.1f}{value.get('median_us', value['best_us']):>16,.1f}"
+                  f"{(f'{ratio:.2f}x' if ratio else '-'):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих путей бота")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="размеры наборов через запятую")
+    parser.add_argument("--output", type=Path, help="куда записать результаты в JSON")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE, help="файл базовых результатов")
+    parser.add_argument("--save-baseline", action="store_true", help="записать результаты как базовые")
+    parser.add_argument("--threshold", type=float, default=0.5, help="допустимое замедление (0.5 = 50%%)")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--import-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.import_only:
+        print(import_bot())
+        return
+    if args.worker:
+        print(json.dumps(run_worker(args.worker)))
+        return
+
+    results = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "sizes": {},
+    }
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        print(f"Замер для {size} участников...", file=sys.stderr)
+        results["sizes"][str(size)] = run_size(size)
+
+    regressions = []
+    if args.baseline.exists() and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nБазовые результаты записаны в {args.baseline}")
+
+    if regressions:
+        print(f"\nЗамедление больше {args.threshold:.0%}:")
+        for size, name, base, value, ratio in regressions:
+            print(f"  {size} участников, {name}: {base:,.1f} → {value:,.1f} мкс ({ratio:.2f}x)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Сколько памяти занимают данные участников: прежние вложенные словари user_data
+(плюс состояния, которые раньше строились для всех при запуске) против записей из records.py,
+в которых остаётся только время ответов (тексты — в answers.db).
+Данные — те же синтетические, что и в bench_hotpaths.py.
+
+Запуск:
+    python benchmarks/bench_memory.py [--size 50000]
+"""
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_hotpaths import make_dataset  # noqa: E402
+from records import participants_from_json  # noqa: E402
+
+QUESTIONS_COUNT = 6
+
+
+def eager_states(user_data: dict) -> dict:
+    """Состояния в том виде, в каком их раньше строил restore_user_states для каждого участника"""
+    states = {}
+    for user_id_str, data in user_data.items():
+        if data.get("raffle_number"):
+            states[int(user_id_str)] = {
+                "stage": "completed",
+                "current_question": QUESTIONS_COUNT,
+                "answers": data.get("answers", {}),
+                "raffle_number": data.get("raffle_number"),
+            }
+        elif data.get("started_at") and len(data.get("answers", {})) < QUESTIONS_COUNT:
+            states[int(user_id_str)] = {
+                "stage": "answering",
+                "current_question": len(data.get("answers", {})),
+                "answers": data.get("answers", {}),
+            }
+    return states
+
+
+def measure(build) -> int:
+    """Байт, оставшихся занятыми после build() (результат удерживается до конца замера)"""
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память на данные участников")
+    parser.add_argument("--size", type=int, default=50_000, help="число участников")
+    args = parser.parse_args()
+
+    text = json.dumps(make_dataset(args.size)[0], ensure_ascii=False)
+
+    def as_dicts():
+        user_data = json.loads(text)
+        return user_data, eager_states(user_data)
+
+    def as_records():
+        return participants_from_json(json.loads(text))
+
+    dicts = measure(as_dicts)
+    records = measure(as_records)
+    print(f"{args.size} участников")
+    print(f"{'словари user_data + состояния':<32}{dicts / 2**20:>10.1f} МиБ{dicts / args.size:>10.0f} байт/участник")
+    print(f"{'записи records.py':<32}{records / 2**20:>10.1f} МиБ{records / args.size:>10.0f} байт/участник")
+    print(f"экономия: {1 - records / dicts:.0%}")
+
+
+if __name__ == "__main__":
+    main()
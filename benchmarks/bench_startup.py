@@ -0,0 +1,66 @@
+"""
+Время загрузки данных участников при запуске: user_data.json (разбор JSON и перевод в записи)
+против двоичного снимка user_data.snapshot (индекс и имена, время ответов не читается).
+Данные — те же синтетические, что и в bench_hotpaths.py.
+
+Запуск:
+    python benchmarks/bench_startup.py [--size 100000] [--repeat 5]
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_hotpaths import make_dataset  # noqa: E402
+from records import participants_from_json  # noqa: E402
+from snapshot import load_snapshot, write_snapshot  # noqa: E402
+
+
+def best_of(repeat: int, func) -> float:
+    """Лучшее время из repeat запусков, мс"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка данных участников при запуске")
+    parser.add_argument("--size", type=int, default=100_000, help="число участников")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов каждого замера")
+    args = parser.parse_args()
+
+    user_data = make_dataset(args.size)[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = Path(tmp) / "user_data.json"
+        snapshot_file = Path(tmp) / "user_data.snapshot"
+        with open(json_file, "w", encoding="utf-8") as f:
+            json.dump(user_data, f, ensure_ascii=False, indent=2)
+        write_snapshot(snapshot_file, participants_from_json(user_data))
+
+        def from_json():
+            with open(json_file, "r", encoding="utf-8") as f:
+                return participants_from_json(json.load(f))
+
+        json_ms = best_of(args.repeat, from_json)
+        snapshot_ms = best_of(args.repeat, lambda: load_snapshot(snapshot_file))
+        # Первое обращение ко времени ответов одного участника после загрузки снимка
+        participants = load_snapshot(snapshot_file)
+        first = next(iter(participants.values()))
+        answers_us = best_of(1, lambda: first.answered_at) * 1000
+
+        print(f"{args.size} участников")
+        print(f"{'user_data.json':<22}{json_file.stat().st_size / 2**20:>8.1f} МиБ{json_ms:>10.0f} мс")
+        print(f"{'user_data.snapshot':<22}{snapshot_file.stat().st_size / 2**20:>8.1f} МиБ{snapshot_ms:>10.0f} мс")
+        print(f"ускорение: {json_ms / snapshot_ms:.1f}x; время ответов участника читается за {answers_us:.0f} мкс")
+
+
+if __name__ == "__main__":
+    main()
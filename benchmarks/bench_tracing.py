@@ -0,0 +1,119 @@
+"""
+Цена трассировки обновлений (tracing.py): сколько добавляют к обработке одного обновления
+точки замера этапов, когда трассировка выключена (по умолчанию) и когда включена.
+
+В handle_message около десятка точек: этапы state, deliver_pending_question, validation, persist,
+reply, schedule_next_question и запись каждого запроса к Bot API. Выключенная трассировка не оборачивает
+обработчики вовсе, а stage() возвращает общий пустой контекстный менеджер — замеряется именно это.
+Доля считается от времени handle_message (--handler-ms, по умолчанию 1 мс — быстрее ответ
+не обрабатывается даже без сети: одна запись в базу уже занимает сотни микросекунд).
+
+Запуск:
+    python benchmarks/bench_tracing.py [--points 10] [--handler-ms 1.0]
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import tracing  # noqa: E402
+
+# Сколько раз повторять операцию в одном замере и сколько замеров делать (берётся лучший)
+ITERATIONS = 200_000
+REPEATS = 5
+
+
+def best_ns(function) -> float:
+    """Лучшее из REPEATS среднее время одной итерации function(), наносекунды"""
+    best = float("inf")
+    for _ in range(REPEATS):
+        started = time.perf_counter_ns()
+        function()
+        best = min(best, (time.perf_counter_ns() - started) / ITERATIONS)
+        # Этапы, записанные в трассу, не копятся между замерами
+        trace = tracing._current.get()
+        if trace is not None:
+            trace.stages.clear()
+    return best
+
+
+def empty_loop():
+    for _ in range(ITERATIONS):
+        pass
+
+
+def stage_loop():
+    stage = tracing.stage
+    for _ in range(ITERATIONS):
+        with stage("validation"):
+            pass
+
+
+def record_loop():
+    record = tracing.record
+    for _ in range(ITERATIONS):
+        record("telegram.sendMessage", 0.001)
+
+
+def measure() -> dict:
+    baseline = best_ns(empty_loop)
+    return {
+        "stage_ns": round(best_ns(stage_loop) - baseline, 1),
+        "record_ns": round(best_ns(record_loop) - baseline, 1),
+    }
+
+
+async def handler(update):
+    return None
+
+
+def traced_handler_ns() -> float:
+    """Вызов обработчика, обёрнутого traced(), сверх вызова без обёртки (своя трасса на каждый вызов)"""
+    wrapped = tracing.traced("handle_message")(handler)
+
+    async def run(function):
+        started = time.perf_counter_ns()
+        for _ in range(ITERATIONS // 10):
+            await function(None)
+        return (time.perf_counter_ns() - started) / (ITERATIONS // 10)
+
+    plain = min(asyncio.run(run(handler)) for _ in range(REPEATS))
+    traced = min(asyncio.run(run(wrapped)) for _ in range(REPEATS))
+    return round(traced - plain, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Цена трассировки обновлений")
+    parser.add_argument("--points", type=int, default=10, help="точек замера на одно обновление")
+    parser.add_argument("--handler-ms", type=float, default=1.0, help="время обработки обновления, мс")
+    args = parser.parse_args()
+
+    # Выключена: обработчики не обёрнуты, этапы — пустой контекстный менеджер
+    tracing.configure(0)
+    assert tracing.traced("handle_message")(handler) is handler
+    disabled = measure()
+
+    # Включена (порог большой, чтобы не мерить запись в лог): этапы пишутся в трассу обновления
+    tracing.configure(10 ** 9)
+    trace = tracing.UpdateTrace("handle_message", None)
+    token = tracing._current.set(trace)
+    enabled = measure()
+    tracing._current.reset(token)
+    enabled["trace_ns"] = traced_handler_ns()
+    tracing.configure(0)
+
+    print(f"{'':<12}{'stage(), нс':>14}{'record(), нс':>14}{'трасса, нс':>12}{'на обновление, мкс':>20}"
+          f"{'доля':>8}")
+    for title, result in (("выключена", disabled), ("включена", enabled)):
+        per_point = max(result["stage_ns"], result["record_ns"])
+        per_update = (args.points * per_point + result.get("trace_ns", 0)) / 1000
+        share = per_update / (args.handler_ms * 1000) * 100
+        print(f"{title:<12}{result['stage_ns']:>14}{result['record_ns']:>14}{result.get('trace_ns', '-'):>12}"
+              f"{per_update:>20.2f}{share:>7.2f}%")
+
+
+if __name__ == "__main__":
+    main()
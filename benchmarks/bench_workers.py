@@ -0,0 +1,76 @@
+"""
+Масштабирование по процессам: нагрузочный тест (loadtest.py) для BOT_WORKERS = 1, 2, ... N
+на общей базе SQLite. Участники подключаются все сразу, чтобы бот был загружен полностью;
+сравниваются пропускная способность (обновлений в секунду) и задержки ответов.
+
+Заглушка Bot API и участники работают в процессе самого замера, поэтому прирост виден,
+только если свободных ядер больше, чем рабочих: на одном ядре несколько процессов
+лишь делят его между собой.
+
+Запуск:
+    python benchmarks/bench_workers.py [--workers 4] [--users 1000]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.loadtest import LoadTest, percentile  # noqa: E402
+
+# Шаги с ответами на задания: их обработка и выдача номеров нагружают бота сильнее всего
+ANSWER_STEPS = ("answer1", "answer2", "answer3", "answer4", "answer5", "answer6")
+
+
+def run(workers: int, args) -> dict:
+    os.environ.update({
+        "BOT_WORKERS": str(workers),
+        "STORAGE_BACKEND": "sqlite",
+        # Ограничитель исходящих сообщений здесь мерил бы лимиты Telegram, а не бота
+        "RATE_LIMIT_OVERALL": "0",
+        "RAFFLE_NUMBER_RANGES": f"1-{max(1000, args.users)}",
+    })
+    load_args = argparse.Namespace(
+        users=args.users, ramp=args.ramp, think=0, wrong_emoji=0.5, mode="polling",
+        traffic=None, keep=False, json=False,
+    )
+    report = asyncio.run(LoadTest(load_args).run())
+    shutil.rmtree(report.pop("workdir"), ignore_errors=True)
+
+    answers = sorted(
+        value for name, step in report["steps"].items() if name in ANSWER_STEPS
+        for value in [step.get("p50_ms")] if value is not None
+    )
+    return {
+        "workers": workers,
+        "completed": report["completed_users"],
+        "timeouts": sum(step["timeouts"] for step in report["steps"].values()),
+        "duration_s": report["duration_s"],
+        "updates_per_s": report["updates_per_s"],
+        "answer_p50_ms": percentile(answers, 50) if answers else None,
+        "start_p95_ms": report["steps"].get("/start", {}).get("p95_ms"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность бота при 1..N рабочих процессах")
+    parser.add_argument("--workers", type=int, default=4, help="наибольшее число рабочих процессов")
+    parser.add_argument("--users", type=int, default=1000, help="число участников")
+    parser.add_argument("--ramp", type=float, default=0, help="за сколько секунд подключаются все участники")
+    args = parser.parse_args()
+
+    print(f"{args.users} участников, ядер: {os.cpu_count()}")
+    print(f"{'рабочих':>8}{'прошли':>8}{'таймауты':>10}{'время, с':>10}{'обновл./с':>11}"
+          f"{'ответ p50, мс':>15}{'/start p95, мс':>16}")
+    # 1 — обычный бот без главного процесса, для сравнения
+    for workers in range(1, args.workers + 1):
+        result = run(workers, args)
+        print(f"{result['workers']:>8}{result['completed']:>8}{result['timeouts']:>10}{result['duration_s']:>10}"
+              f"{result['updates_per_s']:>11}{result['answer_p50_ms'] or '-':>15}{result['start_p95_ms'] or '-':>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Заглушка Telegram Bot API для локальных проверок без доступа к Telegram.
+Отвечает на getMe, setWebhook, getUpdates, sendMessage, sendPhoto, sendDocument,
+answerCallbackQuery и т.п. правдоподобными ответами и запоминает все вызовы.
+
+Бот направляется на неё переменной окружения BOT_API_BASE_URL=http://127.0.0.1:<порт>/bot
+
+Запуск отдельно:
+    python benchmarks/fake_bot_api.py [порт]
+"""
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from http_server import HTTPServer, Request, Response, json_response  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Quest Bot", "username": "quest_test_bot"}
+
+# Загрузки /export и картинок могут быть большими
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+
+
+def _chat_id(fields: dict) -> int:
+    try:
+        return int(fields.get("chat_id", 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+class FakeBotAPI:
+    """
+    Все запросы /bot<токен>/<метод> обрабатываются здесь.
+    on_call(method, fields) вызывается на каждый запрос — так нагрузочный тест видит ответы бота.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, on_call: Optional[Callable[[str, dict], None]] = None):
+        self.server = HTTPServer(host, port, max_body_size=MAX_UPLOAD_SIZE)
+        self.server.route_prefix("POST", "/bot", self._handle)
+        self.server.route_prefix("GET", "/bot", self._handle)
+        self.on_call = on_call
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._updates: asyncio.Queue = asyncio.Queue()
+        self.webhook_url = ""
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server.host}:{self.server.port}/bot"
+
+    async def start(self) -> None:
+        await self.server.start()
+
+    async def stop(self) -> None:
+        # Незавершённые long polling getUpdates просто обрываем
+        await self.server.stop(timeout=0)
+
+    def push_update(self, update: dict) -> None:
+        """Обновление, которое бот получит через getUpdates"""
+        self._updates.put_nowait(update)
+
+    async def _get_updates(self, fields: dict) -> list:
+        timeout = float(fields.get("timeout", 0) or 0)
+        updates = []
+        try:
+            if self._updates.empty() and timeout > 0:
+                updates.append(await asyncio.wait_for(self._updates.get(), timeout))
+            while not self._updates.empty() and len(updates) < 100:
+                updates.append(self._updates.get_nowait())
+        except asyncio.TimeoutError:
+            pass
+        # Выданные обновления из очереди уже удалены, поэтому offset не нужен
+        return updates
+
+    def _message(self, fields: dict, **extra) -> dict:
+        chat_id = _chat_id(fields)
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": BOT_USER,
+        }
+        message.update(extra)
+        return message
+
+    def _file(self, prefix: str) -> dict:
+        n = next(self._file_ids)
+        return {"file_id": f"{prefix}-{n}", "file_unique_id": f"u{prefix}{n}"}
+
+    async def _handle(self, request: Request) -> Response:
+        method = request.path.rsplit("/", 1)[-1]
+        try:
+            fields = request.form() if request.body else dict(request.query)
+        except (ValueError, UnicodeDecodeError):
+            return json_response({"ok": False, "error_code": 400, "description": "Bad Request"}, 400)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.on_call is not None:
+            self.on_call(method, fields)
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = await self._get_updates(fields)
+        elif method == "setWebhook":
+            self.webhook_url = fields.get("url", "")
+            result = True
+        elif method == "deleteWebhook":
+            self.webhook_url = ""
+            result = True
+        elif method == "getWebhookInfo":
+            result = {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        elif method == "sendMessage":
+            result = self._message(fields, text=fields.get("text", ""))
+        elif method in ("editMessageText", "editMessageCaption", "editMessageReplyMarkup"):
+            result = self._message(fields, text=fields.get("text", ""))
+        elif method == "sendPhoto":
+            photo = self._file("photo")
+            result = self._message(fields, photo=[{**photo, "width": 1080, "height": 1080}])
+        elif method == "sendDocument":
+            result = self._message(fields, document=self._file("doc"))
+        else:
+            # answerCallbackQuery и остальные методы, возвращающие True
+            result = True
+        return json_response({"ok": True, "result": result})
+
+
+async def _serve(port: int):
+    def log_call(method, fields):
+        printable = {k: (f"<{len(v)} байт>" if isinstance(v, bytes) else v) for k, v in fields.items()}
+        print(f"{method} {json.dumps(printable, ensure_ascii=False)[:200]}")
+
+    api = FakeBotAPI(port=port, on_call=log_call)
+    await api.start()
+    print(f"Заглушка Bot API: BOT_API_BASE_URL={api.base_url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(_serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8081))
+    except KeyboardInterrupt:
+        pass
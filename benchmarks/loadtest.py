@@ -0,0 +1,437 @@
+"""
+Нагрузочный тест бота целиком: bot.py запускается отдельным процессом и работает
+с локальной заглушкой Bot API (fake_bot_api.py), N участников проходят квест:
+/start → join_quest → start_quest → шесть ответов (часть — с неполной расшифровкой эмодзи в задании 3).
+
+Для каждого шага считается задержка до первого ответа бота (p50/p95/p99), плюс общая пропускная способность.
+
+Записанный трафик (JSONL: {"t": секунды от начала, "update": {...}} или просто объект Update на строку)
+воспроизводится с --traffic. Если файл пуст или его нет, генерируется синтетический трафик
+и записывается в этот файл — следующий запуск воспроизведёт его же:
+    python benchmarks/loadtest.py --traffic requests.jsonl
+
+Запуск:
+    python benchmarks/loadtest.py [--users 200] [--ramp 10] [--mode polling|webhook] [--json]
+Переменные окружения бота (STORAGE_BACKEND, RATE_LIMIT_OVERALL, CONCURRENT_UPDATES, ...) передаются как есть.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.fake_bot_api import FakeBotAPI  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+BOT_TOKEN = "123456:LOADTEST"
+WEBHOOK_SECRET = "loadtest"
+FIRST_USER_ID = 10_000_000
+
+ANSWERS = [
+    "Я и Мария вместе любим pro ai",
+    "На митапе PRO AI я хочу узнать, как внедрять ИИ в работу",
+    "искусственный интеллект, машинное обучение, нейросеть, компьютерное зрение",
+    "Привет, Андрей! Рад был познакомиться",
+    "Иван умеет собирать кубик-рубик за минуту",
+    "Аугментация — это когда из имеющихся данных делают новые примеры для обучения",
+]
+# Неполная расшифровка эмодзи: бот просит досказать остальное
+WRONG_EMOJI_ANSWER = "искусственный интеллект и что-то про машины"
+
+# По этим фразам участник понимает, что пришло следующее задание или квест завершён
+NEXT_STEP_MARKER = re.compile(r"задание:\*|Квест пройден")
+STEP_TIMEOUT = 30
+
+
+def percentile(ordered: list, q: float) -> float:
+    """Перцентиль по ближайшему рангу из отсортированного списка"""
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Traffic:
+    """Создаёт обновления Telegram и при необходимости записывает их в JSONL"""
+
+    def __init__(self, record_path: Path | None = None):
+        self._update_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._started = time.monotonic()
+        self._record = open(record_path, "w", encoding="utf-8") if record_path else None
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Участник{user_id - FIRST_USER_ID}",
+                "username": f"load{user_id}"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        update_id = next(self._update_ids)
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        update_id = next(self._update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(next(self._callback_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+                            "text": "..."},
+            },
+        }
+
+    def record(self, update: dict) -> None:
+        if self._record is not None:
+            offset = round(time.monotonic() - self._started, 3)
+            self._record.write(json.dumps({"t": offset, "update": update}, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        if self._record is not None:
+            self._record.close()
+
+
+def load_traffic(path: Path) -> list:
+    """[(смещение в секундах, update)] из JSONL; пустой список, если файл пуст или отсутствует"""
+    if not path.exists():
+        return []
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if "update" in item:
+                records.append((float(item.get("t", 0)), item["update"]))
+            elif "update_id" in item:
+                records.append((0.0, item))
+    return records
+
+
+def step_name(update: dict) -> str:
+    if "callback_query" in update:
+        return update["callback_query"].get("data", "callback")
+    text = update.get("message", {}).get("text", "")
+    return text.split()[0] if text.startswith("/") else "text"
+
+
+def chat_of(update: dict) -> int | None:
+    if "callback_query" in update:
+        return update["callback_query"]["from"]["id"]
+    return update.get("message", {}).get("chat", {}).get("id")
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.api = FakeBotAPI(on_call=self._on_call)
+        self.bot_process = None
+        self.workdir = None
+        self.webhook_port = None
+        self.http = None
+        # chat_id -> очередь сообщений бота (время, текст) и ожидающие ответа шаги (имя, время отправки)
+        self.inboxes: dict[int, asyncio.Queue] = {}
+        self.pending: dict[int, deque] = {}
+        self.latencies: dict[str, list] = {}
+        self.timeouts: dict[str, int] = {}
+        self.updates_sent = 0
+        self.completed_users = 0
+        self.bot_ready = asyncio.Event()
+
+    # --- Заглушка Bot API ---
+
+    def _on_call(self, method: str, fields: dict) -> None:
+        if method == "getUpdates":
+            self.bot_ready.set()
+            return
+        if not method.startswith(("send", "edit")) or "chat_id" not in fields:
+            return
+        now = time.monotonic()
+        chat_id = int(fields["chat_id"])
+        pending = self.pending.get(chat_id)
+        if pending:
+            name, sent_at = pending.popleft()
+            self.latencies.setdefault(name, []).append(now - sent_at)
+        inbox = self.inboxes.get(chat_id)
+        if inbox is not None:
+            inbox.put_nowait((now, fields.get("text") or fields.get("caption") or ""))
+
+    async def deliver(self, update: dict, name: str) -> None:
+        chat_id = chat_of(update)
+        if chat_id is not None:
+            self.pending.setdefault(chat_id, deque()).append((name, time.monotonic()))
+        self.updates_sent += 1
+        if self.args.mode == "webhook":
+            response = await self.http.post(
+                f"http://127.0.0.1:{self.webhook_port}/webhook",
+                json=update,
+                headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET},
+            )
+            response.raise_for_status()
+        else:
+            self.api.push_update(update)
+
+    # --- Процесс бота ---
+
+    async def start_bot(self) -> None:
+        self.workdir = Path(tempfile.mkdtemp(prefix="quest-loadtest-"))
+        images = ROOT / "images"
+        if images.exists():
+            (self.workdir / "images").symlink_to(images, target_is_directory=True)
+
+        env = dict(os.environ)
+        env.update({
+            "BOT_TOKEN": BOT_TOKEN,
+            "BOT_API_BASE_URL": self.api.base_url,
+            "BOT_MODE": self.args.mode,
+            "WEBHOOK_URL": "",
+            "PYTHONUNBUFFERED": "1",
+        })
+        if self.args.mode == "webhook":
+            self.webhook_port = _free_port()
+            env.update({
+                "WEBHOOK_LISTEN": "127.0.0.1",
+                "WEBHOOK_PORT": str(self.webhook_port),
+                "WEBHOOK_PATH": "/webhook",
+                "WEBHOOK_SECRET_TOKEN": WEBHOOK_SECRET,
+            })
+        log = open(self.workdir / "bot.log", "wb")
+        self.bot_process = await asyncio.create_subprocess_exec(
+            sys.executable, str(ROOT / "bot.py"), cwd=self.workdir, env=env, stdout=log, stderr=log,
+        )
+        log.close()
+
+        if self.args.mode == "webhook":
+            await self._wait_health()
+        else:
+            await asyncio.wait_for(self.bot_ready.wait(), 30)
+
+    async def _wait_health(self) -> None:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.bot_process.returncode is not None:
+                break
+            try:
+                response = await self.http.get(f"http://127.0.0.1:{self.webhook_port}/healthz")
+                if response.status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError(f"Бот не запустился, см. {self.workdir / 'bot.log'}")
+
+    async def stop_bot(self) -> float:
+        """Останавливает бота по SIGTERM; возвращает время остановки (с сохранением данных)"""
+        if self.bot_process is None or self.bot_process.returncode is not None:
+            return 0.0
+        started = time.monotonic()
+        self.bot_process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(self.bot_process.wait(), 60)
+        except asyncio.TimeoutError:
+            self.bot_process.kill()
+        return time.monotonic() - started
+
+    # --- Участники ---
+
+    async def _step(self, traffic: Traffic, update: dict, name: str, inbox: asyncio.Queue,
+                    wait_next: bool = False) -> bool:
+        traffic.record(update)
+        await self.deliver(update, name)
+        try:
+            await asyncio.wait_for(inbox.get(), STEP_TIMEOUT)
+            if wait_next:
+                # Подтверждение пришло, дожидаемся следующего задания (бот шлёт его с паузой)
+                while True:
+                    _, text = await asyncio.wait_for(inbox.get(), STEP_TIMEOUT)
+                    if NEXT_STEP_MARKER.search(text):
+                        break
+        except asyncio.TimeoutError:
+            self.timeouts[name] = self.timeouts.get(name, 0) + 1
+            return False
+        if self.args.think:
+            await asyncio.sleep(random.uniform(0, self.args.think))
+        return True
+
+    async def run_user(self, traffic: Traffic, user_id: int, wrong_emoji: bool) -> None:
+        inbox = self.inboxes[user_id] = asyncio.Queue()
+        if not await self._step(traffic, traffic.message(user_id, "/start"), "/start", inbox):
+            return
+        for data in ("join_quest", "start_quest"):
+            if not await self._step(traffic, traffic.callback(user_id, data), data, inbox):
+                return
+        for index, answer in enumerate(ANSWERS):
+            if index == 2 and wrong_emoji:
+                if not await self._step(traffic, traffic.message(user_id, WRONG_EMOJI_ANSWER), "answer3_wrong", inbox):
+                    return
+            last = index == len(ANSWERS) - 1
+            update = traffic.message(user_id, answer)
+            if not await self._step(traffic, update, f"answer{index + 1}", inbox, wait_next=not last):
+                return
+        self.completed_users += 1
+
+    async def run_synthetic(self, record_path: Path | None) -> None:
+        traffic = Traffic(record_path)
+        try:
+            users = []
+            for n in range(self.args.users):
+                delay = self.args.ramp * n / max(1, self.args.users)
+                wrong_emoji = random.random() < self.args.wrong_emoji
+                users.append(self._delayed(delay, self.run_user(traffic, FIRST_USER_ID + n, wrong_emoji)))
+            await asyncio.gather(*users)
+        finally:
+            traffic.close()
+
+    async def run_replay(self, records: list) -> None:
+        started = time.monotonic()
+        chats = {chat_of(update) for _, update in records}
+        for chat_id in chats:
+            self.inboxes[chat_id] = asyncio.Queue()
+        for offset, update in sorted(records, key=lambda r: r[0]):
+            wait = started + offset - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.deliver(update, step_name(update))
+        # Даём боту ответить на последние обновления
+        deadline = time.monotonic() + STEP_TIMEOUT
+        while any(self.pending.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for queue in self.pending.values():
+            for name, _ in queue:
+                self.timeouts[name] = self.timeouts.get(name, 0) + 1
+        self.completed_users = None
+
+    @staticmethod
+    async def _delayed(delay: float, coroutine):
+        await asyncio.sleep(delay)
+        await coroutine
+
+    # --- Запуск и отчёт ---
+
+    async def run(self) -> dict:
+        self.http = httpx.AsyncClient(timeout=STEP_TIMEOUT)
+        await self.api.start()
+        records = []
+        record_path = None
+        if self.args.traffic:
+            records = load_traffic(self.args.traffic)
+            if not records:
+                print(f"{self.args.traffic}: трафика нет — генерируем синтетический и записываем туда")
+                record_path = self.args.traffic
+        try:
+            await self.start_bot()
+            started = time.monotonic()
+            if records:
+                await self.run_replay(records)
+            else:
+                await self.run_synthetic(record_path)
+            duration = time.monotonic() - started
+            shutdown = await self.stop_bot()
+        finally:
+            await self.stop_bot()
+            await self.http.aclose()
+            await self.api.stop()
+        return self.report(duration, shutdown)
+
+    def report(self, duration: float, shutdown: float) -> dict:
+        steps = {}
+        for name, samples in self.latencies.items():
+            ordered = sorted(samples)
+            steps[name] = {
+                "count": len(ordered),
+                "timeouts": self.timeouts.get(name, 0),
+                "p50_ms": round(percentile(ordered, 50) * 1000, 1),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 1),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 1),
+                "max_ms": round(ordered[-1] * 1000, 1),
+            }
+        for name, count in self.timeouts.items():
+            steps.setdefault(name, {"count": 0, "timeouts": count})
+        return {
+            "mode": self.args.mode,
+            "users": self.args.users if self.completed_users is not None else len(self.inboxes),
+            "completed_users": self.completed_users,
+            "duration_s": round(duration, 2),
+            "updates_sent": self.updates_sent,
+            "updates_per_s": round(self.updates_sent / duration, 1) if duration else 0,
+            "bot_api_calls": dict(self.api.calls),
+            "shutdown_s": round(shutdown, 2),
+            "steps": steps,
+            "workdir": str(self.workdir),
+        }
+
+
+def _free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def print_report(report: dict) -> None:
+    completed = report["completed_users"]
+    print(f"Режим: {report['mode']}, участников: {report['users']}"
+          + (f", прошли квест: {completed}" if completed is not None else ""))
+    print(f"Длительность: {report['duration_s']} с, обновлений: {report['updates_sent']} "
+          f"({report['updates_per_s']}/с), остановка бота: {report['shutdown_s']} с")
+    print(f"Вызовы Bot API: {report['bot_api_calls']}")
+    print()
+    print(f"{'шаг':<15}{'кол-во':>8}{'таймауты':>10}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for name, s in report["steps"].items():
+        print(f"{name:<15}{s['count']:>8}{s['timeouts']:>10}{s.get('p50_ms', '-'):>10}"
+              f"{s.get('p95_ms', '-'):>10}{s.get('p99_ms', '-'):>10}{s.get('max_ms', '-'):>10}")
+    if report.get("workdir"):
+        print(f"\nФайлы и лог бота: {report['workdir']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушкой Bot API")
+    parser.add_argument("--users", type=int, default=200, help="число участников")
+    parser.add_argument("--ramp", type=float, default=10, help="за сколько секунд подключаются все участники")
+    parser.add_argument("--think", type=float, default=0, help="пауза участника между шагами, до N секунд")
+    parser.add_argument("--wrong-emoji", type=float, default=0.5,
+                        help="доля участников, которые сначала расшифровывают эмодзи не полностью")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--traffic", type=Path, help="JSONL с записанным трафиком (пустой — записать)")
+    parser.add_argument("--keep", action="store_true", help="не удалять рабочий каталог бота")
+    parser.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(LoadTest(args).run())
+    failed = sum(s["timeouts"] for s in report["steps"].values())
+    # При таймаутах рабочий каталог оставляем — в нём лог бота
+    if not args.keep and not failed:
+        shutil.rmtree(report.pop("workdir"), ignore_errors=True)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
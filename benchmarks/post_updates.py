@@ -0,0 +1,59 @@
+"""
+Отправляет записанные обновления Telegram (JSON-объекты Update, по одному на строку)
+на вебхук бота — так вебхук проверяется локально, без Telegram.
+
+Запуск:
+    python benchmarks/post_updates.py updates.jsonl [http://127.0.0.1:8443/webhook] [секретный токен]
+"""
+import json
+import sys
+import urllib.error
+import urllib.request
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def post_update(url: str, update: dict, secret_token: str = "") -> int:
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update, ensure_ascii=False).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    if secret_token:
+        request.add_header(SECRET_TOKEN_HEADER, secret_token)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except urllib.error.URLError as e:
+        print(f"Не удалось подключиться к {url}: {e.reason}")
+        sys.exit(1)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(2)
+    path = sys.argv[1]
+    url = sys.argv[2] if len(sys.argv) > 2 else "http://127.0.0.1:8443/webhook"
+    secret_token = sys.argv[3] if len(sys.argv) > 3 else ""
+
+    sent = failed = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            status = post_update(url, json.loads(line), secret_token)
+            sent += 1
+            if status != 200:
+                failed += 1
+                print(f"Обновление {sent}: HTTP {status}")
+    print(f"Отправлено: {sent}, с ошибкой: {failed}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,54 @@
 import os
 import json
-import csv
 import re
 import asyncio
+import functools
 import logging
-from datetime import datetime
+import time
 from pathlib import Path
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
-from telegram.error import NetworkError, RetryAfter, TimedOut
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     ContextTypes,
+    TypeHandler,
     filters,
 )
+from telegram.request import BaseRequest, HTTPXRequest
 from dotenv import load_dotenv
 
-# Настройка логирования
+from answer_store import AnswerStore, answers_from_json
+from backlog import UpdateLedger, stamp as stamp_update
+from completion_log import CompletionLog
+from concurrency import PerUserUpdateProcessor
+from journal import UserDataJournal
+from matching import ConceptMatcher
+from media_cache import MediaCache, prepare_jpeg
+from metrics import Counter, Gauge, Histogram, MetricsServer, timed
+from outbound import PRIORITY_NAMES, PriorityRateLimiter, TimedRequest
+from outbox import Outbox
+from persistence import PersistenceStats, WriteBehindFlusher, atomic_write, parse_raffle_numbers, write_json_atomic
+from raffle_allocator import RaffleAllocator, RaffleNumbersExhausted, parse_ranges
+from raffle_table import RaffleTableWriter, raffle_row, to_cp1251_safe
+from records import (
+    Participant, ParticipantsJson, Progress, now_timestamp, participants_from_json, participants_to_json,
+    to_isoformat, to_timestamp,
+)
+from snapshot import Snapshot, write_snapshot
+from sqlite_storage import SQLiteStorage
+from state_cache import COMPLETED_STATE, UserStateCache
+from tracing import configure as configure_tracing, record as record_stage, stage, traced
+from webhook import run_webhook
+from workers import WORKER_INDEX_ENV, WorkerLink, run_router
+
+# Настройка логирования (у рабочих процессов при BOT_WORKERS > 1 — с номером процесса)
+_log_prefix = f"[worker {int(os.environ[WORKER_INDEX_ENV]) + 1}] " if WORKER_INDEX_ENV in os.environ else ""
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format=f'%(asctime)s - {_log_prefix}%(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
@@ -36,101 +64,421 @@ ADMIN_CHAT_IDS = [id.strip() for id in ADMIN_CHAT_IDS_STR.split(",") if id.strip
 # Ники админов: с @ или без (например: @admin1, admin2)
 ADMIN_USERNAMES_STR = os.getenv("ADMIN_USERNAMES", "")
 ADMIN_USERNAMES = [u.strip().lstrip("@").lower() for u in ADMIN_USERNAMES_STR.split(",") if u.strip()] if ADMIN_USERNAMES_STR else []
-
-# Состояния пользователей
-user_states = {}
+# Сколько обновлений разных пользователей обрабатывать одновременно (1 — строго по одному, как раньше)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+# Лимиты исходящих сообщений: всего в секунду и в один чат в секунду (0 — без ограничителя)
+RATE_LIMIT_OVERALL = float(os.getenv("RATE_LIMIT_OVERALL", "30"))
+RATE_LIMIT_PER_CHAT = float(os.getenv("RATE_LIMIT_PER_CHAT", "1"))
+# Сколько сообщений подряд можно отправить в чат без паузы и сколько раз повторять после RetryAfter.
+# На каждый ответ бот шлёт два сообщения (подтверждение и следующее задание через NEXT_QUESTION_DELAY):
+# запаса в 12 хватает, чтобы участник, отвечающий без пауз, прошёл все шесть заданий, не упираясь в лимит чата
+RATE_LIMIT_CHAT_BURST = float(os.getenv("RATE_LIMIT_CHAT_BURST", "12"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))
+
+# Способ получения обновлений: "polling" (getUpdates) или "webhook" (Telegram сам присылает POST-запросы)
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or os.getenv("PORT") or "8443")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token: запросы без него отклоняются
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+# Публичный адрес вебхука; если пуст, setWebhook не вызывается (вебхук зарегистрирован заранее или локальный тест)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Адрес Bot API вместо https://api.telegram.org/bot — для локального сервера Bot API или заглушки в тестах
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "")
+# false — после перезапуска обработать обновления, накопившиеся за время простоя (уже обработанные
+# до остановки пропускаются, см. backlog.py); true — выбросить их, как раньше
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "true").strip().lower() in ("1", "true", "yes")
+# Сколько процессов обрабатывают обновления (только с STORAGE_BACKEND=sqlite, см. workers.py):
+# главный процесс получает обновления и раздаёт их рабочим по user_id
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Порт страницы метрик GET /metrics (0 — выключена); у рабочих процессов — METRICS_PORT + номер рабочего - 1
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+# Обновления, обработанные дольше стольких миллисекунд, пишутся в лог с разбивкой по этапам (0 — без трассировки)
+TRACE_SLOW_UPDATE_MS = float(os.getenv("TRACE_SLOW_UPDATE_MS", "0"))
+configure_tracing(TRACE_SLOW_UPDATE_MS)
+# Сколько состояний участников держать в памяти и через сколько секунд тишины их забывать
+# (0 — не забывать); забытое состояние восстанавливается из user_data при следующем сообщении
+USER_STATE_CACHE_SIZE = int(os.getenv("USER_STATE_CACHE_SIZE", "10000"))
+USER_STATE_TTL = float(os.getenv("USER_STATE_TTL", "1800"))
+
+# Состояния пользователей: заполняются лениво, при первом сообщении после запуска (см. get_user_state)
+user_states = UserStateCache(USER_STATE_CACHE_SIZE, USER_STATE_TTL)
 
 # Файл для сохранения данных пользователей
 DATA_FILE = Path("user_data.json")
 RAFFLE_NUMBERS_FILE = Path("raffle_numbers.json")
 HELP_REQUESTS_FILE = Path("help_requests.json")
 QUEST_FINISHED_FILE = Path("quest_finished.json")
+PENDING_QUESTIONS_FILE = Path("pending_questions.json")
+JOURNAL_FILE = Path("user_data.journal")
+SNAPSHOT_FILE = Path("user_data.snapshot")
+COMPLETION_LOG_FILE = Path("completions.log")
+# Последние обработанные обновления участников (в режиме sqlite — в базе)
+SQLITE_DB_FILE = Path(os.getenv("SQLITE_DB_FILE", "quest.db"))
+# Тексты ответов (в режиме sqlite — в той же базе SQLITE_DB_FILE)
+ANSWERS_DB_FILE = Path(os.getenv("ANSWERS_DB_FILE", "answers.db"))
+# Исходящие сообщения до подтверждения Telegram (в режиме sqlite — в той же базе SQLITE_DB_FILE)
+OUTBOX_DB_FILE = Path(os.getenv("OUTBOX_DB_FILE", "outbox.db"))
+
+# Способ хранения данных:
+# "json" — user_data.json перезаписывается целиком после каждого изменения,
+# "journal" — изменения дописываются в журнал, снимок обновляется раз в JOURNAL_COMPACT_EVERY событий,
+# "snapshot" — как json, но в двоичный user_data.snapshot: при запуске читается только индекс,
+#              время ответов — когда понадобится (быстрый перезапуск во время мероприятия),
+# "sqlite" — все данные в базе SQLITE_DB_FILE, каждое изменение — отдельная маленькая транзакция
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").strip().lower()
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", "500"))
+# Диапазоны номеров розыгрыша ("1-1000,2001-2500") и случайная (не по порядку) выдача номеров
+RAFFLE_NUMBER_RANGES = os.getenv("RAFFLE_NUMBER_RANGES", "1-1000")
+RAFFLE_NUMBERS_RANDOM = os.getenv("RAFFLE_NUMBERS_RANDOM", "").strip().lower() in ("1", "true", "yes")
+# Интервал фоновой записи файлов в секундах; 0 — писать сразу в обработчике
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", "1.0"))
+
+# Таблица участников розыгрыша для организаторов
+RAFFLE_TABLE_TXT = Path("raffle_table.txt")
+RAFFLE_TABLE_CSV = Path("raffle_table.csv")
+
+# Пауза перед отправкой следующего задания, секунд
+NEXT_QUESTION_DELAY = 1
 
 # Пути к изображениям
 IMAGES_DIR = Path("images")
 WELCOME_IMAGE = IMAGES_DIR / "welcome.png"
-
-# Загружаем существующие данные
-if DATA_FILE.exists():
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        user_data = json.load(f)
-else:
-    user_data = {}
-
-# Загружаем запросы на помощь
-if HELP_REQUESTS_FILE.exists():
-    with open(HELP_REQUESTS_FILE, "r", encoding="utf-8") as f:
-        help_requests = json.load(f)
+# file_id уже загруженных картинок, чтобы не загружать их заново на каждый /start
+MEDIA_CACHE_FILE = Path("media_cache.json")
+# Конвертировать приветственную картинку в JPEG при запуске (нужен Pillow)
+WELCOME_IMAGE_JPEG = os.getenv("WELCOME_IMAGE_JPEG", "").strip().lower() in ("1", "true", "yes")
+
+storage = None
+journal = None
+# Куда пишутся тексты ответов: в памяти бота их нет, читают их только выгрузки
+answer_store = None
+# Журнал завершений квеста для хранения в файлах (в режиме sqlite завершение — одна транзакция)
+completion_log = None
+# Связь с главным процессом, если это рабочий процесс (BOT_WORKERS > 1), иначе None
+worker_link = WorkerLink.from_env()
+# Главный процесс при BOT_WORKERS > 1 только раздаёт обновления, участники ему не нужны
+IS_ROUTER = BOT_WORKERS > 1 and worker_link is None and STORAGE_BACKEND == "sqlite"
+# Время загрузки данных пишется в лог: пока оно идёт, бот не отвечает
+_load_started = time.perf_counter()
+# Снимок нужно записать сразу: данные перенесены из JSON или из снимка в другой формат
+_migrate_user_data = False
+
+if STORAGE_BACKEND == "sqlite":
+    storage = SQLiteStorage(SQLITE_DB_FILE)
+    # Первый запуск с SQLite — переносим данные из JSON-файлов
+    if worker_link is None and storage.is_empty() and DATA_FILE.exists():
+        counts = storage.migrate_from_json(
+            DATA_FILE, RAFFLE_NUMBERS_FILE, HELP_REQUESTS_FILE, QUEST_FINISHED_FILE,
+            journal_file=JOURNAL_FILE, answers_db_file=ANSWERS_DB_FILE,
+        )
+        logger.info(f"Данные перенесены из JSON в {SQLITE_DB_FILE}: {counts}")
+    # Рабочий процесс загружает только своих участников: их обновления приходят только к нему
+    shard = worker_link.shard if worker_link is not None else None
+    user_data = {} if IS_ROUTER else participants_from_json(storage.load_user_data(shard))
+    answer_store = storage
+    help_requests = storage.load_help_requests()
+    raffle_numbers, raffle_allocator_state = storage.load_raffle_numbers()
+    quest_finished = storage.load_quest_finished()
+    pending_questions = {} if IS_ROUTER else storage.load_pending_questions(shard)
 else:
-    help_requests = []
-
-# Загружаем существующие номера розыгрыша
-if RAFFLE_NUMBERS_FILE.exists():
-    with open(RAFFLE_NUMBERS_FILE, "r", encoding="utf-8") as f:
-        raffle_data = json.load(f)
-        # Проверяем формат файла (старый или новый)
-        if isinstance(raffle_data, dict) and "numbers" in raffle_data:
-            # Новый формат
-            raffle_numbers = raffle_data.get("numbers", {})
-            next_raffle_number = raffle_data.get("next_number", 1)
+    answer_store = AnswerStore(ANSWERS_DB_FILE)
+    completion_log = CompletionLog(COMPLETION_LOG_FILE)
+    # Тексты ответов, которые ещё лежат в старых файлах, переносятся в answers.db
+    imported_answers = 0
+
+    # Берём более свежий из user_data.json и двоичного снимка (режим хранения мог смениться)
+    snapshot_is_newest = SNAPSHOT_FILE.exists() and (
+        not DATA_FILE.exists() or SNAPSHOT_FILE.stat().st_mtime_ns >= DATA_FILE.stat().st_mtime_ns
+    )
+    snapshot = None
+    if snapshot_is_newest:
+        snapshot = Snapshot(SNAPSHOT_FILE)
+        imported_answers += answer_store.import_answers(snapshot.legacy_answers())
+    if STORAGE_BACKEND == "snapshot" and snapshot_is_newest and not JOURNAL_FILE.exists():
+        user_data = snapshot.participants()
+    else:
+        # Загружаем существующие данные
+        if snapshot_is_newest:
+            user_data_json = participants_to_json(snapshot.participants())
+        elif DATA_FILE.exists():
+            with open(DATA_FILE, "r", encoding="utf-8") as f:
+                user_data_json = json.load(f)
         else:
-            # Старый формат - конвертируем
-            raffle_numbers = raffle_data
-            # Вычисляем следующий номер на основе максимального существующего
-            if raffle_numbers:
-                max_number = max(raffle_numbers.values())
-                next_raffle_number = max_number + 1 if max_number < 1000 else 1001
-            else:
-                next_raffle_number = 1
-else:
-    raffle_numbers = {}
-    next_raffle_number = 1
-
-# Загружаем флаг завершения квеста
-if QUEST_FINISHED_FILE.exists():
-    with open(QUEST_FINISHED_FILE, "r", encoding="utf-8") as f:
-        quest_finished_data = json.load(f)
-        quest_finished = quest_finished_data.get("finished", False)
-else:
-    quest_finished = False
+            user_data_json = {}
+
+        # Накатываем хвост журнала поверх снимка (в т.ч. если режим journal был включён раньше)
+        if STORAGE_BACKEND == "journal" or JOURNAL_FILE.exists():
+            journal = UserDataJournal(JOURNAL_FILE, DATA_FILE, compact_every=JOURNAL_COMPACT_EVERY)
+            replayed = journal.replay(user_data_json)
+            if replayed:
+                logger.info(f"Из журнала восстановлено событий: {replayed}")
+            if STORAGE_BACKEND != "journal":
+                # Режим журнала выключен — сворачиваем остаток в снимок и дальше пишем как раньше
+                journal.compact(user_data_json)
+                journal = None
+
+        imported_answers += answer_store.import_answers(answers_from_json(user_data_json))
+
+        # В памяти — компактные записи по числовому user_id, в файлах — прежний JSON
+        user_data = participants_from_json(user_data_json)
+        del user_data_json
+        _migrate_user_data = STORAGE_BACKEND == "snapshot" or snapshot_is_newest
+    del snapshot
+
+    if imported_answers:
+        logger.info(f"Тексты ответов перенесены в {ANSWERS_DB_FILE}: {imported_answers}")
+        # Файлы переписываются без текстов
+        _migrate_user_data = True
+
+    # Загружаем запросы на помощь
+    if HELP_REQUESTS_FILE.exists():
+        with open(HELP_REQUESTS_FILE, "r", encoding="utf-8") as f:
+            help_requests = json.load(f)
+    else:
+        help_requests = []
 
+    # Загружаем существующие номера розыгрыша (старый формат файла конвертируется)
+    if RAFFLE_NUMBERS_FILE.exists():
+        with open(RAFFLE_NUMBERS_FILE, "r", encoding="utf-8") as f:
+            raffle_numbers, raffle_allocator_state = parse_raffle_numbers(json.load(f))
+    else:
+        raffle_numbers = {}
+        raffle_allocator_state = None
+
+    # Загружаем флаг завершения квеста
+    if QUEST_FINISHED_FILE.exists():
+        with open(QUEST_FINISHED_FILE, "r", encoding="utf-8") as f:
+            quest_finished_data = json.load(f)
+            quest_finished = quest_finished_data.get("finished", False)
+    else:
+        quest_finished = False
+
+    # Загружаем задания, которые были запланированы к отправке, но не успели уйти до перезапуска
+    if PENDING_QUESTIONS_FILE.exists():
+        with open(PENDING_QUESTIONS_FILE, "r", encoding="utf-8") as f:
+            pending_questions = json.load(f)
+    else:
+        pending_questions = {}
 
+# Какие обновления были обработаны до перезапуска — по отметкам в записях участников
+update_ledger = UpdateLedger(user_data)
+# user_data.json (и снимок журнала) пересобирается из кэша: заново сериализуются только изменённые записи
+participants_json = ParticipantsJson(user_data)
+
+# Свободные и выданные номера розыгрыша; выданные номера занимаются заново в reconcile_completions
+raffle_allocator = RaffleAllocator.from_json(
+    raffle_allocator_state, parse_ranges(RAFFLE_NUMBER_RANGES), randomize=RAFFLE_NUMBERS_RANDOM
+)
+del raffle_allocator_state
+
+# Метрики (см. metrics.py): задержки обработчиков, сохранения данных и запросов к Bot API
+HANDLER_SECONDS = Histogram("quest_handler_duration_seconds", "Время работы обработчика", ["handler"])
+PERSISTENCE_SECONDS = Histogram(
+    "quest_persistence_duration_seconds", "Сколько обработчик ждёт сохранения данных", ["call"]
+)
+FILE_WRITE_SECONDS = Histogram(
+    "quest_file_write_duration_seconds", "Запись файла с данными (в том числе фоновая)", ["file"]
+)
+TELEGRAM_REQUEST_SECONDS = Histogram(
+    "quest_telegram_request_duration_seconds", "Запрос к Bot API (кроме getUpdates)", ["method"]
+)
+TELEGRAM_ERRORS = Counter("quest_telegram_errors_total", "Ошибки запросов к Bot API по типу", ["type"])
+UPDATES = Counter("quest_updates_total", "Полученные обновления", ["type"])
+UPDATE_ERRORS = Counter("quest_update_errors_total", "Ошибки в обработчиках по типу", ["type"])
+ACTIVE_USERS = Gauge(
+    "quest_active_users", "Пользователи, чьи обновления обрабатываются или ждут в очереди (CONCURRENT_UPDATES > 1)"
+)
+USER_STATES = Gauge("quest_user_states", "Состояния участников в памяти")
+OUTBOX_PENDING = Gauge("quest_outbox_pending", "Сообщения в outbox, которые ждут отправки")
+OUTBOUND_QUEUE_DEPTH = Gauge(
+    "quest_outbound_queue_depth", "Запросы к Bot API в очереди ограничителя по приоритету", ["priority"]
+)
+OUTBOUND_WAIT_SECONDS = Histogram(
+    "quest_outbound_wait_seconds", "Ожидание разрешения ограничителя по приоритету", ["priority"]
+)
+metrics_server = None
+
+# Фоновая запись файлов и замеры того, сколько обработчики ждут сохранения
+persistence_stats = PersistenceStats(on_write=lambda name, seconds: FILE_WRITE_SECONDS.labels(name).observe(seconds))
+flusher = WriteBehindFlusher(PERSISTENCE_FLUSH_INTERVAL, persistence_stats)
+raffle_table = RaffleTableWriter(RAFFLE_TABLE_TXT, RAFFLE_TABLE_CSV)
+media_cache = MediaCache(MEDIA_CACHE_FILE)
+# Файл, который отправляется как приветственное фото (может замениться на JPEG в main)
+welcome_photo = WELCOME_IMAGE
+# Пока первая загрузка файла не завершилась, остальные /start ждут её file_id
+_media_upload_locks: dict[str, asyncio.Lock] = {}
+
+
+def _persist(name: str, writer):
+    """Записывает файл сразу или помечает его для фоновой записи, если она запущена"""
+    started = time.perf_counter()
+    if flusher.running:
+        flusher.mark_dirty(name, writer)
+    else:
+        writer()
+        persistence_stats.observe_write(name, time.perf_counter() - started)
+    persistence_stats.observe_wait(name, time.perf_counter() - started)
+
+
+def _write_quest_finished():
+    write_json_atomic(QUEST_FINISHED_FILE, {"finished": quest_finished})
+
+
+@timed(PERSISTENCE_SECONDS, "save_quest_finished")
 def save_quest_finished():
     """Сохраняет флаг завершения квеста"""
-    with open(QUEST_FINISHED_FILE, "w", encoding="utf-8") as f:
-        json.dump({"finished": quest_finished}, f, ensure_ascii=False, indent=2)
+    if storage is not None:
+        storage.set_meta("quest_finished", quest_finished)
+        return
+    _persist("quest_finished", _write_quest_finished)
 
 
-def restore_user_states():
-    """Восстанавливает состояния пользователей из сохранённых данных после перезапуска бота"""
-    for user_id_str, data in user_data.items():
-        user_id = int(user_id_str)
-        
-        # Пропускаем, если квест завершён
-        if data.get("raffle_number"):
-            user_states[user_id] = {
-                "stage": "completed",
-                "current_question": len(QUESTIONS),
-                "answers": data.get("answers", {}),
-                "raffle_number": data.get("raffle_number")
-            }
-            continue
-        
-        # Если пользователь начал квест (есть started_at)
-        if data.get("started_at"):
-            answers = data.get("answers", {})
-            current_question_index = len(answers)
-            
-            # Если все вопросы отвечены, но квест не завершён - завершаем
-            if current_question_index >= len(QUESTIONS):
+@timed(PERSISTENCE_SECONDS, "save_pending_question")
+def save_pending_question(user_id: int):
+    """Сохраняет задание, запланированное к отправке участнику, или снятие отметки (в файле — все задания)"""
+    if storage is not None:
+        storage.save_pending_question(user_id, pending_questions.get(str(user_id)))
+        return
+    _persist("pending_questions", lambda: write_json_atomic(PENDING_QUESTIONS_FILE, pending_questions))
+
+
+def _participant_changed(user_id: int) -> Participant:
+    """Перед сохранением изменённой записи: отметка об обновлении (backlog.stamp) и пометка для user_data.json"""
+    participant = user_data[user_id]
+    stamp_update(participant)
+    participants_json.mark_dirty(user_id)
+    return participant
+
+
+def _last_update(participant: Participant) -> tuple[int, str] | None:
+    """Отметка об обработанном обновлении для записи в базу или журнал (None — отметки нет)"""
+    if participant.last_update_id is None:
+        return None
+    return participant.last_update_id, to_isoformat(participant.last_update_at)
+
+
+def _journal_update_fields(participant: Participant) -> dict:
+    last_update = _last_update(participant)
+    if last_update is None:
+        return {}
+    return {"last_update_id": last_update[0], "last_update_at": last_update[1]}
+
+
+@timed(PERSISTENCE_SECONDS, "persist_last_update")
+def persist_last_update(participant: Participant):
+    """
+    Сохраняет отметку об обновлении, которое данные участника не изменило. В журнал она отдельно
+    не пишется: попадёт в снимок или в следующее событие участника
+    """
+    participants_json.mark_dirty(participant.user_id)
+    if storage is not None:
+        storage.save_last_update(participant.user_id, _last_update(participant))
+    elif journal is None:
+        save_user_data()
+
+
+def _state_from_data(participant: Participant | None) -> Progress | None:
+    """Состояние участника по сохранённым данным; None, если квест не начат"""
+    if participant is None:
+        return None
+    if participant.raffle_number:
+        return COMPLETED_STATE
+    if participant.stage is not None:
+        # Приветствие или условия квеста: задания ещё не показаны
+        return Progress(participant.stage)
+    if participant.started_at:
+        current_question_index = participant.answer_count
+        # Если все вопросы отвечены, но квест не завершён — состояния нет
+        if current_question_index < len(QUESTIONS):
+            # Пользователь ждёт ответа на текущий вопрос
+            return Progress("answering", current_question_index)
+    return None
+
+
+def get_user_state(user_id: int) -> Progress | None:
+    """Состояние участника из кэша, а если его там нет — восстановленное из сохранённых данных"""
+    state = user_states.get(user_id)
+    if state is None:
+        state = _state_from_data(user_data.get(user_id))
+        if state is not None:
+            user_states[user_id] = state
+    return state
+
+
+def reconcile_completions() -> int:
+    """
+    Сверяет номера розыгрыша при запуске, после возможной аварийной остановки:
+    накатывает журнал завершений на user_data, дополняет raffle_numbers номерами из user_data
+    (и наоборот — номер, записанный только в raffle_numbers прежними версиями, уже выдан)
+    и занимает все выданные номера в raffle_allocator. Возвращает число исправлений.
+    """
+    fixed = 0
+
+    if completion_log is not None:
+        for entry in completion_log.read():
+            participant = user_data.get(entry["user_id"])
+            if participant is None:
+                # Записи участника нет (например, user_data восстановлен из старой копии), но номер
+                # уже выдан и сообщён — он остаётся за пользователем и не должен достаться другому
+                logger.warning(
+                    f"Журнал завершений: пользователя {entry['user_id']} нет в user_data, "
+                    f"номер {entry['raffle_number']} остаётся занятым"
+                )
+                if raffle_numbers.get(str(entry["user_id"])) != entry["raffle_number"]:
+                    raffle_numbers[str(entry["user_id"])] = entry["raffle_number"]
+                    fixed += 1
                 continue
-            
-            # Восстанавливаем состояние: пользователь ждёт ответа на текущий вопрос
-            user_states[user_id] = {
-                "stage": "answering",
-                "current_question": current_question_index,
-                "answers": answers
-            }
+            if participant.raffle_number != entry["raffle_number"]:
+                participant.raffle_number = entry["raffle_number"]
+                participant.completed_at = to_timestamp(entry["completed_at"])
+                fixed += 1
+
+    for user_id_str, number in raffle_numbers.items():
+        participant = user_data.get(int(user_id_str))
+        if participant is not None and participant.raffle_number is None:
+            participant.raffle_number = number
+            fixed += 1
+    for user_id, participant in user_data.items():
+        if participant.raffle_number is not None and raffle_numbers.get(str(user_id)) != participant.raffle_number:
+            raffle_numbers[str(user_id)] = participant.raffle_number
+            fixed += 1
+
+    # Карта занятых номеров могла не успеть записаться (или её ещё нет) — выданные номера главнее
+    outside = 0
+    for number in raffle_numbers.values():
+        if number in raffle_allocator:
+            raffle_allocator.reserve(number)
+        else:
+            outside += 1
+    if outside:
+        logger.warning(f"Выданных номеров розыгрыша вне диапазонов {RAFFLE_NUMBER_RANGES}: {outside}")
+    if len(set(raffle_numbers.values())) != len(raffle_numbers):
+        logger.error("В raffle_numbers есть повторяющиеся номера розыгрыша — проверьте таблицу вручную")
+
+    if fixed:
+        logger.info(f"Номера розыгрыша сверены после перезапуска, исправлений: {fixed}")
+    return fixed
+
+
+def restore_user_states():
+    """
+    Подготовка после перезапуска бота. Сами состояния не строятся заранее
+    (их восстанавливает get_user_state при первом сообщении), проверяются только
+    запланированные задания: отправка имеет смысл, только если пользователь всё ещё ждёт это задание
+    (сама отправка планируется заново при запуске бота, см. reschedule_pending_questions)
+    """
+    user_states.clear()
+    for user_id_str, pending in list(pending_questions.items()):
+        state = _state_from_data(user_data.get(int(user_id_str)))
+        if not state or state.stage != "answering" or state.current_question != pending["question"]:
+            del pending_questions[user_id_str]
+            # В базе задания лежат по участникам: снятую отметку удаляем сразу
+            # (файл перепишется целиком при следующем сохранении)
+            if storage is not None:
+                save_pending_question(int(user_id_str))
 
 
 # Определение заданий
@@ -167,6 +515,29 @@ QUESTIONS = [
             "Порядок ответов не важен.\n"
         ),
         "keywords": ["искусственный", "интеллект", "машинное", "обучение", "нейросеть", "нейрон", "компьютерное", "зрение", "vision"],
+        # Ключ ответов: эмодзи -> варианты написания понятия (см. check_emoji_answer)
+        "concepts": {
+            "🤖🧠": [
+                "искусственный интеллект", "ии", "ai", "artificial intelligence",
+                "искусственныйинтеллект"
+            ],
+            "🚗📖": [
+                "машинное обучение", "ml", "machine learning",
+                "машинноеобучение", "мл"
+            ],
+            "🧠📶": [
+                "нейросеть", "нейронная сеть", "neural network", "nn",
+                "нейросети", "нейронные сети"
+            ],
+            "🖥️👁️": [
+                "компьютерное зрение", "cv", "computer vision",
+                "компьютерноезрение"
+            ]
+        },
+        # В скольких словах варианта прощать опечатку (короткие варианты вроде "ии" — только точно).
+        # Сколько правок допустимо в одном слове, можно задать для понятия в "max_distance": {понятие: число};
+        # без него — одна правка по правилам matching.typo_allowed (зависят от длины слова)
+        "max_typos": {"🤖🧠": 2, "🚗📖": 2, "🧠📶": 2, "🖥️👁️": 2},
         "correct_answer": (
             "Правильные ответы на 3 задание:\n"
             "🤖🧠 - искусственный интеллект\n"
@@ -183,6 +554,11 @@ QUESTIONS = [
             "Напиши свое послание."
         ),
         "keywords": ["привет", "здравствуй", "приветствую"],
+        # Проверка в validate_answer: в ответе должно быть приветствие (с опечаткой — тоже)
+        "concepts": {
+            "приветствие": ["привет", "здравствуй", "приветствую", "здравствуйте", "hi", "hello"],
+        },
+        "max_typos": {"приветствие": 1},
     },
     {
         "number": 5,
@@ -206,123 +582,280 @@ QUESTIONS = [
     },
 ]
 
-# Восстанавливаем состояния пользователей после загрузки данных и определения заданий
+# Ключи ответов заданий компилируются один раз при запуске: индекс задания -> ConceptMatcher
+ANSWER_MATCHERS = {
+    index: ConceptMatcher(question["concepts"], question.get("max_typos", 0), question.get("max_distance"))
+    for index, question in enumerate(QUESTIONS)
+    if "concepts" in question
+}
+
+# Сверяем номера розыгрыша (файлы будут переписаны в main), затем проверяем отложенные задания
+_recovered_completions = reconcile_completions()
 restore_user_states()
+logger.info(
+    f"Данные участников загружены за {(time.perf_counter() - _load_started) * 1000:.0f} мс: "
+    f"{len(user_data)} участников, хранение {STORAGE_BACKEND}"
+)
+if not DROP_PENDING_UPDATES and update_ledger.last_update_id is not None:
+    logger.info(
+        f"Обновления, накопившиеся за перезапуск, будут обработаны; последнее обработанное: "
+        f"{update_ledger.last_update_id}"
+    )
+
+
+# Специальные символы MarkdownV2 экранируются за один проход, поэтому уже вставленные
+# обратные слэши повторно не экранируются (str.translate с кириллицей заметно медленнее)
+_MARKDOWN_V2_SPECIAL = re.compile(r"[\\_*\[\]()~`>#+\-=|{}.!:,]")
 
 
 def escape_markdown_v2(text: str) -> str:
     """Экранирует специальные символы для MarkdownV2"""
-    # Важно: экранируем в правильном порядке, чтобы не экранировать уже экранированные символы
-    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!', ':', ',']
-    for char in special_chars:
-        text = text.replace(char, f'\\{char}')
-    return text
+    return _MARKDOWN_V2_SPECIAL.sub(r"\\\g<0>", text)
 
 
-def to_cp1251_safe(text: str) -> str:
-    """
-    Преобразует строку в вид, безопасный для сохранения в cp1251:
-    все неподдерживаемые символы (эмодзи и пр.) заменяются на '?'.
-    """
-    try:
-        return text.encode("cp1251", errors="replace").decode("cp1251")
-    except Exception:
-        # Запасной вариант: выкидываем неподдерживаемые символы
-        return text.encode("cp1251", errors="ignore").decode("cp1251")
+# Готовые тексты и клавиатуры: статичные части сообщений экранируются один раз при запуске,
+# обработчики подставляют только имя участника и номер для розыгрыша
+WELCOME_TEMPLATE = (
+    "*Привет, {username}*\\!\n\n"
+    "*Рады видеть тебя на Большом митапе PRO AI\\!*\n\n"
+    "Для участия в розыгрыше призов присоединяйся к квесту\\. "
+    "Это займет всего несколько минут, и ты сможешь выиграть крутые призы\\!"
+)
+WELCOME_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Присоединиться к квесту", callback_data="join_quest")]
+])
+
+QUEST_INFO_TEXT = (
+    "*Что нужно сделать:*\n\n"
+    "• Выполнить *6 заданий* в боте\n"
+    "• Успеть до *17:30*\n"
+    "• В конце квеста ты получишь *номер для участия в розыгрыше*\n\n"
+    "Задания нетрудные: предстоит приятный нетворкинг и пару интересных задачек\\!\n\n"
+    "*Готов начать?*"
+)
+QUEST_INFO_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Приступить к заданию 1", callback_data="start_quest")]
+])
+
+QUEST_IN_PROGRESS_TEXT = (
+    "*Вы уже начали проходить квест\\.*\n\n"
+    "Продолжайте выполнять задания\\."
+)
+# /start посреди квеста: напоминание с текущим заданием, по одному на задание
+QUEST_RESUME_TEXTS = [
+    "*Вы уже начали проходить квест\\.*\n\n"
+    f"Текущее задание:\n\n{escape_markdown_v2(question['text'])}\n\n"
+    "Продолжайте выполнять задания\\."
+    for question in QUESTIONS
+]
+ANSWER_ACCEPTED_TEXTS = [
+    f"*Отлично\\!* Ответ на задание *{index + 1}* зафиксирован\\.\n\n"
+    "Переходим дальше\\.\\.\\."
+    for index in range(len(QUESTIONS))
+]
+
+COMPLETION_TEMPLATE = (
+    "*Квест пройден, поздравляем\\!*\n\n"
+    "*Твой номер для розыгрыша: {raffle_number}*\n\n"
+    "Сохрани этот номер\\! Он понадобится для участия в розыгрыше призов\\.\n\n"
+    "Розыгрыш состоится в *18:00* на основной сцене\\.\n\n"
+    "Жди объявления результатов\\! Удачи\\!"
+)
+ALREADY_COMPLETED_TEMPLATE = (
+    "*Вы уже завершили квест\\!*\n\n"
+    "Ваш номер для розыгрыша: *{raffle_number}*"
+)
+ACCESS_DENIED_TEXT = "Доступ запрещен\\. Эта команда доступна только организаторам\\."
+RAFFLE_EXHAUSTED_TEXT = (
+    "*Все задания выполнены\\!*\n\n"
+    "Но номера для розыгрыша закончились\\. Подойди к организаторам, "
+    "а потом пришли ответ на последнее задание ещё раз\\."
+)
+
+
+@functools.lru_cache(maxsize=64)
+def render_validation_error(error_message: str) -> str:
+    """Сообщение о непринятом ответе; текстов ошибок немного, каждый экранируется один раз"""
+    return f"{escape_markdown_v2(error_message)}\n\nПопробуйте еще раз\\!"
 
 
+def _write_user_data():
+    # Завершения, записанные в журнал до этого момента, уже есть в user_data, который сейчас запишется
+    if completion_log is not None:
+        completion_log.rotate()
+    if journal is not None:
+        # Снимок журнала: заодно удаляет отложенный сегмент
+        journal.write_snapshot(participants_json.dumps())
+    elif STORAGE_BACKEND == "snapshot":
+        write_snapshot(SNAPSHOT_FILE, user_data)
+    else:
+        write_json_atomic(DATA_FILE, participants_json.dumps())
+    if completion_log is not None:
+        completion_log.drop_rotated()
+
+
+@timed(PERSISTENCE_SECONDS, "save_user_data")
 def save_user_data():
     """Сохраняет данные пользователей в файл"""
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(user_data, f, ensure_ascii=False, indent=2)
+    _persist("user_data", _write_user_data)
+
+
+def _journal_event(event: dict, durable: bool = False):
+    """Дописывает событие в журнал и при необходимости сворачивает его в снимок"""
+    journal.append(event, durable=durable)
+    if journal.needs_compaction and journal.rotate():
+        save_user_data()
+
+
+@timed(PERSISTENCE_SECONDS, "persist_user_started")
+def persist_user_started(user_id: int):
+    """Сохраняет новую запись участника (после /start)"""
+    _participant_changed(user_id)
+    if storage is not None:
+        storage.save_participant(user_id, user_data[user_id].to_json())
+        return
+    if journal is None:
+        save_user_data()
+        return
+    _journal_event({"op": "start", "user_id": str(user_id), "record": user_data[user_id].to_json()})
+
+
+@timed(PERSISTENCE_SECONDS, "persist_stage")
+def persist_stage(user_id: int):
+    """Сохраняет этап участника до первого задания (Participant.stage)"""
+    participant = _participant_changed(user_id)
+    if storage is not None:
+        storage.save_stage(user_id, participant.stage, _last_update(participant))
+        return
+    if journal is None:
+        save_user_data()
+        return
+    _journal_event({
+        "op": "stage", "user_id": str(user_id), "stage": participant.stage, **_journal_update_fields(participant)
+    })
+
+
+@timed(PERSISTENCE_SECONDS, "persist_answer")
+def persist_answer(user_id: int, question_index: int, text: str):
+    """Сохраняет ответ участника на задание: текст — сразу в answer_store, время — вместе с user_data"""
+    participant = _participant_changed(user_id)
+    timestamp = to_isoformat(participant.answered_at[question_index])
+    if storage is not None:
+        storage.save_answer(user_id, question_index, text, timestamp, _last_update(participant))
+        return
+    answer_store.save_answer(user_id, question_index, text, timestamp)
+    if journal is None:
+        save_user_data()
+        return
+    _journal_event({
+        "op": "answer",
+        "user_id": str(user_id),
+        "index": question_index,
+        "timestamp": timestamp,
+        **_journal_update_fields(participant)
+    })
 
 
+@timed(PERSISTENCE_SECONDS, "commit_completion")
+def commit_completion(user_id: int):
+    """
+    Фиксирует завершение квеста одной записью с fsync (в режиме sqlite — одной транзакцией):
+    номер розыгрыша, запись участника и строка таблицы восстанавливаются из неё при запуске
+    (reconcile_completions). Полные файлы — user_data, raffle_numbers.json, таблица — пишутся следом, в фоне.
+    """
+    participant = _participant_changed(user_id)
+    completed_at = to_isoformat(participant.completed_at)
+    if storage is not None:
+        storage.save_completion(user_id, participant.raffle_number, completed_at, _last_update(participant))
+    else:
+        if journal is not None:
+            _journal_event({
+                "op": "complete",
+                "user_id": str(user_id),
+                "raffle_number": participant.raffle_number,
+                "completed_at": completed_at,
+                **_journal_update_fields(participant)
+            }, durable=True)
+        else:
+            completion_log.append(user_id, participant.raffle_number, completed_at)
+            save_user_data()
+        save_raffle_numbers()
+    save_raffle_table(user_id)
+
+
+@timed(PERSISTENCE_SECONDS, "save_help_requests")
 def save_help_requests():
     """Сохраняет запросы на помощь в файл"""
-    with open(HELP_REQUESTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(help_requests, f, ensure_ascii=False, indent=2)
+    if storage is not None:
+        storage.save_help_requests(help_requests)
+        return
+    _persist("help_requests", lambda: write_json_atomic(HELP_REQUESTS_FILE, help_requests))
 
 
+def _write_raffle_numbers():
+    raffle_data = {
+        "numbers": raffle_numbers,
+        "allocator": raffle_allocator.to_json()
+    }
+    write_json_atomic(RAFFLE_NUMBERS_FILE, raffle_data)
 
 
+@timed(PERSISTENCE_SECONDS, "save_raffle_numbers")
 def save_raffle_numbers():
     """Сохраняет номера розыгрыша в файл"""
-    global next_raffle_number
-    raffle_data = {
-        "numbers": raffle_numbers,
-        "next_number": next_raffle_number
-    }
-    with open(RAFFLE_NUMBERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(raffle_data, f, ensure_ascii=False, indent=2)
-
-
-def save_raffle_table():
-    """Автоматически сохраняет таблицу участников розыгрыша в CSV для Excel"""
-    # Собираем данные участников с номерами
-    participants = []
-    for user_id, data in user_data.items():
-        raffle_number = data.get("raffle_number")
-        if raffle_number is not None:
-            participants.append({
-                "number": raffle_number,
-                "username": data.get("username", ""),
-                "full_name": data.get("full_name", ""),
-                "handle": data.get("handle", ""),
-                "completed_at": data.get("completed_at", "")
-            })
-    
-    if not participants:
+    if storage is not None:
+        # Рабочие процессы меняют общую карту в базе только транзакцией выдачи номера
+        if worker_link is not None:
+            return
+        # Сам номер участника записывается вместе с завершением квеста, здесь — только карта занятых номеров
+        storage.set_meta("raffle_allocator", raffle_allocator.to_json())
         return
-    
-    # Сортируем по номеру розыгрыша
-    participants.sort(key=lambda x: x["number"])
-    
-    # Сохраняем TXT файл: Имя, ник, @username, номер (в удобном для чтения виде)
-    txt_file = Path("raffle_table.txt")
-    with open(txt_file, "w", encoding="cp1251") as f_txt:
-        for p in participants:
-            full_name = p["full_name"] or p["username"] or "Не указано"
-            username = p["username"] or "Не указан"
-            handle = p.get("handle") or ""
-            handle_str = f"@{handle}" if handle else ""
-            # cp1251-safe варианты (чтобы не было иероглифов при открытии в Windows/мобильных редакторах)
-            full_name_safe = to_cp1251_safe(full_name)
-            username_safe = to_cp1251_safe(username)
-            handle_safe = to_cp1251_safe(handle_str)
-            # Имя;отображаемое имя;@username;номер
-            f_txt.write(f"{full_name_safe};{username_safe};{handle_safe};{p['number']}\n")
-    
-    # Сохраняем CSV файл (UTF‑8 с BOM + ';' — чтобы Excel корректно показывал русский текст)
-    csv_file = Path("raffle_table.csv")
-    with open(csv_file, "w", newline="", encoding="utf-8-sig") as f:
-        writer = csv.writer(f, delimiter=";")
-        # Без заголовков, @username;отображаемое имя;номер
-        for p in participants:
-            time_str = ""
-            if p["completed_at"]:
-                try:
-                    dt = datetime.fromisoformat(p["completed_at"])
-                    time_str = dt.strftime("%H:%M:%S")
-                except:
-                    time_str = p["completed_at"][:8] if len(p["completed_at"]) > 8 else p["completed_at"]
-            handle = p.get("handle") or ""
-            handle_str = f"@{handle}" if handle else ""
-            username = p["username"] or "Не указан"
-            # В CSV оставляем оригинальные строки, UTF‑8 их поддерживает полностью
-            # Записываем: @username;Имя;Номер
-            writer.writerow([handle_str, username, p["number"]])
+    _persist("raffle_numbers", _write_raffle_numbers)
+
+
+def _collect_raffle_rows() -> list:
+    """Все строки таблицы розыгрыша из user_data (у рабочего процесса — из базы: в памяти только его участники)"""
+    if worker_link is not None:
+        participants = participants_from_json(storage.load_raffle_participants())
+    else:
+        participants = user_data
+    # list() снимает копию за один шаг, даже если запись идёт из фонового потока
+    return [
+        raffle_row(participant)
+        for participant in list(participants.values())
+        if participant.raffle_number is not None
+    ]
+
+
+def _write_raffle_table():
+    raffle_table.flush(_collect_raffle_rows)
+
+
+@timed(PERSISTENCE_SECONDS, "save_raffle_table")
+def save_raffle_table(user_id: int | None = None):
+    """
+    Автоматически сохраняет таблицу участников розыгрыша в CSV для Excel.
+    С user_id строка участника дописывается в конец, без него таблица перестраивается целиком.
+    """
+    if user_id is not None:
+        raffle_table.add(raffle_row(user_data[user_id]))
+    else:
+        raffle_table.request_rebuild()
+    _persist("raffle_table", _write_raffle_table)
+
+
+def rebuild_raffle_table():
+    """Полностью перестраивает таблицу розыгрыша сразу, минуя фоновую запись"""
+    raffle_table.request_rebuild()
+    _write_raffle_table()
 
 
 def generate_raffle_number() -> int:
-    """Генерирует последовательный номер для розыгрыша от 1 до 1000"""
-    global next_raffle_number
-    
-    if next_raffle_number > 1000:
-        raise ValueError("Достигнут лимит номеров розыгрыша (1000)")
-    
-    number = next_raffle_number
-    next_raffle_number += 1
-    return number
+    """
+    Выдаёт номер для розыгрыша из RAFFLE_NUMBER_RANGES (наименьший свободный или случайный).
+    RaffleNumbersExhausted, если свободных номеров не осталось.
+    """
+    return raffle_allocator.allocate()
 
 
 def validate_answer(message_text: str, question: dict, question_index: int) -> tuple[bool, str]:
@@ -355,8 +888,8 @@ def validate_answer(message_text: str, question: dict, question_index: int) -> t
         return True, ""
     
     elif question_index == 3:  # Задание 4: Привет участнику
-        greeting_words = ["привет", "здравствуй", "приветствую", "здравствуйте", "hi", "hello"]
-        if not any(word in text_lower for word in greeting_words):
+        # Приветствия из QUESTIONS[3]["concepts"] целым словом, опечатки вроде «пирвет» тоже засчитываются
+        if ANSWER_MATCHERS[3].missing(text_lower):
             return False, (
                 "Это задание про передачу привета участнику митапа.\n"
                 "Напишите приветственное сообщение для кого-то из участников."
@@ -379,57 +912,93 @@ def check_emoji_answer(text_lower: str) -> tuple[bool, list[str]]:
     Проверяет ответ на задание с эмодзи.
     Возвращает (is_correct, missing_concepts)
     """
-    # Правильные ответы на эмодзи с различными вариантами написания
-    correct_answers = {
-        "🤖🧠": [
-            "искусственный интеллект", "ии", "ai", "artificial intelligence",
-            "искусственныйинтеллект"
-        ],
-        "🚗📖": [
-            "машинное обучение", "ml", "machine learning",
-            "машинноеобучение", "мл"
-        ],
-        "🧠📶": [
-            "нейросеть", "нейронная сеть", "neural network", "nn",
-            "нейросети", "нейронные сети"
-        ],
-        "🖥️👁️": [
-            "компьютерное зрение", "cv", "computer vision",
-            "компьютерноезрение"
-        ]
-    }
-    
-    # Нормализуем текст: убираем лишние пробелы, приводим к нижнему регистру
-    # Заменяем различные разделители на пробелы для унификации
-    normalized_text = re.sub(r'[,\-\.;:\n\r\t]+', ' ', text_lower)
-    normalized_text = " ".join(normalized_text.split())
-    
-    # Проверяем наличие всех правильных ответов
-    found_answers = {}
-    for emoji, variants in correct_answers.items():
-        found = False
-        for variant in variants:
-            if variant in normalized_text:
-                found_answers[emoji] = True
-                found = True
-                break
-        if not found:
-            found_answers[emoji] = False
-    
-    if all(found_answers.values()):
+    # Все понятия ищутся за один проход по тексту (разделители и лишние пробелы не мешают),
+    # ненайденные — ещё раз с учётом опечаток ("машиное обучение", "нейрсеть")
+    missing_emojis: list[str] = ANSWER_MATCHERS[2].missing(text_lower)
+    if not missing_emojis:
         return True, []
     
     # Возвращаем список тех эмодзи, которые пользователь ещё не расшифровал
-    missing_emojis: list[str] = [emoji for emoji, ok in found_answers.items() if not ok]
     return False, missing_emojis
 
 
+async def send_cached_photo(bot, chat_id: int, path: Path, **kwargs):
+    """Отправляет фото по file_id из кэша; файл загружается в Telegram только при первой отправке"""
+    file_id = media_cache.get(path)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id, photo=file_id, **kwargs)
+        except BadRequest as e:
+            # file_id мог стать недействительным (например, сменили токен бота)
+            logger.warning(f"Не удалось отправить {path} по file_id: {e}. Загружаем заново")
+            media_cache.forget(path)
+
+    lock = _media_upload_locks.setdefault(str(path), asyncio.Lock())
+    async with lock:
+        # Пока ждали, файл мог загрузить другой обработчик
+        file_id = media_cache.get(path)
+        if file_id:
+            return await bot.send_photo(chat_id, photo=file_id, **kwargs)
+
+        with open(path, "rb") as photo:
+            sent = await bot.send_photo(chat_id, photo=InputFile(photo), **kwargs)
+        if sent.photo:
+            # Самый большой вариант фото — последний
+            media_cache.remember(path, sent.photo[-1].file_id)
+        return sent
+
+
+async def _deliver_outbox_message(bot, chat_id: int, kind: str, params: dict):
+    """Отправка сообщения из outbox: текст или фото (в outbox — путь к файлу, отправка — по file_id из кэша)"""
+    if kind == "photo":
+        return await send_cached_photo(bot, chat_id, Path(params.pop("photo")), **params)
+    return await bot.send_message(chat_id, **params)
+
+
+# Исходящие сообщения участникам: сначала на диск, потом в Telegram; при сетевой ошибке уходят позже
+outbox = Outbox(
+    SQLITE_DB_FILE if STORAGE_BACKEND == "sqlite" else OUTBOX_DB_FILE,
+    _deliver_outbox_message,
+    shard=worker_link.shard if worker_link is not None else None,
+)
+
+
+async def reply(update: Update, text: str, **kwargs) -> bool:
+    """
+    Ответ в чат обновления через outbox. True — отправлен сразу, False — уйдёт позже
+    (сетевая ошибка или в чате ещё ждут более ранние сообщения)
+    """
+    with stage("reply"):
+        return await outbox.send(update.get_bot(), update.effective_chat.id, "message", {"text": text, **kwargs},
+                                 update_id=update.update_id)
+
+
+async def reply_cached_photo(update: Update, path: Path, **kwargs) -> bool:
+    """Фото в чат обновления через outbox (см. send_cached_photo)"""
+    with stage("reply"):
+        return await outbox.send(update.get_bot(), update.effective_chat.id, "photo", {"photo": str(path), **kwargs},
+                                 update_id=update.update_id)
+
+
+async def answer_callback(query):
+    """
+    Снимает «часики» с нажатой кнопки. На нажатие, которое ждало дольше нескольких секунд
+    (например, накопилось за время перезапуска), Telegram ответить не даёт — нажатие всё равно обрабатывается
+    """
+    try:
+        await query.answer()
+    except BadRequest as e:
+        logger.info(f"Не удалось ответить на нажатие кнопки пользователем {query.from_user.id}: {e}")
+
+
+@timed(HANDLER_SECONDS, "start")
+@traced("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     global quest_finished
     
     if quest_finished:
-        await update.message.reply_text("Квест завершен, спасибо за участие!")
+        await reply(update, "Квест завершен, спасибо за участие!")
         return
     
     user = update.effective_user
@@ -437,170 +1006,143 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = user.id
     
     # Проверяем, начал ли пользователь уже квест
-    if str(user_id) in user_data and user_data[str(user_id)].get("started_at"):
+    participant = user_data.get(user_id)
+    if participant is not None and participant.started_at:
         # Пользователь уже начал квест
-        raffle_number = user_data[str(user_id)].get("raffle_number")
+        raffle_number = participant.raffle_number
         
         if raffle_number:
             # Квест уже завершен
-            await update.message.reply_text(
-                f"*Вы уже завершили квест\\!*\n\n"
-                f"Ваш номер для розыгрыша: *{raffle_number}*",
+            await reply(
+                update,
+                ALREADY_COMPLETED_TEMPLATE.format(raffle_number=raffle_number),
                 parse_mode="MarkdownV2"
             )
         else:
             # Квест начат, но не завершен
             # Восстанавливаем состояние из сохраненных данных
-            saved_answers = user_data[str(user_id)].get("answers", {})
-            if saved_answers:
+            if participant.answer_count:
                 # Определяем текущее задание по количеству ответов
-                current_question_index = len(saved_answers)
+                current_question_index = participant.answer_count
                 if current_question_index < len(QUESTIONS):
-                    question_text = QUESTIONS[current_question_index]["text"]
-                    await update.message.reply_text(
-                        f"*Вы уже начали проходить квест\\.*\n\n"
-                        f"Текущее задание:\n\n{escape_markdown_v2(question_text)}\n\n"
-                        "Продолжайте выполнять задания\\.",
+                    await reply(
+                        update,
+                        QUEST_RESUME_TEXTS[current_question_index],
                         parse_mode="MarkdownV2"
                     )
                 else:
-                    await update.message.reply_text(
-                        "*Вы уже начали проходить квест\\.*\n\n"
-                        "Продолжайте выполнять задания\\.",
+                    await reply(
+                        update,
+                        QUEST_IN_PROGRESS_TEXT,
                         parse_mode="MarkdownV2"
                     )
             else:
-                await update.message.reply_text(
-                    "*Вы уже начали проходить квест\\.*\n\n"
-                    "Продолжайте выполнять задания\\.",
+                await reply(
+                    update,
+                    QUEST_IN_PROGRESS_TEXT,
                     parse_mode="MarkdownV2"
                 )
         return
     
     # Инициализируем данные пользователя
-    user_data[str(user_id)] = {
-        # "username" — отображаемое имя (первое имя или то, что видит пользователь)
-        "username": username,
-        "full_name": user.full_name,
-        "telegram_id": user_id,
-        # "handle" — телеграм‑ник без '@' (User.username)
-        "handle": user.username or "",
-        "started_at": datetime.now().isoformat(),
-        "answers": {},
-        "raffle_number": None,
-        "completed_at": None
-    }
-    save_user_data()
+    user_data[user_id] = Participant(
+        user_id,
+        username=username,
+        full_name=user.full_name,
+        handle=user.username or "",
+        started_at=now_timestamp(),
+        stage="welcome",
+    )
+    persist_user_started(user_id)
     
     # Сбрасываем состояние пользователя
-    user_states[user_id] = {
-        "stage": "welcome", 
-        "current_question": 0,
-        "answers": {}
-    }
-    
-    welcome_text = (
-        f"*Привет, {username}*\\!\n\n"
-        "*Рады видеть тебя на Большом митапе PRO AI\\!*\n\n"
-        "Для участия в розыгрыше призов присоединяйся к квесту\\. "
-        "Это займет всего несколько минут, и ты сможешь выиграть крутые призы\\!"
-    )
+    user_states[user_id] = Progress("welcome")
     
-    keyboard = [
-        [InlineKeyboardButton("Присоединиться к квесту", callback_data="join_quest")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Имя экранируется: точка или подчёркивание в нём иначе ломают разметку
+    welcome_text = WELCOME_TEMPLATE.format(username=escape_markdown_v2(username or ""))
+    reply_markup = WELCOME_MARKUP
     
     # Отправляем фото с приветствием, если файл существует
-    if WELCOME_IMAGE.exists():
-        with open(WELCOME_IMAGE, "rb") as photo:
-            await update.message.reply_photo(
-                photo=InputFile(photo),
-                caption=welcome_text,
-                parse_mode="MarkdownV2",
-                reply_markup=reply_markup
-            )
+    if welcome_photo.exists():
+        await reply_cached_photo(
+            update,
+            welcome_photo,
+            caption=welcome_text,
+            parse_mode="MarkdownV2",
+            reply_markup=reply_markup
+        )
     else:
         # Если фото нет, отправляем только текст
-        await update.message.reply_text(
+        await reply(
+            update,
             welcome_text,
             parse_mode="MarkdownV2",
             reply_markup=reply_markup
         )
 
 
+@timed(HANDLER_SECONDS, "join_quest")
+@traced("join_quest")
 async def join_quest(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик кнопки 'Присоединиться'"""
     global quest_finished
     
     query = update.callback_query
-    await query.answer()
+    await answer_callback(query)
     
     if quest_finished:
-        await query.message.reply_text("Квест завершен, спасибо за участие!")
+        await reply(update, "Квест завершен, спасибо за участие!")
         return
     
     user_id = query.from_user.id
     
-    # Обновляем состояние
-    user_states[user_id] = {
-        "stage": "quest_info", 
-        "current_question": 0,
-        "answers": user_data[str(user_id)].get("answers", {})
-    }
-    
-    quest_info_text = (
-        "*Что нужно сделать:*\n\n"
-        "• Выполнить *6 заданий* в боте\n"
-        "• Успеть до *17:30*\n"
-        "• В конце квеста ты получишь *номер для участия в розыгрыше*\n\n"
-        "Задания нетрудные: предстоит приятный нетворкинг и пару интересных задачек\\!\n\n"
-        "*Готов начать?*"
-    )
-    
-    keyboard = [
-        [InlineKeyboardButton("Приступить к заданию 1", callback_data="start_quest")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Обновляем состояние (этап сохраняется: состояние в памяти может быть вытеснено)
+    user_states[user_id] = Progress("quest_info")
+    set_stage(user_id, "quest_info")
     
     # После приветственного сообщения отправляем отдельный пост с условиями квеста
-    await query.message.reply_text(
-        quest_info_text,
+    await reply(
+        update,
+        QUEST_INFO_TEXT,
         parse_mode="MarkdownV2",
-        reply_markup=reply_markup
+        reply_markup=QUEST_INFO_MARKUP
     )
 
 
+@timed(HANDLER_SECONDS, "start_quest")
+@traced("start_quest")
 async def start_quest(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало квеста - показываем первое задание"""
     global quest_finished
     
     query = update.callback_query
-    await query.answer()
+    await answer_callback(query)
     
     if quest_finished:
-        await query.message.reply_text("Квест завершен, спасибо за участие!")
+        await reply(update, "Квест завершен, спасибо за участие!")
         return
     
     user_id = query.from_user.id
     
     # Обновляем состояние
-    user_states[user_id] = {
-        "stage": "answering", 
-        "current_question": 0,
-        "answers": user_data[str(user_id)].get("answers", {})
-    }
+    user_states[user_id] = Progress("answering")
+    set_stage(user_id, None)
     
     # Отправляем первое задание отдельным сообщением
     question = QUESTIONS[0]
-    await query.message.reply_text(
+    await reply(
+        update,
         question["text"],
         parse_mode="Markdown"
     )
-    
-    # Обновляем состояние
-    user_states[user_id]["current_question"] = 0
-    user_states[user_id]["stage"] = "answering"
+
+
+def set_stage(user_id: int, stage: str | None):
+    """Меняет и сохраняет этап участника до первого задания, если он изменился"""
+    participant = user_data.get(user_id)
+    if participant is not None and participant.stage != stage:
+        participant.stage = stage
+        persist_stage(user_id)
 
 
 async def show_question(query, user_id: int, question_index: int):
@@ -625,23 +1167,23 @@ async def show_question(query, user_id: int, question_index: int):
             )
     except Exception as e:
         # Если не удалось отредактировать, отправляем новое сообщение
-        await query.message.reply_text(
-            question_text,
-            parse_mode="Markdown"
-        )
+        await outbox.send(query.get_bot(), query.message.chat_id, "message", {
+            "text": question_text,
+            "parse_mode": "Markdown",
+        })
     
     # Обновляем состояние
-    user_states[user_id]["current_question"] = question_index
-    user_states[user_id]["stage"] = "answering"
+    user_states[user_id] = Progress("answering", question_index)
 
 
+@timed(HANDLER_SECONDS, "handle_message")
+@traced("handle_message")
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
     global quest_finished
     
     user_id = update.effective_user.id
     message_text = update.message.text
-    user_id_str = str(user_id)
     
     # Если квест завершён - отправляем сообщение (кроме команды /export для админа)
     if quest_finished:
@@ -651,56 +1193,30 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         is_admin_by_username = ADMIN_USERNAMES and username in ADMIN_USERNAMES
         
         if not (is_admin_by_id or is_admin_by_username):
-            await update.message.reply_text("Квест завершен, спасибо за участие!")
+            await reply(update, "Квест завершен, спасибо за участие!")
             return
     
-    # Если пользователя нет в user_states, но он есть в user_data и начал квест - восстанавливаем состояние
-    if user_id not in user_states:
-        if user_id_str in user_data and user_data[user_id_str].get("started_at"):
-            # Восстанавливаем состояние из сохранённых данных
-            data = user_data[user_id_str]
-            if not data.get("raffle_number"):  # Квест не завершён
-                answers = data.get("answers", {})
-                current_question_index = len(answers)
-                
-                if current_question_index < len(QUESTIONS):
-                    user_states[user_id] = {
-                        "stage": "answering",
-                        "current_question": current_question_index,
-                        "answers": answers
-                    }
-                    # Показываем текущий вопрос пользователю
-                    question = QUESTIONS[current_question_index]
-                    await update.message.reply_text(
-                        f"Продолжаем квест!\n\n{question['text']}",
-                        parse_mode="Markdown"
-                    )
-                    return
-            else:
-                # Квест завершён
-                user_states[user_id] = {
-                    "stage": "completed",
-                    "current_question": len(QUESTIONS),
-                    "answers": data.get("answers", {}),
-                    "raffle_number": data.get("raffle_number")
-                }
-        else:
-            await update.message.reply_text(
-                "Для начала работы с ботом используйте команду /start"
-            )
-            return
+    # Состояние берётся из кэша или восстанавливается из сохранённых данных (в т.ч. после перезапуска)
+    with stage("state"):
+        state = get_user_state(user_id)
+    if state is None:
+        await reply(
+            update,
+            "Для начала работы с ботом используйте команду /start"
+        )
+        return
     
-    state = user_states[user_id]
+    # Если предыдущее задание ещё ждёт отправки по таймеру — отправляем его сразу,
+    # чтобы ответ на это сообщение не пришёл раньше самого задания
+    with stage("deliver_pending_question"):
+        await deliver_pending_question_now(context.bot, user_id)
     
     # Если пользователь не в процессе ответа на вопрос
-    if state["stage"] != "answering":
+    if state.stage != "answering":
         # Пользователь уже прошёл квест
-        if state.get("stage") == "completed":
-            user_id_str = str(user_id)
-            raffle_number = (
-                state.get("raffle_number")
-                or user_data.get(user_id_str, {}).get("raffle_number")
-            )
+        if state.stage == "completed":
+            participant = user_data.get(user_id)
+            raffle_number = participant.raffle_number if participant is not None else None
             if raffle_number:
                 msg = (
                     "Квест завершён, ты молодец!\n\n"
@@ -712,35 +1228,38 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "Квест уже завершён.\n\n"
                     "Все 6 заданий выполнены.\n\n"
                 )
-            await update.message.reply_text(msg)
+            await reply(update, msg)
         else:
             # Пользователь ещё не начал квест или в другом состоянии
-            await update.message.reply_text(
+            await reply(
+                update,
                 "Для участия в квесте используй команду /start."
             )
         return
     
-    current_question_index = state["current_question"]
+    current_question_index = state.current_question
     question = QUESTIONS[current_question_index]
     
     # Отдельная логика для задания с эмодзи (3-е задание, индекс 2)
     if current_question_index == 2:
         text_lower = message_text.lower().strip()
-        is_correct, missing = check_emoji_answer(text_lower)
+        with stage("validation"):
+            is_correct, missing = check_emoji_answer(text_lower)
         
         # Считаем попытки пользователя для этого задания
-        attempts = state.get("emoji_attempts", 0)
+        attempts = state.emoji_attempts
         
         if is_correct:
             # Сбросим счётчик попыток и похвалим за точные ответы
-            state["emoji_attempts"] = 0
-            await update.message.reply_text(
+            state.emoji_attempts = 0
+            await reply(
+                update,
                 "Круто! Все ответы совпали, ты отлично справился.",
                 # без разметки, чтобы не ловить ошибок Markdown
             )
         else:
             attempts += 1
-            state["emoji_attempts"] = attempts
+            state.emoji_attempts = attempts
             
             if attempts == 1:
                 # Первая ошибочная попытка: показываем по эмодзи, что ещё не расшифровано
@@ -756,69 +1275,55 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         "Ответ пока не выглядит полным.\n\n"
                         "Попробуй ещё раз — у тебя есть ещё одна попытка."
                     )
-                await update.message.reply_text(msg)
+                await reply(update, msg)
                 return
             else:
                 # Вторая (и далее) неудачная попытка — показываем правильные ответы и идём дальше
-                state["emoji_attempts"] = 0
+                state.emoji_attempts = 0
                 correct_text = question.get("correct_answer")
                 if correct_text:
-                    await update.message.reply_text(
+                    await reply(
+                        update,
                         "Немного не совпало, но ничего страшного — это было непростое задание.\n\n"
                         "Вот правильные ответы:"
                     )
-                    await update.message.reply_text(correct_text)
+                    await reply(update, correct_text)
                 # Считаем ответ принятым и переходим к следующему заданию ниже (как обычно)
     
     # Общая валидация для остальных заданий
     if current_question_index != 2:
-        is_valid, error_message = validate_answer(message_text, question, current_question_index)
+        with stage("validation"):
+            is_valid, error_message = validate_answer(message_text, question, current_question_index)
         
         if not is_valid:
-            # Экранируем специальные символы для MarkdownV2
-            escaped_error = escape_markdown_v2(error_message)
-            await update.message.reply_text(
-                f"{escaped_error}\n\n"
-                "Попробуйте еще раз\\!",
+            await reply(
+                update,
+                render_validation_error(error_message),
                 parse_mode="MarkdownV2"
             )
             return
     
-    # Сохраняем ответ пользователя
-    user_id_str = str(user_id)
-    if "answers" not in user_states[user_id]:
-        user_states[user_id]["answers"] = {}
-    
-    user_states[user_id]["answers"][current_question_index] = {
-        "answer": message_text,
-        "timestamp": datetime.now().isoformat()
-    }
-    
-    # Сохраняем в файл
-    if user_id_str not in user_data:
-        user_obj = update.effective_user
-        user_data[user_id_str] = {
-            "username": user_obj.first_name or user_obj.username,
-            "full_name": user_obj.full_name,
-            "telegram_id": user_id,
-            "handle": user_obj.username or "",
-            "started_at": datetime.now().isoformat(),
-            "answers": {},
-            "raffle_number": None,
-            "completed_at": None
-        }
-    
-    user_data[user_id_str]["answers"][current_question_index] = {
-        "answer": message_text,
-        "timestamp": datetime.now().isoformat()
-    }
-    save_user_data()
+    # Сохраняем ответ пользователя: в записи участника — только время, текст — в answer_store
+    with stage("persist"):
+        participant = user_data.get(user_id)
+        if participant is None:
+            user_obj = update.effective_user
+            participant = user_data[user_id] = Participant(
+                user_id,
+                username=user_obj.first_name or user_obj.username,
+                full_name=user_obj.full_name,
+                handle=user_obj.username or "",
+                started_at=now_timestamp(),
+            )
+            persist_user_started(user_id)
+
+        participant.set_answer(current_question_index, now_timestamp())
+        persist_answer(user_id, current_question_index, message_text)
     
     # Фиксируем ответ с дружелюбным сообщением
-    question_number = current_question_index + 1
-    await update.message.reply_text(
-        f"*Отлично\\!* Ответ на задание *{question_number}* зафиксирован\\.\n\n"
-        "Переходим дальше\\.\\.\\.",
+    await reply(
+        update,
+        ANSWER_ACCEPTED_TEXTS[current_question_index],
         parse_mode="MarkdownV2"
     )
     
@@ -826,51 +1331,161 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     next_question_index = current_question_index + 1
     
     if next_question_index < len(QUESTIONS):
-        # Показываем следующее задание
-        await asyncio.sleep(1)
-        question_text = QUESTIONS[next_question_index]["text"]
-        await update.message.reply_text(
-            question_text,
-            parse_mode="Markdown"
-        )
-        user_states[user_id]["current_question"] = next_question_index
+        # Показываем следующее задание после паузы, не занимая обработчик
+        state.current_question = next_question_index
+        with stage("schedule_next_question"):
+            plan_next_question(context.application, user_id, update.effective_chat.id, next_question_index)
     else:
         # Квест завершен
         await complete_quest(update, user_id)
 
 
+def schedule_question(application: Application, user_id: int, chat_id: int, question_index: int, delay: float):
+    """Планирует отправку задания через delay секунд, не блокируя обработчик"""
+    if application.job_queue is not None:
+        application.job_queue.run_once(
+            deliver_question_job,
+            delay,
+            data=(user_id, question_index),
+            chat_id=chat_id,
+            user_id=user_id,
+            name=f"question:{user_id}",
+        )
+    else:
+        # Без job-queue — обычной задачей asyncio
+        async def deliver_later():
+            await asyncio.sleep(delay)
+            await deliver_question(application.bot, user_id, question_index)
+
+        application.create_task(deliver_later())
+
+
+def plan_next_question(application: Application, user_id: int, chat_id: int, question_index: int):
+    """Запоминает задание к отправке (переживает перезапуск) и планирует его отправку"""
+    pending_questions[str(user_id)] = {
+        "chat_id": chat_id,
+        "question": question_index,
+        "due": time.time() + NEXT_QUESTION_DELAY,
+    }
+    save_pending_question(user_id)
+    schedule_question(application, user_id, chat_id, question_index, NEXT_QUESTION_DELAY)
+
+
+async def deliver_question(bot, user_id: int, question_index: int):
+    """Отправляет запланированное задание, если оно ещё не отправлено"""
+    pending = pending_questions.get(str(user_id))
+    if not pending or pending["question"] != question_index:
+        # Уже отправлено раньше (например, пользователь написал до истечения задержки)
+        return
+    # Снимаем отметку до отправки, чтобы задание не ушло дважды при одновременном вызове
+    del pending_questions[str(user_id)]
+    try:
+        await outbox.send(bot, pending["chat_id"], "message", {
+            "text": QUESTIONS[question_index]["text"],
+            "parse_mode": "Markdown",
+        })
+    except Exception:
+        # После сетевых ошибок outbox повторяет отправку сам, сюда попадают остальные:
+        # оставляем задание в очереди, оно уйдёт при следующем сообщении или перезапуске
+        pending_questions.setdefault(str(user_id), pending)
+        raise
+    save_pending_question(user_id)
+
+
+async def deliver_question_job(context: ContextTypes.DEFAULT_TYPE):
+    """Задача job-queue: отправка следующего задания после паузы"""
+    user_id, question_index = context.job.data
+    await deliver_question(context.bot, user_id, question_index)
+
+
+async def deliver_pending_question_now(bot, user_id: int):
+    """Если задание пользователю ещё ждёт отправки — отправляем его сразу"""
+    pending = pending_questions.get(str(user_id))
+    if pending:
+        await deliver_question(bot, user_id, pending["question"])
+
+
+async def reschedule_pending_questions(application: Application):
+    """После перезапуска планирует заново задания, которые не успели уйти"""
+    now = time.time()
+    for user_id_str, pending in list(pending_questions.items()):
+        delay = max(0.0, pending["due"] - now)
+        schedule_question(application, int(user_id_str), pending["chat_id"], pending["question"], delay)
+    if pending_questions:
+        logger.info(f"Запланирована повторная отправка заданий: {len(pending_questions)}")
+
+
+async def post_init(application: Application):
+    """После запуска: досылаем сообщения из outbox и задания, которые не успели уйти до перезапуска"""
+    global metrics_server
+    outbox.start(application.bot)
+    await reschedule_pending_questions(application)
+
+    processor = application.update_processor
+    if isinstance(processor, PerUserUpdateProcessor):
+        ACTIVE_USERS.set_function(lambda: processor.active_users)
+    USER_STATES.set_function(lambda: len(user_states))
+    OUTBOX_PENDING.set_function(outbox.pending)
+    if METRICS_PORT:
+        port = METRICS_PORT + (worker_link.shard[0] if worker_link is not None else 0)
+        metrics_server = MetricsServer(METRICS_LISTEN, port)
+        await metrics_server.start()
+
+
+async def post_stop(application: Application):
+    """Обработчики остановлены — останавливаем фоновую отправку (неотправленное останется в outbox)"""
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await outbox.stop()
+    if update_ledger.skipped:
+        logger.info(f"Пропущено обновлений, обработанных до перезапуска: {update_ledger.skipped}")
+
+
+@timed(HANDLER_SECONDS, "complete_quest")
+@traced("complete_quest")
 async def complete_quest(update: Update, user_id: int):
     """Завершение квеста"""
     user_id_str = str(user_id)
+    participant = user_data[user_id]
     
-    # Генерируем номер для розыгрыша
-    raffle_number = generate_raffle_number()
+    # Генерируем номер для розыгрыша и сохраняем его в данные пользователя
+    try:
+        with stage("raffle_number"):
+            if worker_link is not None:
+                # Несколько процессов: номер выдаётся по общей карте в базе той же транзакцией,
+                # что фиксирует завершение квеста
+                completed_at = now_timestamp()
+                stamp_update(participant)
+                raffle_number = storage.complete_with_shared_allocator(
+                    user_id, to_isoformat(completed_at), raffle_allocator.ranges, RAFFLE_NUMBERS_RANDOM,
+                    _last_update(participant)
+                )
+            else:
+                raffle_number = generate_raffle_number()
+                completed_at = now_timestamp()
+    except RaffleNumbersExhausted as e:
+        # Квест не завершается: когда организаторы добавят номера, участник повторит последний ответ
+        logger.error(f"Участнику {user_id} не хватило номера розыгрыша: {e}")
+        await reply(update, RAFFLE_EXHAUSTED_TEXT, parse_mode="MarkdownV2")
+        return
     raffle_numbers[user_id_str] = raffle_number
-    save_raffle_numbers()
-    
-    # Сохраняем номер в данные пользователя
-    user_data[user_id_str]["raffle_number"] = raffle_number
-    user_data[user_id_str]["completed_at"] = datetime.now().isoformat()
-    save_user_data()
+    participant.raffle_number = raffle_number
+    participant.completed_at = completed_at
     
-    # Автоматически обновляем таблицу участников
-    save_raffle_table()
+    with stage("persist"):
+        if worker_link is not None:
+            save_raffle_table(user_id)
+        else:
+            # Одна запись на диск до ответа участнику; файлы и строка таблицы — следом
+            commit_completion(user_id)
     
-    # Обновляем состояние
-    user_states[user_id]["stage"] = "completed"
-    user_states[user_id]["raffle_number"] = raffle_number
-    
-    completion_text = (
-        "*Квест пройден, поздравляем\\!*\n\n"
-        f"*Твой номер для розыгрыша: {raffle_number}*\n\n"
-        "Сохрани этот номер\\! Он понадобится для участия в розыгрыше призов\\.\n\n"
-        "Розыгрыш состоится в *18:00* на основной сцене\\.\n\n"
-        "Жди объявления результатов\\! Удачи\\!"
-    )
+    # Обновляем состояние: у завершивших оно общее, номер хранится в user_data
+    user_states[user_id] = COMPLETED_STATE
     
     # Отправляем только текст без фото
-    await update.message.reply_text(
-        completion_text,
+    await reply(
+        update,
+        COMPLETION_TEMPLATE.format(raffle_number=raffle_number),
         parse_mode="MarkdownV2"
     )
 
@@ -887,20 +1502,37 @@ async def finish_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     is_admin_by_username = ADMIN_USERNAMES and username in ADMIN_USERNAMES
 
     if not (is_admin_by_id or is_admin_by_username):
-        await update.message.reply_text(
-            "Доступ запрещен\\. Эта команда доступна только организаторам\\.",
+        await reply(
+            update,
+            ACCESS_DENIED_TEXT,
             parse_mode="MarkdownV2"
         )
         return
     
     quest_finished = True
     save_quest_finished()
-    await update.message.reply_text(
+    # Остальные рабочие процессы узнают об этом сразу, не перечитывая базу
+    if worker_link is not None:
+        await worker_link.broadcast({"op": "quest_finished"})
+    await reply(
+        update,
         "*Квест завершён\\. Приём ответов остановлен\\.*",
         parse_mode="MarkdownV2"
     )
 
 
+def apply_worker_command(command: dict):
+    """Команда от другого рабочего процесса (BOT_WORKERS > 1)"""
+    global quest_finished
+    if command.get("op") == "quest_finished":
+        quest_finished = True
+        logger.info("Квест завершён командой /finish в другом рабочем процессе")
+    else:
+        logger.warning(f"Неизвестная команда рабочему процессу: {command}")
+
+
+@timed(HANDLER_SECONDS, "export_command")
+@traced("export_command")
 async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для получения выгрузки участников (только для организаторов)"""
     user_id = update.effective_user.id
@@ -911,21 +1543,23 @@ async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     is_admin_by_username = ADMIN_USERNAMES and username in ADMIN_USERNAMES
 
     if not (is_admin_by_id or is_admin_by_username):
-        await update.message.reply_text(
-            "Доступ запрещен\\. Эта команда доступна только организаторам\\.",
+        await reply(
+            update,
+            ACCESS_DENIED_TEXT,
             parse_mode="MarkdownV2"
         )
         return
     
-    # Генерируем выгрузку
-    save_raffle_table()
+    # Генерируем выгрузку сразу (не дожидаясь фоновой записи), но вне event loop
+    await asyncio.to_thread(rebuild_raffle_table)
     
-    # Отправляем CSV и TXT
+    # Отправляем CSV и TXT напрямую, не через outbox: файлы пересобираются при каждой команде,
+    # и повтор после перезапуска прислал бы другую выгрузку; при ошибке организатор повторит /export
     try:
         files_sent = False
 
-        if Path("raffle_table.csv").exists():
-            with open("raffle_table.csv", "rb") as csv_file:
+        if RAFFLE_TABLE_CSV.exists():
+            with open(RAFFLE_TABLE_CSV, "rb") as csv_file:
                 await update.message.reply_document(
                     document=InputFile(csv_file, filename="raffle_table.csv"),
                     caption="*Выгрузка участников розыгрыша \\(CSV\\)*",
@@ -933,8 +1567,8 @@ async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
             files_sent = True
 
-        if Path("raffle_table.txt").exists():
-            with open("raffle_table.txt", "rb") as txt_file:
+        if RAFFLE_TABLE_TXT.exists():
+            with open(RAFFLE_TABLE_TXT, "rb") as txt_file:
                 await update.message.reply_document(
                     document=InputFile(txt_file, filename="raffle_table.txt"),
                     caption="Имя;ник;номер в розыгрыше",
@@ -942,20 +1576,59 @@ async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             files_sent = True
 
         if not files_sent:
-            await update.message.reply_text(
+            await reply(
+                update,
                 "*Выгрузка пока недоступна\\.*\n\n"
                 "Участников еще нет\\.",
                 parse_mode="MarkdownV2"
             )
     except Exception as e:
-        await update.message.reply_text(
+        await reply(
+            update,
             f"Ошибка при отправке выгрузки: {escape_markdown_v2(str(e))}",
             parse_mode="MarkdownV2"
         )
 
 
+async def count_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Раньше всех обработчиков: считает полученные обновления для метрик"""
+    if update.message is not None:
+        kind = "message"
+    elif update.callback_query is not None:
+        kind = "callback_query"
+    else:
+        kind = "other"
+    UPDATES.labels(kind).inc()
+
+
+def observe_telegram_request(method: str, seconds: float, error: Exception | None):
+    """Замер запроса к Bot API (TimedRequest) — в метрики и в трассу обновления, если оно трассируется"""
+    TELEGRAM_REQUEST_SECONDS.labels(method).observe(seconds)
+    record_stage(f"telegram.{method}", seconds)
+    if error is not None:
+        TELEGRAM_ERRORS.labels(type(error).__name__).inc()
+
+
+async def skip_applied_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    До остальных обработчиков: обновление, обработанное ещё до перезапуска, дальше не идёт.
+    Остальные отмечаются в записи участника той же записью, что сохраняет сделанные ими изменения (backlog.stamp)
+    """
+    if update_ledger.begin(update):
+        logger.info(f"Обновление {update.update_id} уже обработано до перезапуска, пропускаем")
+        raise ApplicationHandlerStop
+
+
+async def mark_update_applied(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """После остальных обработчиков (и после ошибки в них): обновление больше не обрабатывать"""
+    participant = update_ledger.mark(update)
+    if participant is not None:
+        persist_last_update(participant)
+
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик ошибок для всего приложения"""
+    UPDATE_ERRORS.labels(type(context.error).__name__).inc()
     logger.error(f"Exception while handling an update: {context.error}", exc_info=context.error)
     
     # Обработка сетевых ошибок
@@ -968,25 +1641,52 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.warning(f"Таймаут запроса: {context.error}. Бот продолжит работу...")
         return
     
-    # Обработка ошибок rate limit
+    # Обработка ошибок rate limit: ограничитель исходящих уже повторил запрос несколько раз
     if isinstance(context.error, RetryAfter):
-        logger.warning(f"Превышен лимит запросов. Ожидание {context.error.retry_after} секунд...")
-        await asyncio.sleep(context.error.retry_after)
+        logger.warning(f"Превышен лимит запросов, повторы не помогли (retry_after={context.error.retry_after} с)")
         return
 
 
-def main():
-    """Основная функция запуска бота"""
-    if not BOT_TOKEN:
-        print("Ошибка: BOT_TOKEN не установлен в переменных окружения!")
-        print("Создайте файл .env и добавьте туда BOT_TOKEN=ваш_токен")
-        return
-    
-    # Создаем приложение с настройками для обработки сетевых ошибок
-    application = Application.builder().token(BOT_TOKEN).build()
+def _application_builder(request: BaseRequest | None = None):
+    """Builder с токеном и адресом Bot API — для бота и для главного процесса при BOT_WORKERS > 1"""
+    builder = Application.builder().token(BOT_TOKEN)
+    if BOT_API_BASE_URL:
+        base_url = BOT_API_BASE_URL.rstrip("/")
+        builder = builder.base_url(base_url).base_file_url(base_url.replace("/bot", "/file/bot", 1))
+    # Запросы к Bot API, кроме долгих getUpdates, — с замером времени для метрик
+    builder = builder.request(TimedRequest(request or HTTPXRequest(connection_pool_size=256), observe_telegram_request))
+    if request is not None:
+        builder = builder.get_updates_request(request)
+    return builder
+
+
+def build_application(request: BaseRequest | None = None) -> Application:
+    """Создаёт приложение со всеми обработчиками; request — свой HTTP-клиент (например, в тестах)"""
+    # post_init: после перезапуска досылаем сообщения и задания, которые не успели уйти
+    builder = _application_builder(request).post_init(post_init).post_stop(post_stop)
+    if CONCURRENT_UPDATES > 1:
+        # Пользователи обрабатываются параллельно, сообщения одного пользователя — по очереди
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    if RATE_LIMIT_OVERALL > 0:
+        # Исходящие сообщения — через очередь с лимитами Telegram и повтором после RetryAfter
+        # Общий лимит бота делится между рабочими процессами
+        rate_limiter = PriorityRateLimiter(
+            overall_rate=RATE_LIMIT_OVERALL / (worker_link.count if worker_link is not None else 1),
+            private_chat_rate=RATE_LIMIT_PER_CHAT,
+            chat_burst=RATE_LIMIT_CHAT_BURST,
+            max_retries=RATE_LIMIT_MAX_RETRIES,
+            observe_wait=lambda priority, seconds: OUTBOUND_WAIT_SECONDS.labels(priority).observe(seconds),
+        )
+        for priority in PRIORITY_NAMES.values():
+            OUTBOUND_QUEUE_DEPTH.labels(priority).set_function(
+                lambda priority=priority: rate_limiter.queue_depth()[priority]
+            )
+        builder = builder.rate_limiter(rate_limiter)
+    application = builder.build()
     
     # Регистрируем глобальный обработчик ошибок
     application.add_error_handler(error_handler)
+    application.add_handler(TypeHandler(Update, count_update), group=-2)
     
     # Регистрируем обработчики
     application.add_handler(CommandHandler("start", start))
@@ -995,16 +1695,90 @@ def main():
     application.add_handler(CallbackQueryHandler(join_quest, pattern="^join_quest$"))
     application.add_handler(CallbackQueryHandler(start_quest, pattern="^start_quest$"))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+
+    if not DROP_PENDING_UPDATES:
+        # Накопившиеся за перезапуск обновления приходят снова — уже обработанные пропускаем
+        application.add_handler(TypeHandler(Update, skip_applied_update), group=-1)
+        application.add_handler(TypeHandler(Update, mark_update_applied), group=1)
+    return application
+
+
+def main():
+    """Основная функция запуска бота"""
+    global welcome_photo
+    
+    if not BOT_TOKEN:
+        print("Ошибка: BOT_TOKEN не установлен в переменных окружения!")
+        print("Создайте файл .env и добавьте туда BOT_TOKEN=ваш_токен")
+        return
+    if BOT_WORKERS > 1 and STORAGE_BACKEND != "sqlite":
+        print("Ошибка: BOT_WORKERS > 1 работает только с STORAGE_BACKEND=sqlite (общая база для всех процессов)")
+        return
+    
+    # Заранее готовим облегчённую JPEG-версию приветственной картинки
+    if WELCOME_IMAGE_JPEG and WELCOME_IMAGE.exists():
+        welcome_photo = prepare_jpeg(WELCOME_IMAGE) or WELCOME_IMAGE
+    
+    # Данные прочитаны из другого формата — сразу сохраняем их в текущем
+    if _migrate_user_data:
+        _write_user_data()
+
+    # Карта занятых номеров в базе — общая для рабочих процессов: записываем сверенную до их запуска
+    if IS_ROUTER:
+        save_raffle_numbers()
+
+    # Номера розыгрыша сверены после аварийной остановки — записываем их и перестраиваем таблицу
+    if _recovered_completions:
+        if storage is None:
+            _write_user_data()
+        save_raffle_numbers()
+        rebuild_raffle_table()
+    
+    application = _application_builder().build() if IS_ROUTER else build_application()
     
     # Запускаем бота
-    print("Бот запущен...")
+    print(f"Бот запущен (рабочих процессов: {BOT_WORKERS})..." if IS_ROUTER else "Бот запущен...")
+    
+    # Фоновая запись файлов: обработчики только помечают данные изменёнными
+    if PERSISTENCE_FLUSH_INTERVAL > 0:
+        flusher.start()
     
     try:
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,  # Игнорировать старые обновления при перезапуске
-            close_loop=False  # Не закрывать event loop при ошибках
-        )
+        if IS_ROUTER:
+            # Главный процесс: получает обновления так же, как обычный бот, и раздаёт их рабочим
+            run_router(
+                application,
+                BOT_WORKERS,
+                Path(__file__).resolve(),
+                mode=BOT_MODE,
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET_TOKEN,
+                webhook_url=WEBHOOK_URL,
+                drop_pending_updates=DROP_PENDING_UPDATES,
+            )
+        elif worker_link is not None:
+            # Рабочий процесс: обновления своих участников от главного процесса, /finish от других рабочих
+            worker_link.run(application, apply_worker_command)
+        elif BOT_MODE == "webhook":
+            # Остановка по SIGTERM/SIGINT: дожидаемся обработки принятых обновлений, затем сохраняем данные
+            run_webhook(
+                application,
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET_TOKEN,
+                webhook_url=WEBHOOK_URL,
+                drop_pending_updates=DROP_PENDING_UPDATES,
+            )
+        else:
+            application.run_polling(
+                allowed_updates=Update.ALL_TYPES,
+                # Выбросить обновления, накопившиеся за перезапуск, или обработать их (DROP_PENDING_UPDATES)
+                drop_pending_updates=DROP_PENDING_UPDATES,
+                close_loop=False  # Не закрывать event loop при ошибках
+            )
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
     except Exception as e:
@@ -1015,6 +1789,18 @@ def main():
         print("2. Блокировка Telegram API (может потребоваться VPN/прокси)")
         print("3. Неверный BOT_TOKEN")
         print("\nПопробуйте перезапустить бота через несколько секунд.")
+    finally:
+        # Дописываем всё, что не успел записать фоновый поток
+        flusher.stop()
+        logger.info(f"Статистика сохранения данных:\n{persistence_stats.summary()}")
+        # Сворачиваем журнал, чтобы следующий запуск читал только снимок
+        if journal is not None:
+            journal.compact(participants_json.dumps())
+        outbox.close()
+        if storage is not None:
+            storage.close()
+        elif answer_store is not None:
+            answer_store.close()
 
 
 if __name__ == "__main__":
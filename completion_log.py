@@ -0,0 +1,92 @@
+"""
+Журнал завершений квеста (completions.log) для хранения в user_data.json и двоичном снимке.
+Завершение фиксируется одной строкой с fsync: user_id, номер розыгрыша и время завершения.
+Из неё восстанавливаются и запись участника, и raffle_numbers.json, и строка таблицы розыгрыша,
+поэтому сами эти файлы пишутся после (в фоне), а при запуске сверяются с журналом.
+
+Записи не нужны, когда user_data записан вместе с ними: rotate() перед записью user_data
+откладывает журнал в сегмент ".1", drop_rotated() после записи его удаляет.
+"""
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class CompletionLog:
+    """Append-only журнал завершений квеста"""
+
+    def __init__(self, path: Path, fsync: bool = True):
+        self.path = Path(path)
+        self.fsync = fsync
+        self.rotated_path = self.path.with_name(self.path.name + ".1")
+        self._file = None
+        # append() вызывается из event loop, rotate() — из потока фоновой записи
+        self._lock = threading.Lock()
+
+    def append(self, user_id: int, raffle_number: int, completed_at: str) -> None:
+        """Фиксирует завершение квеста: после возврата оно переживёт аварийную остановку"""
+        line = json.dumps({"user_id": user_id, "raffle_number": raffle_number, "completed_at": completed_at})
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def read(self) -> list[dict]:
+        """Все записи: сначала отложенный сегмент, затем текущий"""
+        entries = []
+        for path in (self.rotated_path, self.path):
+            if not path.exists():
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line_number, line in enumerate(f, start=1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Недописанная строка: fsync не завершился, участник номер не получил
+                        logger.warning(f"Журнал завершений {path}: повреждённая строка {line_number}, остаток пропущен")
+                        break
+        return entries
+
+    def rotate(self) -> None:
+        """
+        Откладывает текущие записи в сегмент ".1" перед записью user_data.
+        Если прошлая запись не удалась и сегмент остался, записи дописываются в него.
+        """
+        with self._lock:
+            self._close()
+            if not self.path.exists():
+                return
+            if self.rotated_path.exists():
+                # Если упадём посередине, записи окажутся в обоих файлах — повторное применение безопасно
+                with open(self.path, "r", encoding="utf-8") as src, \
+                        open(self.rotated_path, "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                self.path.unlink()
+            else:
+                os.replace(self.path, self.rotated_path)
+
+    def drop_rotated(self) -> None:
+        """user_data с отложенными записями уже на диске — сегмент больше не нужен"""
+        if self.rotated_path.exists():
+            self.rotated_path.unlink()
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
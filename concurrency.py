@@ -0,0 +1,78 @@
+"""
+Параллельная обработка обновлений разных пользователей.
+Обновления одного пользователя по-прежнему обрабатываются строго по очереди,
+поэтому user_states и user_data каждого участника меняются в порядке его сообщений.
+"""
+import asyncio
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Ограничение базового класса — только на число одновременно ожидающих обновлений.
+# Реальный лимит параллельности применяется уже после очереди пользователя (см. do_process_update),
+# чтобы десяток сообщений одного пользователя не занимал все слоты
+_MAX_QUEUED_UPDATES = 10_000
+
+
+def update_user_key(update: object):
+    """Ключ для сериализации: id пользователя, иначе id чата, иначе None (без очереди)"""
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает до max_concurrent обновлений одновременно,
+    но обновления одного пользователя — последовательно, в порядке поступления.
+    """
+
+    __slots__ = ("_max_concurrent", "_active", "_user_locks")
+
+    def __init__(self, max_concurrent: int):
+        super().__init__(max(_MAX_QUEUED_UPDATES, max_concurrent))
+        self._max_concurrent = max_concurrent
+        self._active = asyncio.BoundedSemaphore(max_concurrent)
+        # user_id -> [asyncio.Lock, сколько обновлений пользователя сейчас в работе или в очереди]
+        self._user_locks: dict[Any, list] = {}
+
+    @property
+    def max_concurrent(self) -> int:
+        return self._max_concurrent
+
+    @property
+    def active_users(self) -> int:
+        """Сколько пользователей сейчас имеют обновления в работе или в очереди"""
+        return len(self._user_locks)
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        key = update_user_key(update)
+        if key is None:
+            async with self._active:
+                await coroutine
+            return
+
+        # asyncio.Lock пропускает ожидающих в порядке FIFO, а задачи на обновления
+        # создаются в порядке их получения — так сохраняется порядок сообщений пользователя
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._active:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[key]
+
+    async def initialize(self) -> None:
+        """Ресурсов для подготовки нет"""
+
+    async def shutdown(self) -> None:
+        """Ресурсов для освобождения нет"""
@@ -1,73 +1,111 @@
 """
 Скрипт для экспорта данных пользователей в CSV файл
 """
+import os
 import json
 import csv
 from pathlib import Path
 from datetime import datetime
 
+from dotenv import load_dotenv
+
+from answer_store import AnswerTexts
+from journal import UserDataJournal
+from records import participants_to_json
+from snapshot import load_snapshot
+from sqlite_storage import SQLiteStorage
+
+load_dotenv()
+
 DATA_FILE = Path("user_data.json")
+JOURNAL_FILE = Path("user_data.journal")
+SNAPSHOT_FILE = Path("user_data.snapshot")
+SQLITE_DB_FILE = Path(os.getenv("SQLITE_DB_FILE", "quest.db"))
+ANSWERS_DB_FILE = Path(os.getenv("ANSWERS_DB_FILE", "answers.db"))
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").strip().lower()
 OUTPUT_FILE = Path("exported_data.csv")
+QUESTIONS_COUNT = 6
+
+FIELDNAMES = [
+    "ID пользователя", "Имя пользователя", "Полное имя", "Номер розыгрыша",
+    "Начало квеста", "Завершение квеста",
+    "Ответ на задание 1", "Время ответа 1",
+    "Ответ на задание 2", "Время ответа 2",
+    "Ответ на задание 3", "Время ответа 3",
+    "Ответ на задание 4", "Время ответа 4",
+    "Ответ на задание 5", "Время ответа 5",
+    "Ответ на задание 6", "Время ответа 6",
+]
 
 
 def export_to_csv():
     """Экспортирует данные пользователей в CSV файл"""
-    if not DATA_FILE.exists():
-        print(f"Файл {DATA_FILE} не найден!")
-        return
-    
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        user_data = json.load(f)
+    if STORAGE_BACKEND == "sqlite":
+        if not SQLITE_DB_FILE.exists():
+            print(f"Файл {SQLITE_DB_FILE} не найден!")
+            return
+        storage = SQLiteStorage(SQLITE_DB_FILE)
+        user_data = storage.load_user_data()
+        storage.close()
+        answers_db_file = SQLITE_DB_FILE
+    else:
+        if not DATA_FILE.exists() and not JOURNAL_FILE.exists() and not SNAPSHOT_FILE.exists():
+            print(f"Файл {DATA_FILE} не найден!")
+            return
+        
+        user_data = {}
+        # Двоичный снимок (STORAGE_BACKEND=snapshot), если он свежее user_data.json
+        if SNAPSHOT_FILE.exists() and (
+            not DATA_FILE.exists() or SNAPSHOT_FILE.stat().st_mtime_ns >= DATA_FILE.stat().st_mtime_ns
+        ):
+            user_data = participants_to_json(load_snapshot(SNAPSHOT_FILE))
+        elif DATA_FILE.exists():
+            with open(DATA_FILE, "r", encoding="utf-8") as f:
+                user_data = json.load(f)
+        
+        # Учитываем изменения, которые ещё не свёрнуты из журнала в снимок
+        UserDataJournal(JOURNAL_FILE, DATA_FILE).replay(user_data)
+        answers_db_file = ANSWERS_DB_FILE
     
     if not user_data:
         print("Нет данных для экспорта.")
         return
     
-    # Подготавливаем данные для CSV
-    rows = []
-    for user_id, data in user_data.items():
-        row = {
-            "ID пользователя": user_id,
-            "Имя пользователя": data.get("username", ""),
-            "Полное имя": data.get("full_name", ""),
-            "Номер розыгрыша": data.get("raffle_number", ""),
-            "Начало квеста": data.get("started_at", ""),
-            "Завершение квеста": data.get("completed_at", ""),
-        }
-        
-        # Добавляем ответы на вопросы
-        answers = data.get("answers", {})
-        for i in range(6):
-            answer_data = answers.get(str(i), {})
-            row[f"Ответ на задание {i+1}"] = answer_data.get("answer", "")
-            row[f"Время ответа {i+1}"] = answer_data.get("timestamp", "")
-        
-        rows.append(row)
-    
-    # Записываем в CSV
-    if rows:
-        fieldnames = [
-            "ID пользователя", "Имя пользователя", "Полное имя", "Номер розыгрыша",
-            "Начало квеста", "Завершение квеста",
-            "Ответ на задание 1", "Время ответа 1",
-            "Ответ на задание 2", "Время ответа 2",
-            "Ответ на задание 3", "Время ответа 3",
-            "Ответ на задание 4", "Время ответа 4",
-            "Ответ на задание 5", "Время ответа 5",
-            "Ответ на задание 6", "Время ответа 6",
-        ]
-        
-        # Для корректного открытия в Excel (русская локаль) используем cp1251 и разделитель ;
-        with open(OUTPUT_FILE, "w", newline="", encoding="cp1251") as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=";")
-            writer.writeheader()
-            writer.writerows(rows)
-        
-        print(f"✅ Данные успешно экспортированы в {OUTPUT_FILE}")
-        print(f"📊 Всего пользователей: {len(rows)}")
-    else:
-        print("Нет данных для экспорта.")
+    # Участники идут в порядке user_data (как в прежних выгрузках), тексты ответов каждого берутся
+    # из базы по ключу; строки пишутся в файл сразу, без списка всех строк в памяти
+    answer_texts = AnswerTexts(answers_db_file)
+    exported = 0
+
+    # Для корректного открытия в Excel (русская локаль) используем cp1251 и разделитель ;
+    with open(OUTPUT_FILE, "w", newline="", encoding="cp1251") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES, delimiter=";")
+        writer.writeheader()
+
+        for user_id, data in user_data.items():
+            texts = answer_texts.get(int(user_id))
+
+            row = {
+                "ID пользователя": user_id,
+                "Имя пользователя": data.get("username", ""),
+                "Полное имя": data.get("full_name", ""),
+                "Номер розыгрыша": data.get("raffle_number", ""),
+                "Начало квеста": data.get("started_at", ""),
+                "Завершение квеста": data.get("completed_at", ""),
+            }
+
+            # Добавляем ответы на вопросы (в старых файлах текст может лежать прямо в user_data)
+            answers = data.get("answers", {})
+            for i in range(QUESTIONS_COUNT):
+                answer_data = answers.get(str(i), {})
+                row[f"Ответ на задание {i+1}"] = texts.get(i, answer_data.get("answer", ""))
+                row[f"Время ответа {i+1}"] = answer_data.get("timestamp", "")
+
+            writer.writerow(row)
+            exported += 1
+    answer_texts.close()
 
+    print(f"✅ Данные успешно экспортированы в {OUTPUT_FILE}")
+    print(f"📊 Всего пользователей: {exported}")
 
 if __name__ == "__main__":
     export_to_csv()
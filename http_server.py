@@ -0,0 +1,261 @@
+"""
+Минимальный HTTP/1.1-сервер на asyncio без сторонних зависимостей:
+вебхук Telegram, проверка здоровья, заглушка Bot API для нагрузочного теста.
+Поддерживает keep-alive и тела запросов с Content-Length (без chunked).
+"""
+import asyncio
+import email.policy
+import json
+import logging
+from email.parser import BytesParser
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Ограничения на размер запроса: обновления Telegram — единицы килобайт
+MAX_HEADER_SIZE = 16 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+# Сколько держать простаивающее keep-alive соединение
+KEEP_ALIVE_TIMEOUT = 30
+
+_REASONS = {
+    200: "OK",
+    204: "No Content",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method: str, path: str, query: Dict[str, str], headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        # Имена заголовков в нижнем регистре
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        """Тело запроса как JSON"""
+        if not self.body:
+            return {}
+        return json.loads(self.body)
+
+    def form(self) -> Dict[str, object]:
+        """
+        Поля формы (urlencoded или multipart/form-data) либо JSON-объект.
+        Файлы из multipart возвращаются как bytes.
+        """
+        content_type = self.headers.get("content-type", "")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return dict(parse_qsl(self.body.decode("utf-8")))
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + self.body
+            )
+            fields = {}
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                payload = part.get_payload(decode=True) or b""
+                fields[name] = payload if part.get_filename() else payload.decode("utf-8")
+            return fields
+        return self.json()
+
+
+class Response:
+    __slots__ = ("status", "body", "content_type", "headers")
+
+    def __init__(self, status: int = 200, body: bytes = b"", content_type: str = "text/plain; charset=utf-8",
+                 headers: Optional[Dict[str, str]] = None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+def json_response(data, status: int = 200) -> Response:
+    return Response(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+
+def text_response(text: str, status: int = 200) -> Response:
+    return Response(status, text.encode("utf-8"))
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class HTTPServer:
+    """
+    Маршруты — точные пути, route(method, path, handler) или route_prefix(...) для путей
+    вида /bot<token>/sendMessage. stop() перестаёт принимать соединения и дожидается
+    обработки уже принятых запросов.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, max_body_size: int = MAX_BODY_SIZE):
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._prefix_routes: list = []
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._connections: set = set()
+        self._tasks: set = set()
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._closing = False
+
+    def route(self, method: str, path: str, handler: Handler) -> None:
+        self._routes[(method.upper(), path)] = handler
+
+    def route_prefix(self, method: str, prefix: str, handler: Handler) -> None:
+        self._prefix_routes.append((method.upper(), prefix, handler))
+
+    @property
+    def in_flight(self) -> int:
+        """Сколько запросов сейчас обрабатывается"""
+        return self._in_flight
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # При port=0 система выбрала свободный порт
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"HTTP-сервер слушает {self.host}:{self.port}")
+
+    async def stop(self, timeout: float = 30) -> None:
+        """Закрывает сокет, ждёт завершения текущих запросов и закрывает соединения"""
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            if timeout:
+                logger.warning(f"HTTP-сервер: {self._in_flight} запросов не завершились за {timeout} с")
+        for writer in list(self._connections):
+            writer.close()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+            self._server = None
+
+    def _resolve(self, method: str, path: str) -> Tuple[Optional[Handler], int]:
+        handler = self._routes.get((method, path))
+        if handler is not None:
+            return handler, 200
+        for route_method, prefix, prefix_handler in self._prefix_routes:
+            if path.startswith(prefix) and route_method == method:
+                return prefix_handler, 200
+        known_path = any(p == path for _, p in self._routes) or any(path.startswith(p) for _, p, _ in self._prefix_routes)
+        return None, 405 if known_path else 404
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise _HTTPError(413)
+        if len(head) > MAX_HEADER_SIZE:
+            raise _HTTPError(413)
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _version = lines[0].split(" ", 2)
+        except ValueError:
+            raise _HTTPError(400)
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise _HTTPError(411)
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise _HTTPError(400)
+        if length > self.max_body_size:
+            raise _HTTPError(413)
+        body = await reader.readexactly(length) if length else b""
+
+        url = urlsplit(target)
+        return Request(method.upper(), url.path, dict(parse_qsl(url.query)), headers, body)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        self._tasks.add(asyncio.current_task())
+        try:
+            while not self._closing:
+                try:
+                    request = await self._read_request(reader)
+                except _HTTPError as e:
+                    await self._write(writer, Response(e.status, _REASONS[e.status].encode()), keep_alive=False)
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+
+                self._in_flight += 1
+                self._idle.clear()
+                try:
+                    response = await self._dispatch(request)
+                    keep_alive = request.headers.get("connection", "").lower() != "close" and not self._closing
+                    await self._write(writer, response, keep_alive)
+                finally:
+                    self._in_flight -= 1
+                    if self._in_flight == 0:
+                        self._idle.set()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            # Отмена при остановке сервера — соединение просто закрывается
+            pass
+        finally:
+            self._tasks.discard(asyncio.current_task())
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler, status = self._resolve(request.method, request.path)
+        if handler is None:
+            return Response(status, _REASONS[status].encode())
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Ошибка обработки {request.method} {request.path}: {e}", exc_info=True)
+            return Response(500, _REASONS[500].encode())
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+        reason = _REASONS.get(response.status, "")
+        headers = {
+            "Content-Type": response.content_type,
+            "Content-Length": str(len(response.body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+            **response.headers,
+        }
+        head = f"HTTP/1.1 {response.status} {reason}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + response.body)
+        await writer.drain()
+
+
+class _HTTPError(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
@@ -0,0 +1,148 @@
+"""
+Журнал изменений user_data: каждое событие (/start, переход к заданиям, ответ, завершение квеста)
+дописывается одной JSON-строкой в конец файла, а не переписывает весь user_data.json.
+Периодически журнал сворачивается в снимок (тот же формат, что и user_data.json).
+
+Сворачивание в два шага: rotate() откладывает текущий журнал в сегмент ".1" и сразу
+начинает новый, затем снимок записывается (можно в фоне) и сегмент удаляется.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+
+from persistence import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+def apply_event(user_data: dict, event: dict) -> None:
+    """Применяет одно событие журнала к словарю user_data"""
+    op = event.get("op")
+    user_id_str = str(event["user_id"])
+
+    if op == "start":
+        # Полная запись участника, как её создаёт /start
+        user_data[user_id_str] = event["record"]
+    elif op == "answer":
+        record = user_data.get(user_id_str)
+        if record is None:
+            logger.warning(f"Журнал: ответ для неизвестного пользователя {user_id_str}, пропускаем")
+            return
+        # Ключи ответов — строки, как после json.load из user_data.json.
+        # Текст ответа сейчас хранится в answers.db; он есть только в событиях из старых журналов
+        answer = {"timestamp": event["timestamp"]}
+        if "answer" in event:
+            answer["answer"] = event["answer"]
+        record.setdefault("answers", {})[str(event["index"])] = answer
+    elif op == "complete":
+        record = user_data.get(user_id_str)
+        if record is None:
+            logger.warning(f"Журнал: завершение для неизвестного пользователя {user_id_str}, пропускаем")
+            return
+        record["raffle_number"] = event["raffle_number"]
+        record["completed_at"] = event["completed_at"]
+    elif op == "stage":
+        record = user_data.get(user_id_str)
+        if record is None:
+            logger.warning(f"Журнал: этап для неизвестного пользователя {user_id_str}, пропускаем")
+            return
+        record["stage"] = event["stage"]
+    else:
+        logger.warning(f"Журнал: неизвестная операция {op!r}, пропускаем")
+        return
+
+    # Обновление, которое сделало это изменение (см. backlog.py), — в той же строке журнала
+    if "last_update_id" in event and user_id_str in user_data:
+        user_data[user_id_str]["last_update_id"] = event["last_update_id"]
+        user_data[user_id_str]["last_update_at"] = event["last_update_at"]
+
+
+class UserDataJournal:
+    """Append-only журнал поверх снимка user_data.json"""
+
+    def __init__(self, path: Path, snapshot_path: Path, compact_every: int = 500, fsync: bool = False):
+        self.path = Path(path)
+        self.snapshot_path = Path(snapshot_path)
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.rotated_path = self.path.with_name(self.path.name + ".1")
+        # Количество событий в журнале с момента последнего сворачивания
+        self.pending = 0
+        self._file = None
+
+    def replay(self, user_data: dict) -> int:
+        """Накатывает хвост журнала на загруженный снимок. Возвращает число применённых событий"""
+        applied = 0
+        # Сначала отложенный сегмент (если снимок после ротации не успел записаться), затем текущий
+        for path in (self.rotated_path, self.path):
+            if not path.exists():
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line_number, line in enumerate(f, start=1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная строка после аварийной остановки — дальше читать нечего
+                        logger.warning(f"Журнал {path}: повреждённая строка {line_number}, остаток пропущен")
+                        break
+                    apply_event(user_data, event)
+                    applied += 1
+
+        self.pending = applied
+        return applied
+
+    def append(self, event: dict, durable: bool = False) -> None:
+        """Дописывает событие в конец журнала; durable=True — с fsync, даже если он выключен для остальных"""
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self.fsync or durable:
+            os.fsync(self._file.fileno())
+        self.pending += 1
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self.pending >= self.compact_every
+
+    def rotate(self) -> bool:
+        """
+        Откладывает текущий журнал в сегмент ".1" и начинает новый.
+        Возвращает False, если предыдущий сегмент ещё не свёрнут в снимок.
+        """
+        if self.rotated_path.exists():
+            return False
+        self.close()
+        if self.path.exists():
+            os.replace(self.path, self.rotated_path)
+        self.pending = 0
+        return True
+
+    def write_snapshot(self, user_data: dict | str) -> None:
+        """
+        Атомарно записывает снимок (user_data или уже готовый JSON-текст, см. records.ParticipantsJson)
+        и удаляет отложенный сегмент, если он был до начала записи.
+        Если упадём между заменой снимка и удалением сегмента, повторное применение событий безопасно.
+        """
+        had_rotated = self.rotated_path.exists()
+        write_json_atomic(self.snapshot_path, user_data)
+        if had_rotated:
+            self.rotated_path.unlink()
+
+    def compact(self, user_data: dict | str) -> None:
+        """Сворачивает журнал синхронно: снимок уже содержит все события, оба сегмента удаляются"""
+        self.close()
+        self.write_snapshot(user_data)
+        for path in (self.rotated_path, self.path):
+            if path.exists():
+                path.unlink()
+        self.pending = 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,336 @@
+"""
+Поиск понятий в ответах участников.
+Ключ ответов (понятие -> варианты написания) компилируется один раз в одно регулярное выражение,
+и все понятия находятся за один проход по тексту. Для понятий, которые не нашлись точно,
+опечатки ищутся по заранее построенному индексу удалений (symmetric deletion, как в SymSpell).
+Вариант должен начинаться с начала слова. Короткие варианты ("ии", "hi") засчитываются только
+целым словом — иначе они находятся внутри других слов ("линии", "this"), а длинные — и с окончанием
+("нейросетью", "приветик").
+"""
+import functools
+import re
+
+# Всё, кроме букв и цифр (пробелы, знаки препинания, эмодзи), разделяет слова:
+# любая последовательность таких символов равнозначна одному пробелу
+_SEPARATOR_CHARS = r"[\W_]"
+_SEPARATORS = re.compile(_SEPARATOR_CHARS + "+")
+_WORDS = re.compile(r"[^\W_]+")
+# Граница слова: рядом нет буквы или цифры
+_WORD_START = r"(?<![^\W_])"
+_WORD_END = r"(?![^\W_])"
+
+
+def _trie_pattern(words, whole_word) -> str:
+    """
+    Регулярное выражение для набора слов в виде префиксного дерева: общие начала
+    проверяются один раз, и движок не перебирает все варианты в каждой позиции текста.
+    Из нескольких слов, совпадающих в одной позиции, выбирается самое длинное.
+    Пробел в слове совпадает с любой последовательностью разделителей, поэтому текст не нужно нормализовать.
+    Совпадение начинается на границе слова; слова, для которых whole_word(слово) истинно, должны
+    и заканчиваться на ней, остальные могут продолжаться окончанием (в совпадение оно не входит).
+    """
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = _WORD_END if whole_word(word) else ""
+
+    def build(node: dict) -> str:
+        branches = [
+            (_SEPARATOR_CHARS + "+" if char == " " else re.escape(char)) + build(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        end = node.get("")
+        if not branches:
+            return end
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if end is None:
+            return body
+        # Слово может закончиться здесь: продолжение жадно пробуется первым
+        return f"(?:{body}|{end})" if end else f"(?:{body})?"
+
+    return _WORD_START + f"(?:{build(trie)})"
+
+
+def _whole_word_only(variant: str) -> bool:
+    """Короткий вариант ("ии", "cv") с окончанием — почти всегда другое слово ("линии")"""
+    return len(variant) < MIN_TYPO_WORD
+
+
+# Правила опечаток по умолчанию (если для понятия не задан max_distance). В словах короче MIN_TYPO_WORD
+# опечаток не бывает ("ии", "cv", "hi" — только точно). В словах короче LONG_WORD прощается только
+# перестановка соседних букв ("пирвет"): замена или пропуск буквы в коротком слове слишком часто
+# дают другое слово ("привез", "hell")
+MIN_TYPO_WORD = 4
+LONG_WORD = 7
+# Индекс удалений строится по началу варианта такой длины: число удалений не растёт с длиной слова
+FUZZY_PREFIX_LENGTH = 7
+# Сколько слов ответов помнить вместе с найденными для них словами вариантов
+WORD_CACHE_SIZE = 4096
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Расстояние Дамерау — Левенштейна (вставка, удаление, замена, перестановка соседних символов).
+    Если оно больше max_distance, возвращает max_distance + 1, не досчитывая до конца.
+    """
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # Считается только полоса |i - j| <= max_distance: за её пределами расстояние заведомо больше
+    over = max_distance + 1
+    length_b = len(b)
+    previous2 = None
+    previous = [j if j <= max_distance else over for j in range(length_b + 1)]
+    for i in range(1, len(a) + 1):
+        char_a = a[i - 1]
+        current = [over] * (length_b + 1)
+        current[0] = row_min = i if i <= max_distance else over
+        for j in range(max(1, i - max_distance), min(length_b, i + max_distance) + 1):
+            char_b = b[j - 1]
+            value = previous[j - 1] if char_a == char_b else previous[j - 1] + 1
+            if previous[j] < value:
+                value = previous[j] + 1
+            if current[j - 1] < value:
+                value = current[j - 1] + 1
+            if (previous2 is not None and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b
+                    and previous2[j - 2] < value):
+                value = previous2[j - 2] + 1
+            if value > over:
+                value = over
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return over
+        previous2, previous = previous, current
+    return previous[length_b]
+
+
+def typo_allowed(word: str, variant: str) -> bool:
+    """
+    Можно ли засчитать word как одно слово variant с одной опечаткой: перестановка соседних букв,
+    а в длинных словах ещё пропуск буквы ("машиное"), замена или повтор соседней ("обученние").
+    Лишняя буква, которая не повторяет соседнюю, не прощается: так получаются другие слова ("облучение")
+    """
+    if len(variant) < MIN_TYPO_WORD or edit_distance(word, variant, 1) != 1:
+        return False
+    return _one_edit_allowed(word, variant)
+
+
+def _one_edit_allowed(word: str, variant: str) -> bool:
+    """typo_allowed для слов, которые уже точно отличаются одной правкой"""
+    if len(word) == len(variant):
+        diff = [i for i, (a, b) in enumerate(zip(word, variant)) if a != b]
+        if len(diff) == 2 and diff[1] == diff[0] + 1:
+            return True
+        return len(variant) >= LONG_WORD
+    if len(variant) < LONG_WORD:
+        return False
+    if len(word) < len(variant):
+        return True
+    # Лишняя буква word[i]: первая позиция, где слова расходятся
+    i = next((i for i, (a, b) in enumerate(zip(word, variant)) if a != b), len(variant))
+    return (i > 0 and word[i - 1] == word[i]) or (i + 1 < len(word) and word[i + 1] == word[i])
+
+
+def _same_or_typo(word: str, variant: str) -> bool:
+    """Проверка пары из индекса слов: расстояние уже не больше 1"""
+    return word == variant or _one_edit_allowed(word, variant)
+
+
+@functools.lru_cache(maxsize=4096)
+def _deletes(word: str, max_distance: int) -> frozenset:
+    """
+    Все строки, получающиеся из word удалением не более max_distance символов.
+    Слова в ответах участников повторяются, поэтому наборы для начал слов кэшируются.
+    """
+    result = {word}
+    level = {word}
+    for _ in range(max_distance):
+        level = {w[:i] + w[i + 1:] for w in level for i in range(len(w))}
+        result |= level
+    return frozenset(result)
+
+
+def _word_distance(word: str, max_distance: int) -> int:
+    """Правок в слове меньше половины его длины: иначе "ии" с двумя правками — любое слово из двух букв"""
+    return min(max_distance, (len(word) - 1) // 2)
+
+
+class FuzzyIndex:
+    """
+    Индекс слов с допустимым числом опечаток: {слово: (ключ, max_distance)}.
+    Поиск не перебирает слова — сравниваются удаления из начала слова и запроса,
+    поэтому время не зависит от числа слов в индексе. accept(запрос, слово) — дополнительная
+    проверка найденной пары (например, какие опечатки допустимы).
+    """
+
+    def __init__(self, terms: dict[str, tuple[object, int]], prefix_length: int = FUZZY_PREFIX_LENGTH,
+                 accept=None):
+        self.prefix_length = prefix_length
+        self.accept = accept
+        self.terms = {term: limit for term, limit in terms.items() if limit[1] > 0}
+        self.max_distance = max((d for _, d in self.terms.values()), default=0)
+        self._deletes: dict[str, list[str]] = {}
+        for term, (_, distance) in self.terms.items():
+            for deleted in _deletes(term[:prefix_length], distance):
+                self._deletes.setdefault(deleted, []).append(term)
+        lengths = [len(term) for term in self.terms]
+        self._min_length = min(lengths, default=0) - self.max_distance
+        self._max_length = max(lengths, default=0) + self.max_distance
+
+    def __bool__(self) -> bool:
+        return bool(self.terms)
+
+    def lookup(self, candidate: str, exclude: set = frozenset()) -> set:
+        """
+        Ключи слов, от которых candidate отличается не больше чем на их допустимое число опечаток.
+        Слова с ключами из exclude (например, уже найденными точно) не сравниваются.
+        """
+        if not self._min_length <= len(candidate) <= self._max_length:
+            return set()
+        keys = set()
+        checked = set()
+        for deleted in _deletes(candidate[:self.prefix_length], self.max_distance):
+            for term in self._deletes.get(deleted, ()):
+                if term in checked:
+                    continue
+                checked.add(term)
+                key, distance = self.terms[term]
+                if key in exclude or key in keys:
+                    continue
+                if edit_distance(candidate, term, distance) <= distance and (
+                        self.accept is None or self.accept(candidate, term)):
+                    keys.add(key)
+        return keys
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, знаки препинания и прочие разделители -> пробел, без повторяющихся пробелов"""
+    return _SEPARATORS.sub(" ", text.lower()).strip()
+
+
+class ConceptMatcher:
+    """
+    concepts: {понятие: [варианты написания]}, порядок понятий сохраняется в missing().
+    Вариант засчитывается, если встречается в нормализованном тексте с начала слова
+    (короткий, меньше MIN_TYPO_WORD букв, — только целым словом, длинный — и с окончанием),
+    а при max_typos — и с опечатками: до max_typos[понятие] (или max_typos, если это число)
+    слов с опечаткой. Сколько правок допустимо в одном слове, задаёт max_distance[понятие]
+    (или max_distance, если это число; см. _word_distance); без него — одна правка по правилам typo_allowed.
+    """
+
+    def __init__(self, concepts: dict[str, list[str]], max_typos: dict[str, int] | int = 0,
+                 max_distance: dict[str, int] | int | None = None):
+        self.concepts = list(concepts)
+        own: dict[str, set] = {}
+        for concept, spellings in concepts.items():
+            for spelling in spellings:
+                variant = normalize(spelling)
+                if variant:
+                    own.setdefault(variant, set()).add(concept)
+
+        # Вариант -> (все понятия, чьи варианты в нём содержатся, — найдя его, находим и их;
+        # может ли его конец быть началом варианта другого понятия, как "computer vision" + "nn")
+        self._variants: dict[str, tuple[set, bool]] = {}
+        for variant in own:
+            owners = set().union(*(concepts_ for other, concepts_ in own.items() if f" {other} " in f" {variant} "))
+            overlapping = any(
+                f"{other} ".startswith(variant[k:] + " ") and len(other) > len(variant) - k
+                and not own[other] <= owners
+                for k in range(1, len(variant)) if variant[k - 1] == " "
+                for other in own
+            )
+            self._variants[variant] = (owners, overlapping)
+        # Одно выражение на все варианты; в каждой позиции совпадает самый длинный из них
+        self._pattern = re.compile(_trie_pattern(own, _whole_word_only)) if own else None
+
+        # Опечатки ищутся по словам. Слова вариантов делятся по допустимому числу правок в слове
+        # (None — правила по умолчанию), для каждой группы свой индекс. Варианты — по первому слову:
+        # (первое слово, группа) -> [(слова варианта, понятие, сколько слов с опечаткой можно)]
+        self._phrases: dict[tuple, list[tuple[tuple, str, int]]] = {}
+        words: dict[int | None, set] = {}
+        for concept, spellings in concepts.items():
+            limit = max_typos.get(concept, 0) if isinstance(max_typos, dict) else max_typos
+            distance = max_distance.get(concept) if isinstance(max_distance, dict) else max_distance
+            for spelling in spellings:
+                variant = tuple(normalize(spelling).split(" "))
+                if limit <= 0 or distance == 0 or not variant[0]:
+                    continue
+                if distance is None and all(len(word) < MIN_TYPO_WORD for word in variant):
+                    continue
+                self._phrases.setdefault((variant[0], distance), []).append((variant, concept, limit))
+                words.setdefault(distance, set()).update(variant)
+        self._words = {distance: frozenset(group) for distance, group in words.items()}
+        self._fuzzy = {
+            distance: (
+                FuzzyIndex({word: (word, 1) for word in group if len(word) >= MIN_TYPO_WORD}, accept=_same_or_typo)
+                if distance is None else FuzzyIndex({word: (word, _word_distance(word, distance)) for word in group})
+            )
+            for distance, group in words.items()
+        }
+        # Слово ответа -> (слово варианта, группа), которыми оно может быть; слова у участников повторяются
+        self._word_cache: dict[str, frozenset] = {}
+
+    def _lookup(self, variant: str) -> tuple[set, bool]:
+        # Нормализуем только совпадения с разделителями, отличными от одного пробела
+        return self._variants.get(variant) or self._variants[normalize(variant)]
+
+    def find(self, text: str) -> set:
+        """Понятия, найденные в тексте"""
+        if self._pattern is None:
+            return set()
+        text = text.lower()
+        found = set()
+        for match in self._pattern.finditer(text):
+            owners, overlapping = self._lookup(match.group())
+            found |= owners
+            if overlapping:
+                # Совпадение поглотило текст: ищем варианты, которые начинаются внутри него
+                for pos in range(match.start() + 1, match.end()):
+                    inner = self._pattern.match(text, pos)
+                    if inner is not None:
+                        found |= self._lookup(inner.group())[0]
+            if len(found) == len(self.concepts):
+                break
+        if self._phrases and len(found) < len(self.concepts):
+            found |= self._find_fuzzy(text, found)
+        return found
+
+    def _candidates(self, word: str) -> frozenset:
+        """Слова вариантов (с группой), которыми может быть слово ответа (точно или с опечаткой)"""
+        cache = self._word_cache
+        candidates = cache.get(word)
+        if candidates is None:
+            if len(cache) >= WORD_CACHE_SIZE:
+                cache.clear()
+            candidates = cache[word] = frozenset(
+                (variant_word, distance)
+                for distance, index in self._fuzzy.items()
+                for variant_word in index.lookup(word) | ({word} & self._words[distance])
+            )
+        return candidates
+
+    def _find_fuzzy(self, text: str, found: set) -> set:
+        """Понятия, которых нет точно, но есть с опечатками: слова текста подряд совпадают со словами варианта"""
+        words = _WORDS.findall(text)
+        candidates = [self._candidates(word) for word in words]
+        result = set()
+        for start, first in enumerate(candidates):
+            for first_word, distance in first:
+                for variant, concept, limit in self._phrases.get((first_word, distance), ()):
+                    if concept in found or concept in result or start + len(variant) > len(words):
+                        continue
+                    if all((variant[k], distance) in candidates[start + k] for k in range(1, len(variant))):
+                        typos = sum(words[start + k] != variant[k] for k in range(len(variant)))
+                        if typos <= limit:
+                            result.add(concept)
+        return result
+
+    def missing(self, text: str) -> list:
+        """Понятия, которых нет в тексте, в порядке из ключа ответов"""
+        found = self.find(text)
+        return [concept for concept in self.concepts if concept not in found]
@@ -0,0 +1,94 @@
+"""
+Кэш file_id загруженных в Telegram картинок: каждый файл загружается один раз,
+дальше отправляется по file_id. Запись сбрасывается, если содержимое файла изменилось.
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from persistence import write_json_atomic
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не обязателен: без него картинка отправляется как есть
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    """Путь к файлу -> (sha256 содержимого, file_id в Telegram), хранится в JSON"""
+
+    def __init__(self, cache_file: Path):
+        self.cache_file = Path(cache_file)
+        self._entries = {}
+        # Путь -> ((mtime_ns, size), sha256), чтобы не пересчитывать хэш на каждый /start
+        self._hashes = {}
+        if self.cache_file.exists():
+            try:
+                with open(self.cache_file, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Не удалось прочитать {self.cache_file}, кэш медиа сброшен: {e}")
+
+    def _sha256(self, path: Path) -> str:
+        stat = path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(str(path))
+        if cached and cached[0] == key:
+            return cached[1]
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        self._hashes[str(path)] = (key, digest)
+        return digest
+
+    def get(self, path: Path) -> str | None:
+        """file_id для файла или None, если файл ещё не загружался или изменился"""
+        entry = self._entries.get(str(path))
+        if not entry:
+            return None
+        if entry.get("sha256") != self._sha256(Path(path)):
+            logger.info(f"Файл {path} изменился — будет загружен заново")
+            self.forget(path)
+            return None
+        return entry.get("file_id")
+
+    def remember(self, path: Path, file_id: str) -> None:
+        self._entries[str(path)] = {"sha256": self._sha256(Path(path)), "file_id": file_id}
+        self._save()
+
+    def forget(self, path: Path) -> None:
+        if self._entries.pop(str(path), None) is not None:
+            self._save()
+
+    def _save(self):
+        write_json_atomic(self.cache_file, self._entries)
+
+
+def prepare_jpeg(source: Path, quality: int = 85, max_side: int = 1080) -> Path | None:
+    """
+    Конвертирует картинку в оптимизированный JPEG рядом с исходником (welcome.png -> welcome.jpg).
+    Прозрачность заливается белым. Возвращает путь к JPEG или None, если Pillow не установлен.
+    """
+    if Image is None:
+        logger.warning("Pillow не установлен — картинка будет отправляться без конвертации в JPEG")
+        return None
+
+    source = Path(source)
+    target = source.with_suffix(".jpg")
+    if target.exists() and target.stat().st_mtime_ns >= source.stat().st_mtime_ns:
+        return target
+
+    with Image.open(source) as image:
+        image.thumbnail((max_side, max_side))
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        else:
+            image = image.convert("RGB")
+        image.save(target, "JPEG", quality=quality, optimize=True, progressive=True)
+
+    logger.info(f"{source} сконвертирован в {target}: {source.stat().st_size} -> {target.stat().st_size} байт")
+    return target
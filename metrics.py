@@ -0,0 +1,279 @@
+"""
+Метрики бота в текстовом формате Prometheus (без prometheus_client): счётчики, значения
+и гистограммы задержек, страница GET /metrics на отдельном локальном порту (METRICS_PORT).
+
+Интерфейс — как у prometheus_client: HISTOGRAM.labels("start").observe(секунды),
+COUNTER.labels("NetworkError").inc(), @timed(HISTOGRAM, "start") для функций и корутин.
+Замеры приходят и из event loop, и из потока фоновой записи — каждая метрика под своей блокировкой.
+"""
+import bisect
+import functools
+import inspect
+import logging
+import math
+import threading
+import time
+from typing import Callable, Optional, Sequence
+
+from http_server import HTTPServer, Request, Response
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин гистограмм, секунды: от записи в SQLite до медленной выгрузки /export
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        # Значения меток -> дочерняя метрика (без меток — одна дочерняя с ключом ())
+        self._children: dict[tuple, object] = {}
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получено {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self, lock: threading.Lock):
+        self._lock = lock
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.labelnames:
+            self.labels()
+
+    def _new_child(self):
+        return _CounterChild(self._lock)
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            children = list(self._children.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+                for key, child in children]
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.function = function
+
+
+class Gauge(_Metric):
+    """Текущее значение; set_function() — значение считается в момент запроса /metrics"""
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.labelnames:
+            self.labels()
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            children = list(self._children.items())
+        lines = []
+        for key, child in children:
+            if child.function is not None:
+                try:
+                    value = child.function()
+                except Exception as e:
+                    logger.warning(f"Метрика {self.name} не посчитана: {e!r}")
+                    continue
+            else:
+                value = child.value
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_upper_bounds", "counts", "sum")
+
+    def __init__(self, lock: threading.Lock, upper_bounds: tuple):
+        self._lock = lock
+        self._upper_bounds = upper_bounds
+        # Счётчики по корзинам без накопления (последняя — +Inf); накопленные считаются при выводе
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        index = bisect.bisect_left(self._upper_bounds, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+    def time(self):
+        """Декоратор: время выполнения функции или корутины"""
+        return _timed(self.observe)
+
+
+class Histogram(_Metric):
+    """Распределение значений (задержек в секундах) по корзинам"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None):
+        self._upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+        if not self.labelnames:
+            self.labels()
+
+    def _new_child(self):
+        return _HistogramChild(self._lock, self._upper_bounds)
+
+    def observe(self, seconds: float) -> None:
+        self.labels().observe(seconds)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            children = [(key, list(child.counts), child.sum) for key, child in self._children.items()]
+        lines = []
+        for key, counts, total in children:
+            cumulative = 0
+            for upper_bound, count in zip(self._upper_bounds + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(upper_bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def _timed(observe: Callable[[float], None]):
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    observe(time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def timed(histogram: Histogram, *labels):
+    """Декоратор: время выполнения функции или корутины в histogram с метками labels"""
+    return histogram.labels(*labels).time()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class MetricsServer:
+    """GET /metrics на host:port; запускается и останавливается вместе с ботом"""
+
+    def __init__(self, host: str, port: int, registry: Registry = REGISTRY):
+        self.registry = registry
+        self.server = HTTPServer(host, port)
+        self.server.route("GET", METRICS_PATH, self._handle)
+
+    async def _handle(self, request: Request) -> Response:
+        return Response(200, self.registry.render().encode("utf-8"), CONTENT_TYPE)
+
+    async def start(self) -> None:
+        await self.server.start()
+        logger.info(f"Метрики: http://{self.server.host}:{self.server.port}{METRICS_PATH}")
+
+    async def stop(self) -> None:
+        await self.server.stop(timeout=1)
@@ -0,0 +1,377 @@
+"""
+Ограничение исходящих запросов к Telegram Bot API: общий лимит и лимит на чат (token bucket),
+очередь с приоритетами и автоматический повтор после RetryAfter.
+
+Подключается к Application через ApplicationBuilder.rate_limiter(...) и видит все запросы бота,
+кроме getUpdates. Сообщения в один чат уходят строго по очереди, между чатами —
+сначала ответы участникам и задания, потом тяжёлые выгрузки (/export). Приоритет стареет:
+запрос, который ждёт дольше priority_aging секунд, догоняет более приоритетные, поэтому
+поток HIGH не может задержать остальные бесконечно.
+
+Глубина очереди и ожидание по приоритетам — в stats(); ожидание каждого запроса ещё и передаётся
+в observe_wait(приоритет, секунды) для метрик.
+
+TimedRequest — обёртка над HTTP-клиентом бота, которая сообщает длительность и ошибку
+каждого запроса к Bot API (для метрик).
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from telegram.request import BaseRequest
+
+logger = logging.getLogger(__name__)
+
+# Первое сообщение в чат (приветствие нового участника) — раньше всех остальных
+PRIORITY_FIRST_CONTACT = -1
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_FIRST_CONTACT: "first_contact",
+    PRIORITY_HIGH: "high",
+    PRIORITY_NORMAL: "normal",
+    PRIORITY_BULK: "bulk",
+}
+
+# Приоритет по методу API, если он не передан явно через rate_limit_args={"priority": ...}
+ENDPOINT_PRIORITIES = {
+    "answerCallbackQuery": PRIORITY_HIGH,
+    "sendMessage": PRIORITY_HIGH,
+    "sendPhoto": PRIORITY_HIGH,
+    "editMessageText": PRIORITY_HIGH,
+    "editMessageCaption": PRIORITY_HIGH,
+    "sendDocument": PRIORITY_BULK,
+}
+
+# Сколько последних замеров ожидания хранить для перцентилей
+_WAIT_SAMPLES = 1000
+# Как часто удалять лимиты чатов, которые давно не получали сообщений, секунды
+_BUCKET_SWEEP_INTERVAL = 60.0
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше capacity про запас"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд появится токен (0 — есть сейчас)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "chat_key", "future", "enqueued_at")
+
+    def __init__(self, priority: int, seq: int, chat_key, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_key = chat_key
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """
+    Выдаёт разрешения на запросы с учётом общего лимита (overall_rate в секунду)
+    и лимита на чат (private_chat_rate для личных чатов, group_chat_rate для групп).
+    """
+
+    def __init__(
+        self,
+        overall_rate: float = 30,
+        private_chat_rate: float = 1,
+        group_chat_rate: float = 20 / 60,
+        chat_burst: float = 12,
+        max_retries: int = 3,
+        priority_aging: float = 1.0,
+        observe_wait: Optional[Callable[[str, float], None]] = None,
+    ):
+        self.overall = TokenBucket(overall_rate, overall_rate)
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.priority_aging = priority_aging
+        self.observe_wait = observe_wait
+
+        self._seq = itertools.count()
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._next_sweep = time.monotonic() + _BUCKET_SWEEP_INTERVAL
+        # Очередь каждого чата (FIFO) и куча чатов, чья голова очереди готова к отправке.
+        # Порядок в куче — по «сроку»: время постановки + priority_aging секунд за каждую ступень приоритета
+        self._chat_queues: Dict[Any, deque] = {}
+        self._ready: list = []
+        # Чаты, которые ждут токен своего лимита: (когда будет готов, seq, ключ чата)
+        self._delayed: list = []
+        # Чаты, чей запрос сейчас выполняется: следующий уйдёт только после ответа на него
+        self._busy: set = set()
+        # Telegram попросил подождать (RetryAfter) — до этого момента не отправляем ничего
+        self._paused_until = 0.0
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        # Статистика
+        self._depth_by_priority = {p: 0 for p in PRIORITY_NAMES}
+        self._waits = {p: deque(maxlen=_WAIT_SAMPLES) for p in PRIORITY_NAMES}
+        self._granted = {p: 0 for p in PRIORITY_NAMES}
+        self.retries = 0
+
+    async def initialize(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch(), name="outbound-rate-limiter")
+
+    async def shutdown(self) -> None:
+        # Bot.shutdown() может вызываться повторно
+        if self._dispatcher is None:
+            return
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+        self._dispatcher = None
+        # Всё, что не успело уйти, отменяем — запросы получат CancelledError
+        for queue in self._chat_queues.values():
+            for waiter in queue:
+                waiter.future.cancel()
+        self._chat_queues.clear()
+        logger.info(f"Статистика исходящих запросов: {self.stats()}")
+
+    # --- Очередь ---
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные id — группы и каналы, у них лимит строже
+            rate = self.group_chat_rate if isinstance(chat_id, int) and chat_id < 0 else self.private_chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _sweep_buckets(self, now: float):
+        """
+        Удаляет лимиты чатов, которые простояли дольше полного пополнения: такой лимит полон,
+        и новый, созданный при следующем сообщении, ничем от него не отличается
+        """
+        idle = [
+            chat_id for chat_id, bucket in self._chat_buckets.items()
+            if now - bucket.updated >= bucket.capacity / bucket.rate
+            and ("chat", chat_id) not in self._chat_queues and ("chat", chat_id) not in self._busy
+        ]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+
+    def _schedule_chat(self, chat_key, now: float):
+        """Ставит чат в кучу готовых или отложенных по голове его очереди"""
+        head = self._chat_queues[chat_key][0]
+        chat_id = chat_key[1]
+        delay = 0.0 if chat_id is None else self._chat_bucket(chat_id).delay(now)
+        if delay <= 0:
+            deadline = head.enqueued_at + head.priority * self.priority_aging
+            heapq.heappush(self._ready, (deadline, head.seq, chat_key))
+        else:
+            heapq.heappush(self._delayed, (now + delay, head.seq, chat_key))
+
+    def _enqueue(self, waiter: _Waiter, front: bool = False):
+        queue = self._chat_queues.get(waiter.chat_key)
+        if queue is None:
+            queue = self._chat_queues[waiter.chat_key] = deque()
+        was_idle = not queue
+        if front:
+            queue.appendleft(waiter)
+        else:
+            queue.append(waiter)
+        self._depth_by_priority[waiter.priority] += 1
+        if (was_idle or front) and waiter.chat_key not in self._busy:
+            # Новая голова очереди — планируем чат заново (старая запись в куче станет устаревшей)
+            self._schedule_chat(waiter.chat_key, time.monotonic())
+        self._wakeup.set()
+
+    def _release(self, chat_key):
+        """Запрос в чат выполнен — можно выдавать разрешение следующему"""
+        self._busy.discard(chat_key)
+        if self._chat_queues.get(chat_key):
+            self._schedule_chat(chat_key, time.monotonic())
+            self._wakeup.set()
+        else:
+            self._chat_queues.pop(chat_key, None)
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self._sweep_buckets(now)
+                self._next_sweep = now + _BUCKET_SWEEP_INTERVAL
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, chat_key = heapq.heappop(self._delayed)
+                if self._chat_queues.get(chat_key):
+                    self._schedule_chat(chat_key, now)
+
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Общий лимит Telegram — на сообщения в чаты: запросы без чата (answerCallbackQuery и т. п.) его не тратят
+            metered = self._ready[0][2][1] is not None
+            pause = max(self._paused_until - now, self.overall.delay(now) if metered else 0.0)
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+
+            _, seq, chat_key = heapq.heappop(self._ready)
+            queue = self._chat_queues.get(chat_key)
+            if not queue or queue[0].seq != seq:
+                # Устаревшая запись: голова очереди уже другая
+                continue
+
+            waiter = queue.popleft()
+            if chat_key[1] is not None:
+                self.overall.consume(now)
+                self._chat_bucket(chat_key[1]).consume(now)
+            self._depth_by_priority[waiter.priority] -= 1
+            self._granted[waiter.priority] += 1
+            self._waits[waiter.priority].append(now - waiter.enqueued_at)
+            if self.observe_wait is not None:
+                self.observe_wait(PRIORITY_NAMES[waiter.priority], now - waiter.enqueued_at)
+            if waiter.future.done():
+                # Запрос отменили, пока он ждал в очереди
+                self._release(chat_key)
+            else:
+                self._busy.add(chat_key)
+                waiter.future.set_result(None)
+
+    # --- BaseRateLimiter ---
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[dict],
+    ):
+        priority = ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_NORMAL)
+        if isinstance(rate_limit_args, dict) and "priority" in rate_limit_args:
+            priority = rate_limit_args["priority"]
+
+        chat_id = data.get("chat_id")
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+        if priority == PRIORITY_HIGH and chat_id is not None and chat_id not in self._chat_buckets:
+            # Первое сообщение в чат (обычно приветствие после /start): новый участник не ждёт в общей очереди.
+            # Так же уходит и первое сообщение после долгой паузы (лимит чата к тому времени удалён)
+            priority = PRIORITY_FIRST_CONTACT
+        # Ключ очереди: (метка, chat_id). Запросы без чата не ждут друг друга — у каждого своя очередь
+        chat_key = ("chat", chat_id) if chat_id is not None else (f"request-{next(self._seq)}", None)
+
+        attempt = 0
+        front = False
+        while True:
+            waiter = _Waiter(priority, next(self._seq), chat_key, asyncio.get_running_loop().create_future())
+            self._enqueue(waiter, front=front)
+            await waiter.future
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.retries += 1
+                retry_after = float(e.retry_after)
+                logger.warning(
+                    f"{endpoint}: превышен лимит Telegram, повтор через {retry_after} с "
+                    f"(попытка {attempt} из {self.max_retries})"
+                )
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                # Повторный запрос встаёт в начало очереди своего чата, чтобы не нарушить порядок
+                front = True
+                self._busy.discard(chat_key)
+            finally:
+                if chat_key in self._busy:
+                    self._release(chat_key)
+
+    # --- Статистика ---
+
+    def queue_depth(self) -> dict:
+        return {PRIORITY_NAMES[p]: depth for p, depth in self._depth_by_priority.items()}
+
+    def stats(self) -> dict:
+        """Глубина очереди и время ожидания разрешения по приоритетам (в миллисекундах)"""
+        result = {"queue_depth": self.queue_depth(), "retries": self.retries, "wait_ms": {}}
+        for priority, samples in self._waits.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            result["wait_ms"][PRIORITY_NAMES[priority]] = {
+                "granted": self._granted[priority],
+                "avg": round(sum(ordered) / len(ordered) * 1000, 2),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+                "max": round(ordered[-1] * 1000, 2),
+            }
+        return result
+
+
+class TimedRequest(BaseRequest):
+    """
+    Передаёт запросы в request и вызывает observe(метод API, секунды, исключение или None)
+    после каждого — в том числе для RetryAfter и ошибок сети, которые разбирает BaseRequest.post
+    """
+
+    def __init__(self, request: BaseRequest, observe: Callable[[str, float, Optional[Exception]], None]):
+        self._request = request
+        self._observe = observe
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self._request.read_timeout
+
+    async def initialize(self) -> None:
+        await self._request.initialize()
+
+    async def shutdown(self) -> None:
+        await self._request.shutdown()
+
+    async def post(self, url: str, request_data=None, **timeouts):
+        started = time.perf_counter()
+        error = None
+        try:
+            return await self._request.post(url, request_data, **timeouts)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._observe(url.rsplit("/", 1)[-1], time.perf_counter() - started, error)
+
+    async def do_request(self, *args, **kwargs):
+        return await self._request.do_request(*args, **kwargs)
@@ -0,0 +1,341 @@
+"""
+Исходящие сообщения участникам через outbox (SQLite): сообщение записывается в базу до отправки
+и удаляется, когда Telegram его принял. Если отправка не удалась из-за сети (NetworkError, TimedOut)
+или лимитов (RetryAfter), обработчик не падает: сообщение остаётся в outbox, и фоновая задача
+повторяет отправку с нарастающей паузой. После перезапуска неотправленное уходит первым делом.
+
+Сообщения одного чата уходят строго по порядку: пока в чате есть неотправленное сообщение,
+новые встают за ним. Повтором считается не одинаковый текст (участник может дважды получить одну
+и ту же подсказку), а то же по счёту сообщение того же обновления Telegram: ключ — update_id
+и номер сообщения в его обработке. Обновление, которое Telegram прислал снова после аварийной остановки,
+не отправит ответы второй раз: ключи отправленных сообщений хранятся сутки (SENT_KEYS_MAX_AGE).
+Сообщения не из обработчиков обновлений (задания по таймеру) ключа не имеют и не сравниваются.
+Сама отправка (deliver) — функция бота: outbox хранит только вид сообщения и его параметры.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = Path("outbox.db")
+
+OUTBOX_TABLE = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    dedup_key TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+)
+"""
+
+SCHEMA = OUTBOX_TABLE + """;
+CREATE INDEX IF NOT EXISTS idx_outbox_chat ON outbox(chat_id, id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_dedup ON outbox(dedup_key);
+CREATE TABLE IF NOT EXISTS outbox_sent (
+    dedup_key TEXT PRIMARY KEY,
+    sent_at REAL NOT NULL
+);
+"""
+
+# Пауза перед повтором: BASE_DELAY, дальше вдвое больше, но не больше MAX_DELAY.
+# После MAX_ATTEMPTS неудач подряд (около получаса) сообщение выбрасывается
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+MAX_ATTEMPTS = 40
+# Как часто фоновая задача проверяет outbox, если её не будят
+IDLE_INTERVAL = 5.0
+# Сколько хранить ключи отправленных сообщений: столько Telegram хранит неполученные обновления
+SENT_KEYS_MAX_AGE = 24 * 3600
+# Как часто удалять устаревшие ключи
+SENT_KEYS_PRUNE_INTERVAL = 3600
+
+# (update_id, сколько сообщений уже отправлено при его обработке); у каждого обновления своя задача asyncio
+_update_sequence: contextvars.ContextVar = contextvars.ContextVar("outbox_update_sequence", default=None)
+
+# deliver(bot, chat_id, kind, params) — отправляет сообщение; исключения Telegram пробрасывает
+Deliver = Callable[[object, int, str, dict], Awaitable[object]]
+
+
+def is_transient(error: Exception) -> bool:
+    """Ошибка, после которой отправку стоит повторить (BadRequest — тоже NetworkError, но не временная)"""
+    if isinstance(error, RetryAfter):
+        return True
+    return isinstance(error, NetworkError) and not isinstance(error, BadRequest)
+
+
+def _dedup_key(update_id: Optional[int]) -> Optional[str]:
+    """Ключ очередного сообщения обновления update_id: "update_id:номер" (нумерация с 1)"""
+    if update_id is None:
+        return None
+    sequence = _update_sequence.get()
+    number = sequence[1] + 1 if sequence is not None and sequence[0] == update_id else 1
+    _update_sequence.set((update_id, number))
+    return f"{update_id}:{number}"
+
+
+def _dump_params(params: dict) -> str:
+    params = dict(params)
+    if isinstance(params.get("reply_markup"), InlineKeyboardMarkup):
+        params["reply_markup"] = params["reply_markup"].to_dict()
+    return json.dumps(params, ensure_ascii=False, sort_keys=True)
+
+
+def _load_params(payload: str, bot) -> dict:
+    params = json.loads(payload)
+    if params.get("reply_markup") is not None:
+        params["reply_markup"] = InlineKeyboardMarkup.de_json(params["reply_markup"], bot)
+    return params
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений на диске. send() вызывается из обработчиков,
+    start() запускает фоновые повторы (после Application.initialize), stop() — останавливает.
+    shard=(index, count) — при BOT_WORKERS > 1 процесс повторяет только сообщения своих участников.
+    """
+
+    def __init__(self, path: Path, deliver: Deliver, shard: tuple[int, int] | None = None):
+        self.path = Path(path)
+        self.deliver = deliver
+        self.shard = shard
+        # Пишет event loop; соединение отдельное от остальных данных, даже если файл базы общий
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Как в sqlite_storage: после сбоя процесса записанное не теряется, fsync на каждое сообщение не нужен
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self._conn.executescript(SCHEMA)
+        self._prune_sent()
+        # Чаты, в которые сейчас идёт отправка: их сообщения ждут своей очереди
+        self._busy: set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.retried = 0
+        self.dropped = 0
+
+    # --- База ---
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def _migrate(self) -> None:
+        """
+        Outbox прежней версии (digest — хэш содержимого, NOT NULL, уникальный): пересоздаём таблицу
+        под новую схему, ждущие отправки сообщения переносятся без ключа
+        """
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")]
+        if "digest" not in columns:
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute("DROP INDEX IF EXISTS idx_outbox_digest")
+            self._conn.execute("DROP INDEX IF EXISTS idx_outbox_chat")
+            self._conn.execute("ALTER TABLE outbox RENAME TO outbox_old")
+            self._conn.execute(OUTBOX_TABLE)
+            self._conn.execute(
+                "INSERT INTO outbox (id, chat_id, kind, params, attempts, next_attempt_at, created_at) "
+                "SELECT id, chat_id, kind, params, attempts, next_attempt_at, created_at FROM outbox_old"
+            )
+            self._conn.execute("DROP TABLE outbox_old")
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        logger.info("Outbox: таблица переведена на ключи обновлений вместо хэша содержимого")
+
+    def _add(self, chat_id: int, kind: str, payload: str, dedup_key: Optional[str]) -> Optional[int]:
+        """Записывает сообщение; None — сообщение с этим ключом уже ждёт отправки или отправлено"""
+        cursor = self._execute(
+            "INSERT OR IGNORE INTO outbox (chat_id, kind, params, dedup_key, created_at) "
+            "SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM outbox_sent WHERE dedup_key = ?)",
+            (chat_id, kind, payload, dedup_key, time.time(), dedup_key),
+        )
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def _has_earlier(self, chat_id: int, entry_id: int) -> bool:
+        return self._execute(
+            "SELECT 1 FROM outbox WHERE chat_id = ? AND id < ? LIMIT 1", (chat_id, entry_id)
+        ).fetchone() is not None
+
+    def _head(self, chat_id: int):
+        return self._execute(
+            "SELECT id, kind, params, attempts, next_attempt_at FROM outbox WHERE chat_id = ? ORDER BY id LIMIT 1",
+            (chat_id,),
+        ).fetchone()
+
+    def _done(self, entry_id: int, sent: bool = False) -> None:
+        """Убирает сообщение из outbox; ключ отправленного запоминается, чтобы повтор обновления его не отправил"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if sent:
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO outbox_sent (dedup_key, sent_at) "
+                        "SELECT dedup_key, ? FROM outbox WHERE id = ? AND dedup_key IS NOT NULL",
+                        (time.time(), entry_id),
+                    )
+                self._conn.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _prune_sent(self) -> None:
+        self._execute("DELETE FROM outbox_sent WHERE sent_at < ?", (time.time() - SENT_KEYS_MAX_AGE,))
+        self._pruned_at = time.time()
+
+    def _waiting_chats(self) -> list[int]:
+        if self.shard is None:
+            condition, params = "1", ()
+        else:
+            index, count = self.shard
+            condition, params = "chat_id % ? = ?", (count, index)
+        return [chat_id for (chat_id,) in self._execute(
+            f"SELECT chat_id FROM outbox WHERE {condition} GROUP BY chat_id ORDER BY MIN(id)", params
+        )]
+
+    def pending(self) -> int:
+        """Сколько сообщений ждёт отправки"""
+        return self._execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    # --- Отправка ---
+
+    async def _attempt(self, bot, chat_id: int, entry_id: int, kind: str, payload: str, attempts: int,
+                       raise_permanent: bool = False) -> bool:
+        """
+        Одна попытка отправки. True — сообщение ушло или выброшено, можно отправлять следующее;
+        False — временная ошибка, повтор запланирован
+        """
+        try:
+            await self.deliver(bot, chat_id, kind, _load_params(payload, bot))
+        except Exception as e:
+            if not is_transient(e):
+                self._done(entry_id)
+                self.dropped += 1
+                if raise_permanent:
+                    raise
+                logger.error(f"Outbox: сообщение в чат {chat_id} не отправлено и выброшено: {e!r}")
+                return True
+            attempts += 1
+            if attempts >= MAX_ATTEMPTS:
+                self._done(entry_id)
+                self.dropped += 1
+                logger.error(f"Outbox: сообщение в чат {chat_id} не отправлено за {attempts} попыток, выброшено: {e!r}")
+                return True
+            delay = min(MAX_DELAY, BASE_DELAY * 2 ** (attempts - 1))
+            if isinstance(e, RetryAfter):
+                delay = max(delay, float(e.retry_after))
+            self._execute(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ? WHERE id = ?",
+                (attempts, time.time() + delay, entry_id),
+            )
+            self.retried += 1
+            logger.warning(f"Outbox: сообщение в чат {chat_id} не отправлено ({e!r}), повтор через {delay:.0f} с")
+            self._wakeup.set()
+            return False
+        self._done(entry_id, sent=True)
+        self.sent += 1
+        return True
+
+    async def send(self, bot, chat_id: int, kind: str, params: dict, update_id: Optional[int] = None) -> bool:
+        """
+        Записывает сообщение в outbox и, если чат не ждёт более ранних сообщений, сразу отправляет.
+        True — отправлено сейчас, False — уйдёт позже (или уже отправлено при прошлой обработке update_id).
+        update_id — обновление, в ответ на которое отправляется сообщение (см. _dedup_key).
+        Ошибки, после которых повтор бессмыслен (BadRequest, Forbidden), пробрасываются, как при обычной отправке.
+        """
+        payload = _dump_params(params)
+        entry_id = self._add(chat_id, kind, payload, _dedup_key(update_id))
+        if entry_id is None:
+            return False
+        if chat_id in self._busy or self._has_earlier(chat_id, entry_id):
+            self._wakeup.set()
+            return False
+        self._busy.add(chat_id)
+        try:
+            sent = await self._attempt(bot, chat_id, entry_id, kind, payload, 0, raise_permanent=True)
+        finally:
+            self._busy.discard(chat_id)
+        if self._head(chat_id) is not None:
+            # Пока отправляли, за этим сообщением встали следующие
+            self._wakeup.set()
+        return sent
+
+    async def _drain_chat(self, bot, chat_id: int) -> Optional[float]:
+        """Отправляет сообщения чата по порядку; возвращает время следующей попытки, если отправка застряла"""
+        if chat_id in self._busy:
+            return None
+        self._busy.add(chat_id)
+        try:
+            while True:
+                row = self._head(chat_id)
+                if row is None:
+                    return None
+                entry_id, kind, payload, attempts, next_attempt_at = row
+                if next_attempt_at > time.time():
+                    return next_attempt_at
+                if not await self._attempt(bot, chat_id, entry_id, kind, payload, attempts):
+                    return self._head(chat_id)[4]
+        finally:
+            self._busy.discard(chat_id)
+
+    async def _run(self, bot) -> None:
+        while True:
+            self._wakeup.clear()
+            if time.time() - self._pruned_at >= SENT_KEYS_PRUNE_INTERVAL:
+                self._prune_sent()
+            results = await asyncio.gather(
+                *(self._drain_chat(bot, chat_id) for chat_id in self._waiting_chats()),
+                return_exceptions=True,
+            )
+            retry_at = [result for result in results if isinstance(result, float)]
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Outbox: ошибка фоновой отправки: {result!r}")
+            timeout = IDLE_INTERVAL
+            if retry_at:
+                timeout = min(timeout, max(0.0, min(retry_at) - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, bot) -> None:
+        """Запускает фоновую отправку; сообщения, не отправленные до перезапуска, уходят сразу"""
+        waiting = self.pending()
+        if waiting:
+            logger.info(f"Outbox: неотправленных сообщений после перезапуска: {waiting}")
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self) -> None:
+        """Останавливает фоновую отправку; неотправленное остаётся в outbox до следующего запуска"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        logger.info(
+            f"Outbox: отправлено {self.sent}, повторов {self.retried}, выброшено {self.dropped}, "
+            f"ждут отправки {self.pending()}"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
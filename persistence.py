@@ -0,0 +1,194 @@
+"""
+Отложенная запись состояния на диск: обработчики только помечают данные как изменённые,
+а фоновый поток раз в интервал записывает каждый изменённый файл не более одного раза.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write(path: Path, write, encoding: str | None = "utf-8", newline=None) -> None:
+    """
+    Атомарно перезаписывает файл: пишет во временный файл рядом и переименовывает его.
+    write(f) получает открытый текстовый файл (с encoding=None — двоичный).
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "w" if encoding else "wb", encoding=encoding, newline=newline) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def parse_raffle_numbers(raffle_data) -> tuple[dict, dict | None]:
+    """
+    Разбирает содержимое raffle_numbers.json. Возвращает (номера по user_id, сохранённое состояние
+    RaffleAllocator или None). Понимает текущий формат {"numbers": ..., "allocator": ...},
+    прежний {"numbers": ..., "next_number": ...} и самый старый {user_id: номер}.
+    В прежних форматах карты занятых номеров нет: её восстанавливают по выданным номерам.
+    """
+    if raffle_data is None:
+        return {}, None
+
+    # Проверяем формат файла (старый или новый)
+    if isinstance(raffle_data, dict) and "numbers" in raffle_data:
+        return raffle_data.get("numbers", {}), raffle_data.get("allocator")
+
+    # Старый формат — просто {user_id: номер}
+    return raffle_data, None
+
+
+def write_json_atomic(path: Path, data) -> None:
+    """
+    Атомарно записывает data в JSON (без \\u-экранирования и без отступов).
+    data может быть уже готовым JSON-текстом (str) — он записывается как есть.
+    """
+    # json.dumps без отступов работает целиком в C-энкодере под GIL, поэтому обработчики в другом потоке
+    # не могут изменить данные посередине сериализации — копия не нужна (json.dump в файл и indent
+    # включают медленный энкодер на Python, который отдаёт GIL по ходу работы)
+    text = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    atomic_write(path, lambda f: f.write(text))
+
+
+class _TimingStat:
+    """Количество, сумма и максимум замеров в секундах"""
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def format(self) -> str:
+        if not self.count:
+            return "нет замеров"
+        avg_ms = self.total / self.count * 1000
+        return f"{self.count} шт., среднее {avg_ms:.3f} мс, максимум {self.max * 1000:.3f} мс"
+
+
+class PersistenceStats:
+    """
+    Сколько обработчики ждут сохранения (handler wait) и сколько длится сама запись файла.
+    При синхронной записи обработчик ждал бы ровно время записи — его и сравниваем.
+    on_write(имя, секунды) вызывается после каждой записи файла (например, для метрик).
+    """
+
+    def __init__(self, on_write=None):
+        self._lock = threading.Lock()
+        self.handler_wait: dict[str, _TimingStat] = {}
+        self.write_time: dict[str, _TimingStat] = {}
+        self.on_write = on_write
+
+    def observe_wait(self, name: str, seconds: float):
+        with self._lock:
+            self.handler_wait.setdefault(name, _TimingStat()).add(seconds)
+
+    def observe_write(self, name: str, seconds: float):
+        with self._lock:
+            self.write_time.setdefault(name, _TimingStat()).add(seconds)
+        if self.on_write is not None:
+            self.on_write(name, seconds)
+
+    def summary(self) -> str:
+        with self._lock:
+            names = sorted(set(self.handler_wait) | set(self.write_time))
+            lines = []
+            for name in names:
+                wait = self.handler_wait.get(name, _TimingStat())
+                write = self.write_time.get(name, _TimingStat())
+                lines.append(
+                    f"{name}: ожидание в обработчиках — {wait.format()}; "
+                    f"запись файла (столько ждал бы обработчик при синхронной записи) — {write.format()}"
+                )
+            return "\n".join(lines)
+
+
+class WriteBehindFlusher:
+    """
+    Фоновый поток, который раз в interval секунд записывает изменённые файлы.
+    Повторные пометки одного и того же файла до записи схлопываются в одну.
+    """
+
+    def __init__(self, interval: float, stats: PersistenceStats | None = None):
+        self.interval = interval
+        self.stats = stats or PersistenceStats()
+        # Имя файла -> функция, которая его записывает
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def mark_dirty(self, name: str, writer) -> None:
+        """Помечает файл как изменённый. Вызывается из обработчиков и не блокирует их"""
+        with self._lock:
+            self._dirty[name] = writer
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="persistence-flusher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """Записывает все изменённые файлы (по одному разу каждый)"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+
+        for name, writer in sorted(dirty.items()):
+            started = time.perf_counter()
+            try:
+                writer()
+            except RuntimeError as e:
+                # Словарь изменился во время обхода — повторим в следующем цикле
+                logger.debug(f"Запись {name} отложена: {e}")
+                self._retry(name, writer)
+                continue
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении {name}: {e}", exc_info=True)
+                self._retry(name, writer)
+                continue
+            self.stats.observe_write(name, time.perf_counter() - started)
+
+    def _retry(self, name: str, writer) -> None:
+        # Не затираем более свежую пометку, сделанную во время записи
+        with self._lock:
+            self._dirty.setdefault(name, writer)
+
+    def stop(self) -> None:
+        """Останавливает поток и дописывает всё, что осталось"""
+        if self._thread is not None:
+            self._stopping = True
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        # Финальная запись — уже без конкурирующих обработчиков
+        self.flush()
@@ -0,0 +1,213 @@
+"""
+Выдача номеров розыгрыша из настраиваемых диапазонов (RAFFLE_NUMBER_RANGES, например "1-1000,2001-2500").
+Занятые номера отмечены битами в bytearray: 1000 номеров — 125 байт, миллион — 122 КиБ.
+
+По умолчанию выдаётся наименьший свободный номер (номер дисквалифицированного участника,
+освобождённый release(), выдаётся снова). С randomize=True номер случайный, тоже за O(1):
+пока занято не больше половины номеров, случайная позиция подбирается пробами (каждая свободна
+с вероятностью не меньше 1/2), дальше свободные номера дополнительно лежат в массиве,
+из которого берётся случайный элемент.
+reserve() занимает конкретный номер (уже выданный раньше или отложенный организаторами).
+"""
+import base64
+import bisect
+import random
+import re
+import threading
+import zlib
+from array import array
+
+# Байт, в котором есть хотя бы один свободный номер
+_NOT_FULL = re.compile(rb"[^\xff]")
+
+
+class RaffleNumbersExhausted(ValueError):
+    """Свободных номеров в диапазонах не осталось"""
+
+
+def parse_ranges(spec: str) -> list[tuple[int, int]]:
+    """"1-1000,2001-2500,3000" -> [(1, 1000), (2001, 2500), (3000, 3000)]"""
+    ranges = []
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        low, _, high = part.partition("-")
+        low, high = int(low), int(high or low)
+        if low < 1 or high < low:
+            raise ValueError(f"Неверный диапазон номеров розыгрыша: {part!r}")
+        ranges.append((low, high))
+    if not ranges:
+        raise ValueError("Не задан ни один диапазон номеров розыгрыша")
+    ranges.sort()
+    for (_, previous_high), (low, _) in zip(ranges, ranges[1:]):
+        if low <= previous_high:
+            raise ValueError(f"Диапазоны номеров розыгрыша пересекаются: {spec!r}")
+    return ranges
+
+
+def format_ranges(ranges: list[tuple[int, int]]) -> str:
+    return ",".join(f"{low}-{high}" if high != low else str(low) for low, high in ranges)
+
+
+class RaffleAllocator:
+    """
+    Номера розыгрыша из диапазонов ranges. Все операции под блокировкой: номера могут
+    выдаваться из обработчиков разных участников и из фоновых потоков.
+    """
+
+    def __init__(self, ranges: list[tuple[int, int]], randomize: bool = False, rng: random.Random | None = None):
+        self.ranges = sorted(ranges)
+        self.randomize = randomize
+        self._rng = rng or random.Random()
+        # Номер -> позиция бита: начала диапазонов и позиции их первых номеров
+        self._lows = [low for low, _ in self.ranges]
+        self._offsets = []
+        self.capacity = 0
+        for low, high in self.ranges:
+            self._offsets.append(self.capacity)
+            self.capacity += high - low + 1
+        self._bits = bytearray((self.capacity + 7) // 8)
+        # Лишние биты последнего байта считаем занятыми, чтобы поиск их не находил
+        padding = len(self._bits) * 8 - self.capacity
+        if padding:
+            self._bits[-1] = (0xFF << (8 - padding)) & 0xFF
+        self.taken = 0
+        # Все позиции до _cursor заняты: поиск наименьшего свободного номера начинается с него
+        self._cursor = 0
+        # Только для randomize: свободные позиции и индекс каждой из них в _free
+        self._free = None
+        self._free_index = None
+        self._lock = threading.Lock()
+
+    # --- Номер <-> позиция бита ---
+
+    def _slot(self, number: int) -> int:
+        i = bisect.bisect_right(self._lows, number) - 1
+        if i < 0 or number > self.ranges[i][1]:
+            raise ValueError(f"Номер {number} вне диапазонов розыгрыша {format_ranges(self.ranges)}")
+        return self._offsets[i] + number - self._lows[i]
+
+    def _number(self, slot: int) -> int:
+        i = bisect.bisect_right(self._offsets, slot) - 1
+        return self._lows[i] + slot - self._offsets[i]
+
+    def _is_set(self, slot: int) -> bool:
+        return bool(self._bits[slot >> 3] & (1 << (slot & 7)))
+
+    def __contains__(self, number: int) -> bool:
+        i = bisect.bisect_right(self._lows, number) - 1
+        return i >= 0 and number <= self.ranges[i][1]
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.taken
+
+    # --- Случайная выдача: массив свободных позиций ---
+
+    def _build_free_list(self) -> None:
+        if not self.taken:
+            # Все номера свободны: позиция и её индекс совпадают
+            self._free = array("I", range(self.capacity))
+            self._free_index = array("I", self._free)
+            return
+        self._free = array("I", (slot for slot in range(self.capacity) if not self._is_set(slot)))
+        self._free_index = array("I", bytes(4 * self.capacity))
+        for index, slot in enumerate(self._free):
+            self._free_index[slot] = index
+
+    def _drop_free(self, slot: int) -> None:
+        index = self._free_index[slot]
+        last = self._free.pop()
+        if index < len(self._free):
+            self._free[index] = last
+            self._free_index[last] = index
+
+    # --- Выдача, резерв, освобождение ---
+
+    def _take(self, slot: int) -> None:
+        self._bits[slot >> 3] |= 1 << (slot & 7)
+        self.taken += 1
+        if self._free is not None:
+            self._drop_free(slot)
+
+    def allocate(self) -> int:
+        """Выдаёт свободный номер; RaffleNumbersExhausted, если их не осталось"""
+        with self._lock:
+            if self.taken >= self.capacity:
+                raise RaffleNumbersExhausted(
+                    f"Все номера розыгрыша ({format_ranges(self.ranges)}) выданы"
+                )
+            if self.randomize:
+                if self._free is None and self.taken * 2 <= self.capacity:
+                    # Равномерно среди свободных и без массива: при BOT_WORKERS > 1 карта читается
+                    # из базы на каждую выдачу, и строить массив каждый раз было бы O(capacity)
+                    slot = self._rng.randrange(self.capacity)
+                    while self._is_set(slot):
+                        slot = self._rng.randrange(self.capacity)
+                else:
+                    if self._free is None:
+                        self._build_free_list()
+                    slot = self._free[self._rng.randrange(len(self._free))]
+            else:
+                match = _NOT_FULL.search(self._bits, self._cursor >> 3)
+                byte_index = match.start()
+                byte = self._bits[byte_index]
+                # Младший нулевой бит байта
+                slot = byte_index * 8 + ((~byte & (byte + 1)).bit_length() - 1)
+                self._cursor = slot + 1
+            self._take(slot)
+            return self._number(slot)
+
+    def reserve(self, number: int) -> bool:
+        """Занимает конкретный номер. False — он уже занят; ValueError — вне диапазонов"""
+        with self._lock:
+            slot = self._slot(number)
+            if self._is_set(slot):
+                return False
+            self._take(slot)
+            return True
+
+    def release(self, number: int) -> bool:
+        """Возвращает номер в оборот (например, после дисквалификации). False — он и так свободен"""
+        with self._lock:
+            slot = self._slot(number)
+            if not self._is_set(slot):
+                return False
+            self._bits[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+            self.taken -= 1
+            self._cursor = min(self._cursor, slot)
+            if self._free is not None:
+                self._free_index[slot] = len(self._free)
+                self._free.append(slot)
+            return True
+
+    def is_taken(self, number: int) -> bool:
+        with self._lock:
+            return self._is_set(self._slot(number))
+
+    # --- Сохранение ---
+
+    def to_json(self) -> dict:
+        """Диапазоны и сжатая битовая карта занятых номеров (base64)"""
+        with self._lock:
+            bits = bytes(self._bits)
+        return {"ranges": format_ranges(self.ranges), "taken": base64.b64encode(zlib.compress(bits)).decode("ascii")}
+
+    @classmethod
+    def from_json(cls, state: dict | None, ranges: list[tuple[int, int]], randomize: bool = False,
+                  rng: random.Random | None = None) -> "RaffleAllocator":
+        """
+        Восстанавливает карту занятых номеров, если она сохранена для тех же диапазонов.
+        Иначе (первый запуск, диапазоны изменились) карта пуста, и выданные номера
+        нужно занять заново через reserve().
+        """
+        allocator = cls(ranges, randomize=randomize, rng=rng)
+        if not state or state.get("ranges") != format_ranges(allocator.ranges):
+            return allocator
+        bits = zlib.decompress(base64.b64decode(state["taken"]))
+        if len(bits) != len(allocator._bits):
+            return allocator
+        allocator._bits[:] = bits
+        padding = len(bits) * 8 - allocator.capacity
+        allocator.taken = int.from_bytes(bits, "little").bit_count() - padding
+        return allocator
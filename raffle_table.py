@@ -0,0 +1,163 @@
+"""
+Таблица участников розыгрыша (raffle_table.txt и raffle_table.csv).
+Номера обычно выдаются по возрастанию, поэтому новые строки дописываются в конец файлов;
+полная перестройка — только по запросу (/export) или если файлы разошлись с ожидаемым состоянием.
+"""
+import csv
+import io
+import logging
+import os
+import threading
+from pathlib import Path
+
+from persistence import atomic_write
+from records import Participant
+
+logger = logging.getLogger(__name__)
+
+
+def to_cp1251_safe(text: str) -> str:
+    """
+    Преобразует строку в вид, безопасный для сохранения в cp1251:
+    все неподдерживаемые символы (эмодзи и пр.) заменяются на '?'.
+    """
+    try:
+        return text.encode("cp1251", errors="replace").decode("cp1251")
+    except Exception:
+        # Запасной вариант: выкидываем неподдерживаемые символы
+        return text.encode("cp1251", errors="ignore").decode("cp1251")
+
+
+def raffle_row(participant: Participant) -> dict:
+    """Строка таблицы из записи участника user_data"""
+    return {
+        "number": participant.raffle_number,
+        "username": participant.username or "",
+        "full_name": participant.full_name or "",
+        "handle": participant.handle,
+        "completed_at": participant.completed_at
+    }
+
+
+def _txt_line(p: dict) -> str:
+    full_name = p["full_name"] or p["username"] or "Не указано"
+    username = p["username"] or "Не указан"
+    handle = p.get("handle") or ""
+    handle_str = f"@{handle}" if handle else ""
+    # cp1251-safe варианты (чтобы не было иероглифов при открытии в Windows/мобильных редакторах)
+    full_name_safe = to_cp1251_safe(full_name)
+    username_safe = to_cp1251_safe(username)
+    handle_safe = to_cp1251_safe(handle_str)
+    # Имя;отображаемое имя;@username;номер
+    return f"{full_name_safe};{username_safe};{handle_safe};{p['number']}\n"
+
+
+def _csv_lines(participants: list) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";")
+    # Без заголовков, @username;отображаемое имя;номер
+    for p in participants:
+        handle = p.get("handle") or ""
+        handle_str = f"@{handle}" if handle else ""
+        username = p["username"] or "Не указан"
+        # В CSV оставляем оригинальные строки, UTF‑8 их поддерживает полностью
+        writer.writerow([handle_str, username, p["number"]])
+    return buffer.getvalue()
+
+
+class RaffleTableWriter:
+    """
+    Дописывает строки новых победителей квеста в конец таблицы.
+    add() вызывается из обработчика и только ставит строку в очередь,
+    flush() пишет очередь на диск (в т.ч. из фонового потока).
+    """
+
+    def __init__(self, txt_path: Path, csv_path: Path):
+        self.txt_path = Path(txt_path)
+        self.csv_path = Path(csv_path)
+        self._pending = []
+        self._rebuild_requested = False
+        self._lock = threading.Lock()
+        # /export перестраивает таблицу в своём потоке, фоновая запись — в своём
+        self._write_lock = threading.Lock()
+        # Что мы сами записали в файлы: последний номер и размеры файлов.
+        # None — состояние неизвестно (например, сразу после запуска), нужна полная перестройка
+        self._last_number = None
+        self._sizes = None
+
+    def add(self, row: dict) -> None:
+        with self._lock:
+            self._pending.append(row)
+
+    def request_rebuild(self) -> None:
+        with self._lock:
+            self._rebuild_requested = True
+
+    def flush(self, collect_rows) -> None:
+        """
+        Дописывает накопленные строки. collect_rows() возвращает все строки таблицы —
+        вызывается только при полной перестройке.
+        """
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                rebuild = self._rebuild_requested
+                self._rebuild_requested = False
+
+            if not rebuild and pending and self._can_append(pending):
+                try:
+                    self._append(pending)
+                    return
+                except OSError as e:
+                    logger.warning(f"Не удалось дописать таблицу розыгрыша, перестраиваем целиком: {e}")
+
+            if rebuild or pending:
+                self.rebuild(collect_rows())
+
+    def _can_append(self, pending: list) -> bool:
+        """
+        Проверяет, что файлы на диске — ровно те, что мы записали, и новые номера больше уже записанных
+        (пропуски допустимы: диапазоны номеров могут идти с разрывами, часть номеров — в резерве)
+        """
+        if self._last_number is None:
+            return False
+        try:
+            sizes = (os.path.getsize(self.txt_path), os.path.getsize(self.csv_path))
+        except OSError:
+            return False
+        if sizes != self._sizes:
+            logger.info("Таблица розыгрыша изменена вне бота — перестраиваем целиком")
+            return False
+
+        pending.sort(key=lambda x: x["number"])
+        if pending[0]["number"] <= self._last_number:
+            logger.info(f"Номер {pending[0]['number']} меньше последнего в таблице ({self._last_number}) — перестраиваем")
+            return False
+        return True
+
+    def _append(self, pending: list) -> None:
+        with open(self.txt_path, "a", encoding="cp1251") as f_txt:
+            f_txt.write("".join(_txt_line(p) for p in pending))
+        # Без BOM: он уже есть в начале файла
+        with open(self.csv_path, "a", encoding="utf-8", newline="") as f_csv:
+            f_csv.write(_csv_lines(pending))
+        self._remember(pending[-1]["number"])
+
+    def rebuild(self, participants: list) -> None:
+        """Полностью перезаписывает обе таблицы"""
+        # Новые строки, пришедшие до перестройки, уже есть в participants
+        if not participants:
+            return
+
+        # Сортируем по номеру розыгрыша
+        participants = sorted(participants, key=lambda x: x["number"])
+
+        # Сохраняем TXT файл: Имя, ник, @username, номер (в удобном для чтения виде)
+        atomic_write(self.txt_path, lambda f: f.write("".join(_txt_line(p) for p in participants)), encoding="cp1251")
+        # Сохраняем CSV файл (UTF‑8 с BOM + ';' — чтобы Excel корректно показывал русский текст)
+        atomic_write(self.csv_path, lambda f: f.write(_csv_lines(participants)), encoding="utf-8-sig", newline="")
+        self._remember(participants[-1]["number"])
+
+    def _remember(self, last_number: int) -> None:
+        self._last_number = last_number
+        self._sizes = (os.path.getsize(self.txt_path), os.path.getsize(self.csv_path))
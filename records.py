@@ -0,0 +1,208 @@
+"""
+Компактные записи участников в памяти вместо вложенных словарей из user_data.json.
+Время хранится целым числом микросекунд (локальное время, как у datetime.now()).
+Тексты ответов в памяти не держатся (они в answers.db, см. answer_store.py) — только время
+каждого ответа по номеру задания. В JSON записи переводятся в прежний формат файла:
+{"user_id": {"username": ..., "answers": {"0": {"timestamp": ...}}, ...}}
+"""
+import json
+import threading
+from datetime import datetime, timedelta
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_timestamp(value: str | None) -> int | None:
+    """ISO-строка из JSON -> микросекунды; без часового пояса, поэтому обратное преобразование точное"""
+    if not value:
+        return None
+    return (datetime.fromisoformat(value) - _EPOCH) // _MICROSECOND
+
+
+def to_isoformat(timestamp: int | None) -> str | None:
+    """Микросекунды -> ISO-строка в том же виде, что datetime.now().isoformat()"""
+    if timestamp is None:
+        return None
+    return (_EPOCH + timestamp * _MICROSECOND).isoformat()
+
+
+def now_timestamp() -> int:
+    return (datetime.now() - _EPOCH) // _MICROSECOND
+
+
+class Participant:
+    """
+    Участник квеста. answered_at[i] — время ответа на задание i (None, если ответа нет);
+    состояние диалога хранит только номер задания, тексты ответов — answers.db.
+    stage — этап до первого задания ("welcome" после /start, "quest_info" после «Присоединиться»);
+    None — задания уже показаны, текущее определяется по числу ответов.
+    last_update_id и last_update_at — последнее обработанное обновление участника (см. backlog.py).
+    Время ответов участника, загруженного из двоичного снимка, читается из него при первом
+    обращении (answers_source.load()), а до этого известно только количество ответов.
+    """
+
+    __slots__ = ("user_id", "username", "full_name", "handle", "started_at", "completed_at",
+                 "raffle_number", "stage", "last_update_id", "last_update_at",
+                 "answers_source", "_answered_at", "_answer_count")
+
+    def __init__(self, user_id: int, username: str | None = None, full_name: str | None = None,
+                 handle: str = "", started_at: int | None = None, completed_at: int | None = None,
+                 raffle_number: int | None = None, stage: str | None = None,
+                 last_update_id: int | None = None, last_update_at: int | None = None,
+                 answered_at: list | None = None, answers_source=None, answer_count: int = 0):
+        self.user_id = user_id
+        # Отображаемое имя (первое имя или то, что видит пользователь)
+        self.username = username
+        self.full_name = full_name
+        # Телеграм-ник без '@' (User.username)
+        self.handle = handle
+        self.started_at = started_at
+        self.completed_at = completed_at
+        self.raffle_number = raffle_number
+        self.stage = stage
+        self.last_update_id = last_update_id
+        self.last_update_at = last_update_at
+        self.answers_source = answers_source
+        if answers_source is not None:
+            self._answered_at = None
+        else:
+            self._answered_at = answered_at if answered_at is not None else []
+        self._answer_count = answer_count
+
+    @property
+    def answered_at(self) -> list:
+        answered_at = self._answered_at
+        if answered_at is None:
+            source = self.answers_source
+            # source пуст, только если время ответов только что загрузил другой поток
+            answered_at = self._answered_at = source.load() if source is not None else self._answered_at
+            self.answers_source = None
+        return answered_at
+
+    @property
+    def loaded_answered_at(self) -> list | None:
+        """Время ответов, если оно уже в памяти, иначе None (без чтения снимка)"""
+        return self._answered_at
+
+    @property
+    def answer_count(self) -> int:
+        answered_at = self._answered_at
+        if answered_at is None:
+            return self._answer_count
+        return sum(timestamp is not None for timestamp in answered_at)
+
+    def set_answer(self, index: int, timestamp: int) -> None:
+        """Отмечает ответ на задание index; текст ответа сохраняется в answers.db отдельно"""
+        answered_at = self.answered_at
+        if index >= len(answered_at):
+            answered_at.extend([None] * (index + 1 - len(answered_at)))
+        answered_at[index] = timestamp
+
+    def to_json(self) -> dict:
+        """Запись в формате user_data.json"""
+        return {
+            "username": self.username,
+            "full_name": self.full_name,
+            "telegram_id": self.user_id,
+            "handle": self.handle,
+            "started_at": to_isoformat(self.started_at),
+            # list() — копия за один шаг, даже если ответ добавляется из другого потока
+            "answers": {
+                str(i): {"timestamp": to_isoformat(timestamp)}
+                for i, timestamp in enumerate(list(self.answered_at)) if timestamp is not None
+            },
+            "raffle_number": self.raffle_number,
+            "completed_at": to_isoformat(self.completed_at),
+            "stage": self.stage,
+            "last_update_id": self.last_update_id,
+            "last_update_at": to_isoformat(self.last_update_at),
+        }
+
+    @classmethod
+    def from_json(cls, user_id: int, data: dict) -> "Participant":
+        # Текст ответа (если он есть в старом файле) не читается: его переносят в answers.db при запуске
+        answered_at = []
+        for index, answer in (data.get("answers") or {}).items():
+            index = int(index)
+            if index == len(answered_at):
+                # Обычный случай: ответы идут по порядку, без пропусков
+                answered_at.append(to_timestamp(answer["timestamp"]))
+                continue
+            if index > len(answered_at):
+                answered_at.extend([None] * (index + 1 - len(answered_at)))
+            answered_at[index] = to_timestamp(answer["timestamp"])
+        return cls(
+            user_id,
+            username=data.get("username"),
+            full_name=data.get("full_name"),
+            handle=data.get("handle") or "",
+            started_at=to_timestamp(data.get("started_at")),
+            completed_at=to_timestamp(data.get("completed_at")),
+            raffle_number=data.get("raffle_number"),
+            stage=data.get("stage"),
+            last_update_id=data.get("last_update_id"),
+            last_update_at=to_timestamp(data.get("last_update_at")),
+            answered_at=answered_at,
+        )
+
+
+class Progress:
+    """Состояние диалога с участником: этап и текущее задание"""
+
+    __slots__ = ("stage", "current_question", "emoji_attempts")
+
+    def __init__(self, stage: str, current_question: int = 0):
+        self.stage = stage
+        self.current_question = current_question
+        # Неудачные попытки в задании с эмодзи
+        self.emoji_attempts = 0
+
+
+def participants_from_json(data: dict) -> dict[int, Participant]:
+    """user_data.json -> {user_id: Participant}"""
+    return {int(user_id_str): Participant.from_json(int(user_id_str), record) for user_id_str, record in data.items()}
+
+
+def participants_to_json(participants: dict[int, Participant]) -> dict:
+    """{user_id: Participant} -> содержимое user_data.json"""
+    # list() снимает копию за один шаг, даже если запись идёт из фонового потока
+    return {str(user_id): participant.to_json() for user_id, participant in list(participants.items())}
+
+
+class ParticipantsJson:
+    """
+    Текст user_data.json, собранный из готовых JSON-строк записей: при записи файла заново
+    сериализуются только участники, отмеченные mark_dirty(), остальные берутся из кэша.
+    dumps() вызывается из потока фоновой записи, mark_dirty() — из event loop.
+    """
+
+    def __init__(self, participants: dict[int, Participant]):
+        self._participants = participants
+        # user_id -> JSON-строка записи (как значение в user_data.json)
+        self._fragments: dict[int, str] = {}
+        self._dirty: set[int] = set()
+        self._all_dirty = True
+        self._lock = threading.Lock()
+
+    def mark_dirty(self, user_id: int | None = None) -> None:
+        """Запись участника изменилась (без user_id — все записи)"""
+        with self._lock:
+            if user_id is None:
+                self._all_dirty = True
+            else:
+                self._dirty.add(user_id)
+
+    def dumps(self) -> str:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            all_dirty, self._all_dirty = self._all_dirty, False
+        fragments = self._fragments
+        # list() снимает копию за один шаг, даже если запись идёт из фонового потока
+        items = list(self._participants.items())
+        if all_dirty:
+            fragments.clear()
+        for user_id, participant in items:
+            if user_id in dirty or user_id not in fragments:
+                fragments[user_id] = json.dumps(participant.to_json(), ensure_ascii=False)
+        return "{" + ", ".join([f'"{user_id}": {fragments[user_id]}' for user_id, _ in items]) + "}"
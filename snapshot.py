@@ -0,0 +1,181 @@
+"""
+Двоичный снимок участников (user_data.snapshot) для быстрого запуска.
+В начале файла — индекс фиксированного размера: user_id, номер розыгрыша, число ответов,
+время начала и завершения и смещение списка времени ответов участника. Файл отображается
+в память (mmap): при запуске читаются только индекс и имена, а время ответов — при первом
+обращении к нему (новый ответ участника). Тексты ответов в снимок не входят (answers.db).
+
+Формат (little-endian):
+    заголовок   HEADER: "QSNP", версия, число участников, смещение и длина блока имён
+    индекс      ENTRY × число участников
+    имена       JSON-список [username, full_name, handle, last_update_id, last_update_at] в порядке индекса
+    ответы      JSON-список времени ответов участника (микросекунды или null), подряд для всех участников
+
+В снимках версии 2 у имён нет последнего обработанного обновления (только [username, full_name, handle]).
+В снимках версии 1, кроме того, вместо времени лежали ответы целиком, [текст, время]; такой снимок
+читается, а тексты из него отдаёт legacy_answers() для переноса в answers.db.
+"""
+import json
+import mmap
+import struct
+from pathlib import Path
+
+from persistence import atomic_write
+from records import Participant, to_isoformat
+
+MAGIC = b"QSNP"
+VERSION = 3
+_LEGACY_VERSION = 1
+_SUPPORTED_VERSIONS = (VERSION, 2, _LEGACY_VERSION)
+HEADER = struct.Struct("<4sHxxIQQ4x")
+# user_id, номер розыгрыша (0 — нет), число ответов, флаги, начало, завершение, смещение и длина ответов
+ENTRY = struct.Struct("<qIHBxqqQI4x")
+_HAS_STARTED = 1
+_HAS_COMPLETED = 2
+# Этап до первого задания (Participant.stage); без этих флагов — None
+_STAGE_FLAGS = {"welcome": 4, "quest_info": 8}
+
+
+class AnswersRef:
+    """Где в снимке лежит время ответов участника"""
+
+    __slots__ = ("snapshot", "offset", "length")
+
+    def __init__(self, snapshot: "Snapshot", offset: int, length: int):
+        self.snapshot = snapshot
+        self.offset = offset
+        self.length = length
+
+    def raw(self) -> bytes:
+        return self.snapshot.read(self.offset, self.length)
+
+    def load(self) -> list:
+        items = json.loads(self.raw())
+        if self.snapshot.version == _LEGACY_VERSION:
+            return [None if item is None else item[1] for item in items]
+        return items
+
+
+def _stage_from_flags(flags: int) -> str | None:
+    for stage, flag in _STAGE_FLAGS.items():
+        if flags & flag:
+            return stage
+    return None
+
+
+def encode_answers(answered_at: list) -> bytes:
+    return json.dumps(answered_at, separators=(",", ":")).encode("utf-8")
+
+
+class Snapshot:
+    """Открытый (отображённый в память) файл снимка"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.count, self._profiles_offset, self._profiles_length = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or self.version not in _SUPPORTED_VERSIONS:
+            raise ValueError(f"{self.path}: не снимок участников или неизвестная версия {self.version}")
+
+    def read(self, offset: int, length: int) -> bytes:
+        return self._mmap[offset:offset + length]
+
+    def _index(self) -> memoryview:
+        return memoryview(self._mmap)[HEADER.size:HEADER.size + ENTRY.size * self.count]
+
+    def participants(self) -> dict[int, Participant]:
+        """Все участники; время ответов не читается, пока к нему не обратятся"""
+        profiles = json.loads(self.read(self._profiles_offset, self._profiles_length))
+        index = self._index()
+        participants = {}
+        try:
+            for (user_id, raffle_number, answer_count, flags, started_at, completed_at, offset, length), \
+                    (username, full_name, handle, *last_update) in zip(ENTRY.iter_unpack(index), profiles):
+                last_update_id, last_update_at = last_update or (None, None)
+                participants[user_id] = Participant(
+                    user_id,
+                    username=username,
+                    full_name=full_name,
+                    handle=handle,
+                    started_at=started_at if flags & _HAS_STARTED else None,
+                    completed_at=completed_at if flags & _HAS_COMPLETED else None,
+                    raffle_number=raffle_number or None,
+                    stage=_stage_from_flags(flags),
+                    last_update_id=last_update_id,
+                    last_update_at=last_update_at,
+                    answers_source=AnswersRef(self, offset, length),
+                    answer_count=answer_count,
+                )
+        finally:
+            # Иначе mmap нельзя будет закрыть, пока жив memoryview
+            index.release()
+        return participants
+
+    def legacy_answers(self):
+        """(user_id, номер задания, текст, время) из снимка версии 1; в версии 2 текстов нет"""
+        if self.version != _LEGACY_VERSION:
+            return
+        index = self._index()
+        try:
+            for user_id, *_, offset, length in ENTRY.iter_unpack(index):
+                for question_index, item in enumerate(json.loads(self.read(offset, length))):
+                    if item is not None:
+                        yield user_id, question_index, item[0], to_isoformat(item[1])
+        finally:
+            index.release()
+
+
+def load_snapshot(path: Path) -> dict[int, Participant]:
+    return Snapshot(path).participants()
+
+
+def write_snapshot(path: Path, participants: dict[int, Participant]) -> None:
+    """
+    Атомарно записывает снимок. Время ответов, которое ещё не читалось, копируется из старого
+    снимка байт в байт, без разбора, а затем перенаправляется на новый файл.
+    """
+    # list() снимает копию за один шаг, даже если запись идёт из фонового потока
+    items = list(participants.values())
+    data_offset = HEADER.size + ENTRY.size * len(items)
+    profiles = json.dumps(
+        [[p.username, p.full_name, p.handle, p.last_update_id, p.last_update_at] for p in items],
+        ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+    index = bytearray()
+    blobs = []
+    # Участники, чьё время ответов скопировано из старого снимка: (участник, смещение, длина)
+    copied = []
+    offset = data_offset + len(profiles)
+    for participant in items:
+        source = participant.answers_source
+        if participant.loaded_answered_at is None and source is not None and source.snapshot.version != _LEGACY_VERSION:
+            blob = source.raw()
+            copied.append((participant, offset, len(blob)))
+        else:
+            blob = encode_answers(participant.answered_at)
+        flags = (_HAS_STARTED if participant.started_at is not None else 0) | \
+                (_HAS_COMPLETED if participant.completed_at is not None else 0) | \
+                _STAGE_FLAGS.get(participant.stage, 0)
+        index += ENTRY.pack(
+            participant.user_id, participant.raffle_number or 0, participant.answer_count, flags,
+            participant.started_at or 0, participant.completed_at or 0, offset, len(blob),
+        )
+        blobs.append(blob)
+        offset += len(blob)
+
+    def write(f):
+        f.write(HEADER.pack(MAGIC, VERSION, len(items), data_offset, len(profiles)))
+        f.write(index)
+        f.write(profiles)
+        f.writelines(blobs)
+
+    atomic_write(path, write, encoding=None)
+
+    # Старый файл уже заменён; время ответов, которое так и не читалось, теперь берётся из нового
+    if copied:
+        snapshot = Snapshot(path)
+        for participant, offset, length in copied:
+            if participant.loaded_answered_at is None:
+                participant.answers_source = AnswersRef(snapshot, offset, length)
@@ -0,0 +1,442 @@
+"""
+Хранение данных квеста в SQLite (режим WAL) вместо JSON-файлов.
+Каждое изменение — одна небольшая транзакция, без перезаписи всех данных.
+Базу могут одновременно открывать несколько процессов бота (BOT_WORKERS > 1, см. workers.py):
+каждый читает только своих участников (shard), номера розыгрыша выдаются транзакцией по общей карте.
+
+Запуск как скрипта переносит данные из JSON-файлов в базу:
+    python sqlite_storage.py
+"""
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from answer_store import iter_answers
+from journal import UserDataJournal
+from persistence import parse_raffle_numbers
+from raffle_allocator import RaffleAllocator
+
+DB_FILE = Path("quest.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS participants (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    full_name TEXT,
+    handle TEXT NOT NULL DEFAULT '',
+    started_at TEXT,
+    completed_at TEXT,
+    stage TEXT,
+    -- Последнее обработанное обновление участника (см. backlog.py)
+    last_update_id INTEGER,
+    last_update_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_participants_handle ON participants(handle);
+CREATE INDEX IF NOT EXISTS idx_participants_completed_at ON participants(completed_at);
+
+CREATE TABLE IF NOT EXISTS answers (
+    user_id INTEGER NOT NULL,
+    question_index INTEGER NOT NULL,
+    answer TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (user_id, question_index)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS raffle_assignments (
+    user_id INTEGER PRIMARY KEY,
+    raffle_number INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_raffle_assignments_number ON raffle_assignments(raffle_number);
+
+CREATE TABLE IF NOT EXISTS pending_questions (
+    user_id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS help_requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SQLiteStorage:
+    """Участники, ответы и номера розыгрыша в SQLite"""
+
+    def __init__(self, path: Path = DB_FILE):
+        self.path = Path(path)
+        # Соединение используется и из event loop, и из фоновых потоков — доступ под блокировкой
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL synchronous=NORMAL не теряет согласованность и не делает fsync на каждый коммит
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._add_missing_columns()
+
+    def _add_missing_columns(self) -> None:
+        """Столбцы, добавленные после создания базы прежней версией бота"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(participants)")}
+        for column, column_type in (("stage", "TEXT"), ("last_update_id", "INTEGER"), ("last_update_at", "TEXT")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE participants ADD COLUMN {column} {column_type}")
+
+    def _transaction(self, statements):
+        """Выполняет список (sql, params) одной транзакцией"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _query(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _shard_condition(column: str, shard: tuple[int, int] | None) -> tuple[str, tuple]:
+        """Условие WHERE для участников одного процесса: user_id % count = index"""
+        if shard is None:
+            return "1", ()
+        index, count = shard
+        return f"{column} % ? = ?", (count, index)
+
+    def is_empty(self) -> bool:
+        return not self._query("SELECT 1 FROM participants LIMIT 1") and not self._query("SELECT 1 FROM meta LIMIT 1")
+
+    # --- Запись ---
+
+    @staticmethod
+    def _participant_statements(user_id: int, record: dict) -> list:
+        """Запись участника целиком: профиль, ответы и номер розыгрыша"""
+        statements = [
+            (
+                "INSERT OR REPLACE INTO participants (user_id, username, full_name, handle, started_at, completed_at, "
+                "stage, last_update_id, last_update_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, record.get("username"), record.get("full_name"), record.get("handle") or "",
+                 record.get("started_at"), record.get("completed_at"), record.get("stage"),
+                 record.get("last_update_id"), record.get("last_update_at")),
+            ),
+            ("DELETE FROM answers WHERE user_id = ?", (user_id,)),
+            ("DELETE FROM raffle_assignments WHERE user_id = ?", (user_id,)),
+        ]
+        for index, answer in (record.get("answers") or {}).items():
+            if "answer" not in answer:
+                # Текст ответа уже в answers.db (его переносит migrate_from_json)
+                continue
+            statements.append((
+                "INSERT INTO answers (user_id, question_index, answer, timestamp) VALUES (?, ?, ?, ?)",
+                (user_id, int(index), answer["answer"], answer["timestamp"]),
+            ))
+        if record.get("raffle_number") is not None:
+            statements.append((
+                "INSERT INTO raffle_assignments (user_id, raffle_number) VALUES (?, ?)",
+                (user_id, record["raffle_number"]),
+            ))
+        return statements
+
+    @staticmethod
+    def _last_update_statements(user_id: int, last_update: tuple[int, str] | None) -> list:
+        """Отметка об обновлении, которое сделало изменение, — в той же транзакции (см. backlog.py)"""
+        if last_update is None:
+            return []
+        return [(
+            "UPDATE participants SET last_update_id = ?, last_update_at = ? WHERE user_id = ?",
+            (*last_update, user_id),
+        )]
+
+    def save_participant(self, user_id: int, record: dict) -> None:
+        """Сохраняет запись участника целиком (после /start)"""
+        self._transaction(self._participant_statements(user_id, record))
+
+    def save_stage(self, user_id: int, stage: str | None, last_update: tuple[int, str] | None = None) -> None:
+        """Этап участника до первого задания (None — задания уже показаны)"""
+        self._transaction(
+            [("UPDATE participants SET stage = ? WHERE user_id = ?", (stage, user_id))]
+            + self._last_update_statements(user_id, last_update)
+        )
+
+    def save_answer(self, user_id: int, question_index: int, answer: str, timestamp: str,
+                    last_update: tuple[int, str] | None = None) -> None:
+        """Сохраняет один ответ — одна маленькая транзакция"""
+        self._transaction([(
+            "INSERT OR REPLACE INTO answers (user_id, question_index, answer, timestamp) VALUES (?, ?, ?, ?)",
+            (user_id, question_index, answer, timestamp),
+        )] + self._last_update_statements(user_id, last_update))
+
+    def save_completion(self, user_id: int, raffle_number: int, completed_at: str,
+                        last_update: tuple[int, str] | None = None) -> None:
+        """
+        Номер розыгрыша и время завершения квеста — одной транзакцией.
+        Карта занятых номеров отдельно не пишется: при запуске выданные номера берутся из raffle_assignments.
+        """
+        self._transaction([
+            ("INSERT OR REPLACE INTO raffle_assignments (user_id, raffle_number) VALUES (?, ?)",
+             (user_id, raffle_number)),
+            ("UPDATE participants SET completed_at = ? WHERE user_id = ?", (completed_at, user_id)),
+        ] + self._last_update_statements(user_id, last_update))
+
+    def save_last_update(self, user_id: int, last_update: tuple[int, str]) -> None:
+        """Отметка об обновлении, которое данные участника не изменило"""
+        self._transaction(self._last_update_statements(user_id, last_update))
+
+    def complete_with_shared_allocator(self, user_id: int, completed_at: str,
+                                       ranges: list[tuple[int, int]], randomize: bool = False,
+                                       last_update: tuple[int, str] | None = None) -> int:
+        """
+        Выдаёт номер розыгрыша по общей карте занятых номеров в meta и фиксирует завершение квеста —
+        всё одной транзакцией BEGIN IMMEDIATE, поэтому несколько процессов не выдадут один номер дважды.
+        Если карты нет или она для других диапазонов, занятые номера берутся из raffle_assignments.
+        RaffleNumbersExhausted — свободных номеров нет (транзакция откатывается).
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value FROM meta WHERE key = 'raffle_allocator'").fetchone()
+                allocator = RaffleAllocator.from_json(json.loads(row[0]) if row else None, ranges, randomize=randomize)
+                if not allocator.taken:
+                    for (number,) in self._conn.execute("SELECT raffle_number FROM raffle_assignments"):
+                        if number in allocator:
+                            allocator.reserve(number)
+                raffle_number = allocator.allocate()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO raffle_assignments (user_id, raffle_number) VALUES (?, ?)",
+                    (user_id, raffle_number),
+                )
+                self._conn.execute("UPDATE participants SET completed_at = ? WHERE user_id = ?", (completed_at, user_id))
+                for sql, params in self._last_update_statements(user_id, last_update):
+                    self._conn.execute(sql, params)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('raffle_allocator', ?)",
+                    (json.dumps(allocator.to_json()),),
+                )
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return raffle_number
+
+    def save_pending_question(self, user_id: int, pending: dict | None) -> None:
+        """Задание, запланированное к отправке участнику; None — отметка снята"""
+        if pending is None:
+            self._transaction([("DELETE FROM pending_questions WHERE user_id = ?", (user_id,))])
+            return
+        self._transaction([(
+            "INSERT OR REPLACE INTO pending_questions (user_id, payload) VALUES (?, ?)",
+            (user_id, json.dumps(pending)),
+        )])
+
+    def set_meta(self, key: str, value) -> None:
+        self._transaction([
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value))),
+        ])
+
+    def save_help_requests(self, help_requests: list) -> None:
+        statements = [("DELETE FROM help_requests", ())]
+        for request in help_requests:
+            statements.append((
+                "INSERT INTO help_requests (payload) VALUES (?)",
+                (json.dumps(request, ensure_ascii=False),),
+            ))
+        self._transaction(statements)
+
+    # --- Чтение ---
+
+    def get_meta(self, key: str, default=None):
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    def load_user_data(self, shard: tuple[int, int] | None = None) -> dict:
+        """
+        Собирает user_data в том же виде, что и после json.load из user_data.json.
+        Тексты ответов не читаются (в памяти бота их нет) — только время ответов; тексты — iter_answers().
+        shard=(index, count) — только участники, у которых user_id % count == index.
+        """
+        user_data = {}
+        condition, params = self._shard_condition("p.user_id", shard)
+        for user_id, username, full_name, handle, started_at, completed_at, stage, last_update_id, last_update_at, \
+                raffle_number in self._query(
+            "SELECT p.user_id, p.username, p.full_name, p.handle, p.started_at, p.completed_at, p.stage, "
+            "p.last_update_id, p.last_update_at, r.raffle_number "
+            "FROM participants p LEFT JOIN raffle_assignments r ON r.user_id = p.user_id "
+            f"WHERE {condition} ORDER BY p.rowid", params
+        ):
+            user_data[str(user_id)] = {
+                "username": username,
+                "full_name": full_name,
+                "telegram_id": user_id,
+                "handle": handle,
+                "started_at": started_at,
+                "answers": {},
+                "raffle_number": raffle_number,
+                "completed_at": completed_at,
+                "stage": stage,
+                "last_update_id": last_update_id,
+                "last_update_at": last_update_at
+            }
+
+        condition, params = self._shard_condition("user_id", shard)
+        for user_id, question_index, timestamp in self._query(
+            f"SELECT user_id, question_index, timestamp FROM answers WHERE {condition} "
+            "ORDER BY user_id, question_index", params
+        ):
+            record = user_data.get(str(user_id))
+            if record is not None:
+                record["answers"][str(question_index)] = {"timestamp": timestamp}
+        return user_data
+
+    def load_raffle_participants(self) -> dict:
+        """
+        Участники с номером розыгрыша (всех процессов) в формате user_data.json, без времени ответов:
+        из них строится таблица розыгрыша, когда в памяти процесса только его участники
+        """
+        return {
+            str(user_id): {
+                "username": username,
+                "full_name": full_name,
+                "telegram_id": user_id,
+                "handle": handle,
+                "answers": {},
+                "raffle_number": raffle_number,
+                "completed_at": completed_at
+            }
+            for user_id, username, full_name, handle, completed_at, raffle_number in self._query(
+                "SELECT p.user_id, p.username, p.full_name, p.handle, p.completed_at, r.raffle_number "
+                "FROM raffle_assignments r JOIN participants p ON p.user_id = r.user_id"
+            )
+        }
+
+    def load_pending_questions(self, shard: tuple[int, int] | None = None) -> dict:
+        """Задания, запланированные к отправке: {user_id (строкой): {"chat_id", "question", "due"}}"""
+        # Прежние версии хранили все задания одним значением в meta — переносим их в таблицу
+        legacy = self.get_meta("pending_questions")
+        if legacy is not None:
+            statements = [
+                ("INSERT OR IGNORE INTO pending_questions (user_id, payload) VALUES (?, ?)",
+                 (int(user_id_str), json.dumps(pending)))
+                for user_id_str, pending in legacy.items()
+            ]
+            statements.append(("DELETE FROM meta WHERE key = 'pending_questions'", ()))
+            self._transaction(statements)
+        condition, params = self._shard_condition("user_id", shard)
+        return {
+            str(user_id): json.loads(payload)
+            for user_id, payload in self._query(f"SELECT user_id, payload FROM pending_questions WHERE {condition}", params)
+        }
+
+    def iter_answers(self):
+        """Тексты ответов потоком по возрастанию user_id, как AnswerStore.iter_answers()"""
+        return iter_answers(self.path)
+
+    def load_raffle_numbers(self) -> tuple[dict, dict | None]:
+        """Возвращает (номера по user_id, сохранённое состояние RaffleAllocator или None)"""
+        numbers = {
+            str(user_id): number
+            for user_id, number in self._query(
+                "SELECT user_id, raffle_number FROM raffle_assignments ORDER BY raffle_number"
+            )
+        }
+        return numbers, self.get_meta("raffle_allocator")
+
+    def load_help_requests(self) -> list:
+        return [json.loads(payload) for (payload,) in self._query("SELECT payload FROM help_requests ORDER BY id")]
+
+    def load_quest_finished(self) -> bool:
+        return bool(self.get_meta("quest_finished", False))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # --- Миграция ---
+
+    def migrate_from_json(self, data_file: Path, raffle_numbers_file: Path,
+                          help_requests_file: Path, quest_finished_file: Path,
+                          journal_file: Path | None = None, answers_db_file: Path | None = None) -> dict:
+        """
+        Переносит данные из JSON-файлов в базу одной транзакцией.
+        Понимает и старый формат raffle_numbers.json (просто {user_id: номер}),
+        несвёрнутый хвост журнала user_data.journal и тексты ответов из answers.db.
+        Возвращает количество перенесённых записей.
+        """
+        def load(path: Path, default):
+            if not Path(path).exists():
+                return default
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        user_data = load(data_file, {})
+        if journal_file is not None:
+            UserDataJournal(journal_file, data_file).replay(user_data)
+        raffle_numbers, allocator_state = parse_raffle_numbers(load(raffle_numbers_file, None))
+        help_requests = load(help_requests_file, [])
+        quest_finished = load(quest_finished_file, {}).get("finished", False)
+
+        statements = []
+        for user_id_str, record in user_data.items():
+            record = dict(record)
+            # Номер из raffle_numbers.json главнее: он записывался первым при завершении квеста
+            if user_id_str in raffle_numbers:
+                record["raffle_number"] = raffle_numbers[user_id_str]
+            statements.extend(self._participant_statements(int(user_id_str), record))
+
+        # Тексты ответов из answers.db главнее старых текстов в user_data.json
+        if answers_db_file is not None and Path(answers_db_file).exists():
+            for user_id, question_index, answer, timestamp in iter_answers(answers_db_file):
+                statements.append((
+                    "INSERT OR REPLACE INTO answers (user_id, question_index, answer, timestamp) VALUES (?, ?, ?, ?)",
+                    (user_id, question_index, answer, timestamp),
+                ))
+
+        # Номера участников, которых по какой-то причине нет в user_data
+        for user_id_str, number in raffle_numbers.items():
+            if user_id_str not in user_data:
+                statements.append((
+                    "INSERT OR REPLACE INTO raffle_assignments (user_id, raffle_number) VALUES (?, ?)",
+                    (int(user_id_str), number),
+                ))
+
+        statements.append(("DELETE FROM help_requests", ()))
+        for request in help_requests:
+            statements.append((
+                "INSERT INTO help_requests (payload) VALUES (?)",
+                (json.dumps(request, ensure_ascii=False),),
+            ))
+        if allocator_state is not None:
+            statements.append(("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               ("raffle_allocator", json.dumps(allocator_state))))
+        statements.append(("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                           ("quest_finished", json.dumps(quest_finished))))
+        self._transaction(statements)
+
+        return {
+            "participants": len(user_data),
+            "raffle_numbers": len(raffle_numbers),
+            "help_requests": len(help_requests),
+        }
+
+
+if __name__ == "__main__":
+    storage = SQLiteStorage(DB_FILE)
+    counts = storage.migrate_from_json(
+        Path("user_data.json"),
+        Path("raffle_numbers.json"),
+        Path("help_requests.json"),
+        Path("quest_finished.json"),
+        journal_file=Path("user_data.journal"),
+        answers_db_file=Path("answers.db"),
+    )
+    storage.close()
+    print(f"✅ Данные перенесены в {DB_FILE}")
+    print(f"📊 Участников: {counts['participants']}, номеров розыгрыша: {counts['raffle_numbers']}, "
+          f"запросов на помощь: {counts['help_requests']}")
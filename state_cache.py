@@ -0,0 +1,77 @@
+"""
+Состояния участников в памяти: ограниченный LRU-кэш с вытеснением давно молчащих.
+Состояние собирается из сохранённых данных при первом сообщении участника,
+поэтому память и время запуска не растут с историей прошлых участников.
+"""
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Iterator
+
+from records import Progress
+
+# Состояние всех завершивших квест: одно на всех (не меняется), номер для розыгрыша берётся из user_data
+COMPLETED_STATE = Progress("completed")
+
+
+class UserStateCache(MutableMapping):
+    """
+    user_id -> состояние. Хранит не больше max_size записей (вытесняются давно не использованные)
+    и забывает записи, к которым не обращались дольше ttl секунд (ttl=0 — без срока).
+    Вытесненное состояние восстанавливается из user_data при следующем сообщении.
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 0):
+        self.max_size = max_size
+        self.ttl = ttl
+        # user_id -> (состояние, время последнего обращения), от давних к свежим
+        self._entries: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
+        self.evicted = 0
+
+    def _expired(self, touched: float, now: float) -> bool:
+        return self.ttl > 0 and now - touched > self.ttl
+
+    def _evict(self, now: float) -> None:
+        # Сначала — самые давние: просроченные и всё, что не помещается в max_size
+        while self._entries:
+            key, (_, touched) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_size and not self._expired(touched, now):
+                break
+            del self._entries[key]
+            self.evicted += 1
+
+    def __getitem__(self, key):
+        state, touched = self._entries[key]
+        now = time.monotonic()
+        if self._expired(touched, now):
+            del self._entries[key]
+            self.evicted += 1
+            raise KeyError(key)
+        self._entries[key] = (state, now)
+        self._entries.move_to_end(key)
+        return state
+
+    def __setitem__(self, key, state) -> None:
+        now = time.monotonic()
+        self._entries[key] = (state, now)
+        self._entries.move_to_end(key)
+        self._evict(now)
+
+    def __delitem__(self, key) -> None:
+        del self._entries[key]
+
+    def __contains__(self, key) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator:
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
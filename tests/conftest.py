@@ -0,0 +1,23 @@
+"""
+Общие фикстуры тестов. bot.py при импорте загружает данные из текущего каталога
+и потом пишет туда же, поэтому на всю сессию тестов он работает во временном каталоге.
+"""
+import importlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture(scope="session")
+def bot(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp("bot"))
+        monkeypatch.setenv("BOT_TOKEN", os.getenv("BOT_TOKEN", "123:TEST"))
+        module = importlib.import_module("bot")
+        yield module
+        module.flusher.stop()
@@ -0,0 +1,187 @@
+"""
+Параллельная обработка обновлений (concurrency.PerUserUpdateProcessor) с настоящими обработчиками бота:
+обновления участников приходят вперемешку, каждый проходит квест целиком.
+Проверяется, что сообщения одного участника обработаны по порядку, одновременно
+обрабатывается не больше CONCURRENT_UPDATES обновлений, а USERS участников проходят квест
+ненамного дольше одного.
+"""
+import asyncio
+import itertools
+import json
+import time
+
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import BaseRequest
+
+USERS = 80
+FIRST_USER_ID = 20_000_000
+# Участник для замера времени одного квеста
+SINGLE_USER_ID = 21_000_000
+# Задержка «сети» на каждый запрос к Bot API: без неё обработчики не пересекаются во времени
+API_LATENCY = 0.01
+TIMEOUT = 60
+# USERS участников (больше CONCURRENT_UPDATES — два «захода») должны пройти квест быстрее, чем
+# SLOWDOWN_LIMIT одиночных квестов плюс SLOWDOWN_ALLOWANCE секунд; запас — на шумные машины
+SLOWDOWN_LIMIT = 3
+SLOWDOWN_ALLOWANCE = 2.0
+
+ANSWERS = [
+    "Я и Мария вместе любим pro ai",
+    "На митапе PRO AI я хочу узнать, как внедрять ИИ в работу",
+    "искусственный интеллект, машинное обучение, нейросеть, компьютерное зрение",
+    "Привет, Андрей! Рад был познакомиться",
+    "Иван умеет собирать кубик-рубик за минуту",
+    "Аугментация — это когда из имеющихся данных делают новые примеры для обучения",
+]
+
+
+class FakeRequest(BaseRequest):
+    """Отвечает на запросы к Bot API как Telegram и запоминает отправленные сообщения по чатам"""
+
+    def __init__(self):
+        self.sent: dict[int, list[str]] = {}
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        await asyncio.sleep(API_LATENCY)
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.json_parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Quest", "username": "quest_bot"}
+        elif endpoint in ("sendMessage", "sendPhoto"):
+            chat_id = int(params["chat_id"])
+            text = params.get("text") or params.get("caption") or ""
+            self.sent.setdefault(chat_id, []).append(text)
+            result = {"message_id": next(self._message_ids), "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private"}, "text": text}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+# update_id, как и в Telegram, не повторяются между запусками: по ним outbox отбрасывает повторы
+_update_ids = itertools.count(1)
+
+
+def participant_name(user_id: int) -> str:
+    return f"Участник{user_id % 1_000_000}"
+
+
+def make_updates(user_ids) -> list[dict]:
+    """Весь квест каждого участника; шаги разных участников идут вперемешку"""
+    steps = [("text", "/start"), ("callback", "join_quest"), ("callback", "start_quest")]
+    steps += [("text", answer) for answer in ANSWERS]
+
+    updates = []
+    for kind, value in steps:
+        for user_id in user_ids:
+            update_id = next(_update_ids)
+            user = {"id": user_id, "is_bot": False, "first_name": participant_name(user_id)}
+            chat = {"id": user_id, "type": "private"}
+            if kind == "callback":
+                message = {"message_id": 1, "date": int(time.time()), "chat": chat, "text": "..."}
+                updates.append({"update_id": update_id, "callback_query": {
+                    "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": value,
+                    "message": message,
+                }})
+            else:
+                message = {"message_id": update_id, "date": int(time.time()), "chat": chat, "from": user,
+                           "text": value}
+                if value.startswith("/"):
+                    message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(value)}]
+                updates.append({"update_id": update_id, "message": message})
+    return updates
+
+
+def expected_messages(bot, user_id: int) -> list[str]:
+    """Что участник должен получить, если его сообщения обработаны по порядку"""
+    name = bot.escape_markdown_v2(participant_name(user_id))
+    messages = [bot.WELCOME_TEMPLATE.format(username=name), bot.QUEST_INFO_TEXT]
+    for index in range(len(bot.QUESTIONS)):
+        messages.append(bot.QUESTIONS[index]["text"])
+        if index == 2:
+            messages.append("Круто! Все ответы совпали, ты отлично справился.")
+        messages.append(bot.ANSWER_ACCEPTED_TEXTS[index])
+    return messages
+
+
+async def run_quest(bot, monkeypatch, user_ids):
+    # Проверяем обработку обновлений, а не лимиты исходящих сообщений
+    monkeypatch.setattr(bot, "RATE_LIMIT_OVERALL", 0)
+    request = FakeRequest()
+    application = bot.build_application(request=request)
+
+    in_flight = 0
+    max_in_flight = 0
+    errors = []
+
+    async def enter(update, context):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+
+    async def leave(update, context):
+        nonlocal in_flight
+        in_flight -= 1
+
+    async def collect_error(update, context):
+        errors.append(context.error)
+
+    # Первая и последняя группы обработчиков: между ними обновление занимает слот процессора
+    application.add_handler(TypeHandler(Update, enter), group=-10)
+    application.add_handler(TypeHandler(Update, leave), group=10)
+    application.add_error_handler(collect_error)
+
+    updates = [Update.de_json(data, application.bot) for data in make_updates(user_ids)]
+    # Файлы записываются в фоне, как при запуске бота (main): иначе каждый обработчик ждёт fsync
+    bot.flusher.start()
+    try:
+        async with application:
+            await application.start()
+            started = time.monotonic()
+            for update in updates:
+                await application.update_queue.put(update)
+
+            processor = application.update_processor
+            deadline = started + TIMEOUT
+            while application.update_queue.qsize() or processor.active_users:
+                assert time.monotonic() < deadline, "обновления не обработаны за отведённое время"
+                await asyncio.sleep(0.01)
+            elapsed = time.monotonic() - started
+            await application.stop()
+    finally:
+        bot.flusher.stop()
+
+    return processor, request, max_in_flight, errors, elapsed
+
+
+def test_interleaved_users_keep_order_limit_and_time(bot, monkeypatch):
+    user_ids = range(FIRST_USER_ID, FIRST_USER_ID + USERS)
+    *_, single_errors, single_elapsed = asyncio.run(run_quest(bot, monkeypatch, [SINGLE_USER_ID]))
+    processor, request, max_in_flight, errors, elapsed = asyncio.run(run_quest(bot, monkeypatch, user_ids))
+
+    assert single_errors == []
+    assert errors == []
+    assert processor.max_concurrent == bot.CONCURRENT_UPDATES == 64
+    # Участников больше лимита: все слоты заняты, но не больше
+    assert max_in_flight == processor.max_concurrent
+
+    for user_id in user_ids:
+        expected = expected_messages(bot, user_id)
+        assert request.sent[user_id][:len(expected)] == expected
+        participant = bot.user_data[user_id]
+        assert participant.answer_count == len(ANSWERS)
+        assert participant.raffle_number
+
+    # Участники обрабатываются параллельно: квест USERS участников ненамного дольше квеста одного
+    assert elapsed < SLOWDOWN_LIMIT * single_elapsed + SLOWDOWN_ALLOWANCE, (
+        f"{USERS} участников: {elapsed:.2f} с, один участник: {single_elapsed:.2f} с"
+    )
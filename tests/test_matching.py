@@ -0,0 +1,87 @@
+"""Проверка ответов по ключу: задание с эмодзи (3) и приветствие (4) с опечатками и без"""
+import pytest
+
+from matching import ConceptMatcher, typo_allowed
+
+EMOJI = 2
+GREETING = 3
+
+
+@pytest.mark.parametrize("text", [
+    "Привет, Маша!",
+    "пирвет!!",
+    "Здраствуйте, Иван",
+    "приветствую всех",
+    "Hello!!!",
+    "Приветик, Маша!",
+    "Приветствуем тебя",
+    "Передаю приветы всем",
+    "Приветище!",
+    "Шлю приветов Андрею",
+])
+def test_greeting_accepted(bot, text):
+    assert bot.validate_answer(text, bot.QUESTIONS[GREETING], GREETING) == (True, "")
+
+
+@pytest.mark.parametrize("text", [
+    "привез тебе подарок",
+    "hell yeah",
+    "this is it",
+    "было круто пообщаться",
+])
+def test_greeting_rejected(bot, text):
+    assert not bot.validate_answer(text, bot.QUESTIONS[GREETING], GREETING)[0]
+
+
+@pytest.mark.parametrize("text", [
+    "искусственный интеллект, машинное обучение, нейросеть, компьютерное зрение",
+    "ИИ\nМЛ\nнейронная сеть\nкомпьютерное зрение",
+    "🤖🧠 - AI; 🚗📖 - ML; 🧠📶 - neural network; 🖥️👁️ - computer vision",
+    "искуственный интелект, машиное обучение, нейрсеть, компютерное зрение",
+    "ии; машинное обученние; нейросети; cv",
+    "ии, мл, общаюсь с нейросетью, cv",
+    "ai ml neural networks cv",
+])
+def test_emoji_answer_accepted(bot, text):
+    assert bot.check_emoji_answer(text.lower()) == (True, [])
+
+
+@pytest.mark.parametrize("text, missing", [
+    ("ии, мышиное обучение, нейросеть, cv", ["🚗📖"]),
+    ("ии, машинное облучение, нейросеть, cv", ["🚗📖"]),
+    ("ии, мл, нейросеть, компьютерное горение", ["🖥️👁️"]),
+    ("на линии html и nnn", ["🤖🧠", "🚗📖", "🧠📶", "🖥️👁️"]),
+    ("аиии, mlp, nnet, cvs", ["🤖🧠", "🚗📖", "🧠📶", "🖥️👁️"]),
+])
+def test_emoji_answer_rejected(bot, text, missing):
+    assert bot.check_emoji_answer(text.lower()) == (False, missing)
+
+
+@pytest.mark.parametrize("word, variant, allowed", [
+    ("пирвет", "привет", True),
+    ("привез", "привет", False),
+    ("hell", "hello", False),
+    ("машиное", "машинное", True),
+    ("мышинное", "машинное", True),
+    ("обученние", "обучение", True),
+    ("облучение", "обучение", False),
+    ("горение", "зрение", False),
+    ("ai", "ии", False),
+])
+def test_typo_allowed(word, variant, allowed):
+    assert typo_allowed(word, variant) is allowed
+
+
+@pytest.mark.parametrize("max_distance, text, found", [
+    # Без max_distance — правила по умолчанию: лишняя буква, не повторяющая соседнюю, не прощается
+    (None, "машиное обучение", True),
+    (None, "машинное облучение", False),
+    (0, "машиное обучение", False),
+    (1, "машинное облучение", True),
+    (1, "мошиное обучение", False),
+    (2, "мошиное обучение", True),
+    (2, "ии", False),
+])
+def test_max_distance(max_distance, text, found):
+    matcher = ConceptMatcher({"ml": ["машинное обучение", "мл"]}, 2, max_distance={"ml": max_distance})
+    assert (matcher.missing(text) == []) is found
@@ -0,0 +1,139 @@
+"""
+Трассировка обновлений: сколько длился каждый этап обработки (состояние участника, проверка ответа,
+сохранение, запросы к Bot API, ...). Обновление, обработанное дольше порога TRACE_SLOW_UPDATE_MS,
+записывается в лог одной JSON-строкой с разбивкой по этапам.
+
+Трасса обновления хранится в contextvars, поэтому этапы, вызванные из обработчика где угодно ниже
+(в том числе запросы к Bot API внутри python-telegram-bot), попадают в неё без передачи параметров.
+Выключенная трассировка почти ничего не стоит: traced() возвращает обработчик как есть,
+stage() — общий пустой контекстный менеджер (замер — benchmarks/bench_tracing.py).
+"""
+import contextvars
+import functools
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Порог медленного обновления в секундах; None — трассировка выключена
+_threshold: float | None = None
+_current: contextvars.ContextVar = contextvars.ContextVar("update_trace", default=None)
+
+
+def configure(slow_update_ms: float) -> None:
+    """
+    Включает трассировку с порогом slow_update_ms (0 — выключает).
+    Вызывается до объявления обработчиков: traced() решает, оборачивать ли их, в момент объявления
+    """
+    global _threshold
+    _threshold = slow_update_ms / 1000 if slow_update_ms > 0 else None
+
+
+class UpdateTrace:
+    """Этапы одного обновления: (название, начало от начала обработки, длительность), секунды"""
+
+    __slots__ = ("handler", "update_id", "user_id", "started", "stages")
+
+    def __init__(self, handler: str, update: object):
+        self.handler = handler
+        self.update_id = getattr(update, "update_id", None)
+        user = getattr(update, "effective_user", None)
+        self.user_id = user.id if user is not None else None
+        self.started = time.perf_counter()
+        self.stages: list[tuple[str, float, float]] = []
+
+    def add(self, name: str, started: float, seconds: float) -> None:
+        self.stages.append((name, started - self.started, seconds))
+
+    def to_json(self, duration: float) -> dict:
+        return {
+            "event": "slow_update",
+            "handler": self.handler,
+            "update_id": self.update_id,
+            "user_id": self.user_id,
+            "duration_ms": round(duration * 1000, 3),
+            "stages": [
+                {"stage": name, "start_ms": round(offset * 1000, 3), "duration_ms": round(seconds * 1000, 3)}
+                for name, offset, seconds in sorted(self.stages, key=lambda entry: entry[1])
+            ],
+        }
+
+    def finish(self) -> None:
+        duration = time.perf_counter() - self.started
+        if _threshold is not None and duration >= _threshold:
+            logger.warning(json.dumps(self.to_json(duration), ensure_ascii=False))
+
+
+class _Stage:
+    __slots__ = ("trace", "name", "started")
+
+    def __init__(self, trace: UpdateTrace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.add(self.name, self.started, time.perf_counter() - self.started)
+        return False
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str):
+    """Этап обработки обновления: with stage("validation"): ... Вне трассы ничего не замеряет"""
+    if _threshold is None:
+        return _NO_STAGE
+    trace = _current.get()
+    if trace is None:
+        return _NO_STAGE
+    return _Stage(trace, name)
+
+
+def record(name: str, seconds: float) -> None:
+    """Этап, уже замеренный в другом месте (например, запрос в TimedRequest), который закончился сейчас"""
+    if _threshold is None:
+        return
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, time.perf_counter() - seconds, seconds)
+
+
+def traced(handler_name: str):
+    """
+    Декоратор корутины (update, ...): своя трасса на каждое обновление.
+    Вызов из уже трассируемого обработчика (complete_quest из handle_message) — этап его трассы
+    """
+    def decorator(func):
+        if _threshold is None:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(update, *args, **kwargs):
+            parent = _current.get()
+            if parent is not None:
+                with _Stage(parent, handler_name):
+                    return await func(update, *args, **kwargs)
+            trace = UpdateTrace(handler_name, update)
+            token = _current.set(trace)
+            try:
+                return await func(update, *args, **kwargs)
+            finally:
+                _current.reset(token)
+                trace.finish()
+        return wrapper
+    return decorator
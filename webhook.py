@@ -0,0 +1,132 @@
+"""
+Режим вебхука: Telegram сам присылает обновления POST-запросами, бот не опрашивает getUpdates.
+Сервер — http_server.HTTPServer, обновления кладутся в application.update_queue,
+дальше обрабатываются так же, как при polling.
+"""
+import asyncio
+import hmac
+import logging
+import signal
+import time
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from http_server import HTTPServer, Request, Response, json_response, text_response
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+HEALTH_PATH = "/healthz"
+
+
+class WebhookServer:
+    """
+    POST {path} — обновление от Telegram (проверяется секретный токен, если задан),
+    GET /healthz — состояние бота: 200, пока принимаем обновления, 503 во время остановки.
+    """
+
+    def __init__(self, application: Application, listen: str, port: int, path: str,
+                 secret_token: Optional[str] = None):
+        self.application = application
+        self.path = path if path.startswith("/") else f"/{path}"
+        self.secret_token = secret_token or None
+        self.server = HTTPServer(listen, port)
+        self.server.route("POST", self.path, self._handle_update)
+        self.server.route("GET", HEALTH_PATH, self._handle_health)
+        self.draining = False
+        self.started_at = time.monotonic()
+        self.received = 0
+
+    async def _handle_update(self, request: Request) -> Response:
+        if self.secret_token is not None:
+            token = request.headers.get(SECRET_TOKEN_HEADER, "")
+            if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+                logger.warning("Вебхук: запрос с неверным секретным токеном отклонён")
+                return text_response("Forbidden", 403)
+        if self.draining:
+            # Telegram повторит доставку позже — уже новому процессу
+            return text_response("Shutting down", 503)
+        try:
+            update = Update.de_json(request.json(), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Вебхук: некорректное обновление: {e}")
+            return text_response("Bad Request", 400)
+        if update is None:
+            return text_response("Bad Request", 400)
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return text_response("OK")
+
+    async def _handle_health(self, request: Request) -> Response:
+        status = "draining" if self.draining else "ok"
+        return json_response({
+            "status": status,
+            "mode": "webhook",
+            "uptime": round(time.monotonic() - self.started_at, 1),
+            "updates_received": self.received,
+            "update_queue": self.application.update_queue.qsize(),
+            "requests_in_flight": self.server.in_flight,
+        }, status=503 if self.draining else 200)
+
+    async def serve(self, stop_event: asyncio.Event, webhook_url: Optional[str] = None,
+                    drop_pending_updates: bool = True) -> None:
+        """Запускает бота и сервер, ждёт stop_event, затем аккуратно останавливает всё в обратном порядке"""
+        application = self.application
+        await application.initialize()
+        if application.post_init is not None:
+            await application.post_init(application)
+        try:
+            if webhook_url:
+                await application.bot.set_webhook(
+                    url=webhook_url,
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=drop_pending_updates,
+                    secret_token=self.secret_token,
+                )
+                logger.info(f"Вебхук зарегистрирован: {webhook_url}")
+            await application.start()
+            await self.server.start()
+            logger.info(f"Бот принимает обновления на {self.server.host}:{self.server.port}{self.path}")
+
+            await stop_event.wait()
+
+            # 1. Новые обновления не принимаем (Telegram повторит их позже),
+            #    ждём ответа на уже принятые HTTP-запросы
+            logger.info("Остановка вебхука: дожидаемся обработки принятых обновлений...")
+            self.draining = True
+            await self.server.stop()
+        finally:
+            # 2. Application.stop() обрабатывает всё, что уже в update_queue, и ждёт запущенные обработчики
+            if application.running:
+                await application.stop()
+                if application.post_stop is not None:
+                    await application.post_stop(application)
+            await application.shutdown()
+            if application.post_shutdown is not None:
+                await application.post_shutdown(application)
+        logger.info("Вебхук остановлен")
+
+
+def serve_until_signal(server: WebhookServer, webhook_url: Optional[str] = None,
+                       drop_pending_updates: bool = True) -> None:
+    """Блокирующий запуск сервера до SIGINT/SIGTERM"""
+    async def main():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:  # Windows
+                pass
+        await server.serve(stop_event, webhook_url, drop_pending_updates)
+
+    asyncio.run(main())
+
+
+def run_webhook(application: Application, listen: str, port: int, path: str,
+                secret_token: Optional[str] = None, webhook_url: Optional[str] = None,
+                drop_pending_updates: bool = True) -> None:
+    """Блокирующий запуск вебхука до SIGINT/SIGTERM, по аналогии с Application.run_polling"""
+    serve_until_signal(WebhookServer(application, listen, port, path, secret_token), webhook_url, drop_pending_updates)
@@ -0,0 +1,319 @@
+"""
+Несколько процессов бота с общей базой SQLite (BOT_WORKERS=N, только STORAGE_BACKEND=sqlite).
+
+Главный процесс получает обновления от Telegram (polling или вебхук) и сам их не обрабатывает:
+раздаёт рабочим процессам по user_id % N. Все обновления участника попадают в один и тот же
+процесс и по порядку, поэтому состояние диалога по-прежнему живёт в памяти процесса,
+а каждый рабочий загружает из базы только своих участников.
+
+Общее для всех процессов — в базе: записи участников, тексты ответов, номера розыгрыша
+(номер выдаётся транзакцией по общей карте занятых номеров, см.
+SQLiteStorage.complete_with_shared_allocator), флаг завершения квеста. /finish, кроме записи
+в базу, сразу рассылается всем рабочим (POST /control), чтобы они перестали принимать ответы.
+
+Рабочий процесс — обычный bot.py в режиме вебхука на 127.0.0.1. Номер рабочего, порты всех
+рабочих и общий секрет главный процесс передаёт через переменные окружения.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import httpx
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+from concurrency import update_user_key
+from http_server import Request, Response, text_response
+from webhook import SECRET_TOKEN_HEADER, WebhookServer, serve_until_signal
+
+logger = logging.getLogger(__name__)
+
+WORKER_INDEX_ENV = "BOT_WORKER_INDEX"
+WORKER_PORTS_ENV = "BOT_WORKER_PORTS"
+WORKER_SECRET_ENV = "BOT_WORKER_SECRET"
+
+UPDATE_PATH = "/update"
+CONTROL_PATH = "/control"
+HEALTH_PATH = "/healthz"
+
+# Сколько ждать запуска рабочих и пауза между повторами, пока рабочий недоступен (например, перезапускается)
+STARTUP_TIMEOUT = 60
+RETRY_DELAY = 0.5
+# Сколько при остановке ждать, пока рабочие примут уже полученные обновления, и пока они сами остановятся
+DRAIN_TIMEOUT = 30
+STOP_TIMEOUT = 60
+
+
+def shard_of(key: int | None, count: int) -> int:
+    """Номер рабочего для пользователя; обновления без пользователя и чата — первому рабочему"""
+    return key % count if key is not None else 0
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _authorized(request: Request, secret: str) -> bool:
+    token = request.headers.get(SECRET_TOKEN_HEADER, "")
+    return hmac.compare_digest(token.encode(), secret.encode())
+
+
+# --- Рабочий процесс ---
+
+class WorkerLink:
+    """
+    Рабочий процесс: его номер (index из count), приём обновлений от главного процесса
+    и рассылка команд остальным рабочим
+    """
+
+    def __init__(self, index: int, ports: list[int], secret: str):
+        self.index = index
+        self.ports = ports
+        self.secret = secret
+
+    @classmethod
+    def from_env(cls) -> "WorkerLink | None":
+        """Связь с главным процессом, если бот запущен им как рабочий; иначе None"""
+        index = os.getenv(WORKER_INDEX_ENV)
+        if index is None:
+            return None
+        ports = [int(port) for port in os.environ[WORKER_PORTS_ENV].split(",")]
+        return cls(int(index), ports, os.environ[WORKER_SECRET_ENV])
+
+    @property
+    def count(self) -> int:
+        return len(self.ports)
+
+    @property
+    def shard(self) -> tuple[int, int]:
+        """(index, count) для SQLiteStorage.load_user_data"""
+        return self.index, self.count
+
+    async def broadcast(self, message: dict) -> int:
+        """Отправляет команду всем остальным рабочим; возвращает, скольким она доставлена"""
+        headers = {SECRET_TOKEN_HEADER: self.secret}
+        others = [port for index, port in enumerate(self.ports) if index != self.index]
+        async with httpx.AsyncClient(timeout=10) as client:
+            results = await asyncio.gather(
+                *(client.post(f"http://127.0.0.1:{port}{CONTROL_PATH}", json=message, headers=headers)
+                  for port in others),
+                return_exceptions=True,
+            )
+        delivered = 0
+        for port, result in zip(others, results):
+            if isinstance(result, Exception) or result.status_code != 200:
+                # Перезапущенный рабочий прочитает состояние из базы при запуске
+                logger.warning(f"Команда {message} не доставлена рабочему на порту {port}: {result}")
+            else:
+                delivered += 1
+        return delivered
+
+    def run(self, application: Application, on_control: Callable[[dict], None]) -> None:
+        """Блокирующий запуск: обновления от главного процесса и команды других рабочих до SIGTERM"""
+        server = WebhookServer(application, "127.0.0.1", self.ports[self.index], UPDATE_PATH, self.secret)
+
+        async def handle_control(request: Request) -> Response:
+            if not _authorized(request, self.secret):
+                return text_response("Forbidden", 403)
+            on_control(request.json())
+            return text_response("OK")
+
+        server.server.route("POST", CONTROL_PATH, handle_control)
+        logger.info(f"Рабочий процесс {self.index + 1} из {self.count}")
+        # Вебхук у Telegram регистрирует главный процесс
+        serve_until_signal(server)
+
+
+# --- Главный процесс ---
+
+class WorkerPool:
+    """Рабочие процессы bot.py; упавший рабочий запускается заново с тем же номером и портом"""
+
+    def __init__(self, count: int, script: Path):
+        self.script = Path(script)
+        self.ports = [_free_port() for _ in range(count)]
+        self.secret = secrets.token_hex(16)
+        self.processes: list[Optional[subprocess.Popen]] = [None] * count
+        self.stopping = False
+
+    def _spawn(self, index: int) -> None:
+        env = dict(os.environ)
+        env.update({
+            WORKER_INDEX_ENV: str(index),
+            WORKER_PORTS_ENV: ",".join(map(str, self.ports)),
+            WORKER_SECRET_ENV: self.secret,
+        })
+        # Своя группа процессов: Ctrl+C получает только главный процесс и останавливает рабочих по порядку
+        self.processes[index] = subprocess.Popen(
+            [sys.executable, str(self.script)], env=env, start_new_session=True,
+        )
+
+    def start(self) -> None:
+        for index in range(len(self.ports)):
+            self._spawn(index)
+
+    async def wait_ready(self, client: httpx.AsyncClient) -> None:
+        """Ждёт, пока все рабочие загрузят своих участников и начнут принимать обновления"""
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        pending = set(range(len(self.ports)))
+        while pending:
+            for index in list(pending):
+                if self.processes[index].poll() is not None:
+                    raise RuntimeError(f"Рабочий процесс {index + 1} завершился при запуске")
+                try:
+                    response = await client.get(f"http://127.0.0.1:{self.ports[index]}{HEALTH_PATH}")
+                    if response.status_code == 200:
+                        pending.discard(index)
+                except httpx.TransportError:
+                    pass
+            if pending:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Рабочие процессы не запустились за {STARTUP_TIMEOUT} с")
+                await asyncio.sleep(0.2)
+        logger.info(f"Рабочих процессов запущено: {len(self.ports)}")
+
+    async def supervise(self) -> None:
+        """Перезапускает рабочих, которые завершились не по команде главного процесса"""
+        while not self.stopping:
+            for index, process in enumerate(self.processes):
+                if process is not None and process.poll() is not None and not self.stopping:
+                    logger.error(f"Рабочий процесс {index + 1} завершился (код {process.returncode}), перезапускаем")
+                    self._spawn(index)
+            await asyncio.sleep(1)
+
+    def stop(self) -> None:
+        """SIGTERM всем рабочим: каждый дообрабатывает принятые обновления и сохраняет данные"""
+        self.stopping = True
+        for process in self.processes:
+            if process is not None and process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.error(f"Рабочий процесс {index + 1} не остановился за {STOP_TIMEOUT} с, завершаем принудительно")
+                process.kill()
+                process.wait()
+
+
+class UpdateRouter:
+    """
+    Раздаёт обновления рабочим: у каждого рабочего своя очередь и одна задача отправки,
+    поэтому обновления одного участника приходят к рабочему в том порядке, в каком их прислал Telegram
+    """
+
+    def __init__(self, pool: WorkerPool, client: httpx.AsyncClient):
+        self.pool = pool
+        self.client = client
+        self.queues = [asyncio.Queue() for _ in pool.ports]
+        self.routed = [0] * len(pool.ports)
+        self._senders = []
+
+    async def route(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Обработчик главного процесса для всех обновлений (TypeHandler)"""
+        index = shard_of(update_user_key(update), len(self.queues))
+        self.routed[index] += 1
+        self.queues[index].put_nowait(update.to_json())
+
+    async def _send(self, index: int) -> None:
+        queue = self.queues[index]
+        url = f"http://127.0.0.1:{self.pool.ports[index]}{UPDATE_PATH}"
+        headers = {SECRET_TOKEN_HEADER: self.pool.secret, "Content-Type": "application/json"}
+        while True:
+            body = await queue.get()
+            while True:
+                try:
+                    response = await self.client.post(url, content=body, headers=headers)
+                    if response.status_code == 200:
+                        break
+                    # 503 — рабочий останавливается, 400 — обновление ему не понравилось
+                    if response.status_code != 503:
+                        logger.error(f"Рабочий {index + 1} отклонил обновление: HTTP {response.status_code}")
+                        break
+                except httpx.TransportError as e:
+                    logger.warning(f"Рабочий {index + 1} недоступен ({e!r}), повторяем")
+                await asyncio.sleep(RETRY_DELAY)
+            queue.task_done()
+
+    def start(self) -> None:
+        self._senders = [asyncio.create_task(self._send(index)) for index in range(len(self.queues))]
+
+    async def stop(self) -> None:
+        """Дожидается отправки уже полученных обновлений (не дольше DRAIN_TIMEOUT)"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            left = sum(queue.qsize() for queue in self.queues)
+            logger.error(f"Не отправлено рабочим обновлений при остановке: {left}")
+        for task in self._senders:
+            task.cancel()
+        await asyncio.gather(*self._senders, return_exceptions=True)
+        logger.info(f"Обновлений по рабочим: {self.routed}")
+
+
+def run_router(application: Application, workers: int, script: Path, mode: str = "polling",
+               listen: str = "0.0.0.0", port: int = 8443, path: str = "/webhook",
+               secret_token: Optional[str] = None, webhook_url: Optional[str] = None,
+               drop_pending_updates: bool = True) -> None:
+    """
+    Блокирующий запуск главного процесса до SIGINT/SIGTERM: запускает workers рабочих,
+    получает обновления (polling или вебхук, как обычный бот) и раздаёт их рабочим.
+    application — без обработчиков: в него добавляется только раздача обновлений.
+    """
+    pool = WorkerPool(workers, script)
+
+    async def main():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:  # Windows
+                pass
+
+        pool.start()
+        limits = httpx.Limits(max_connections=2 * workers, max_keepalive_connections=2 * workers)
+        async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+            try:
+                await pool.wait_ready(client)
+                router = UpdateRouter(pool, client)
+                application.add_handler(TypeHandler(Update, router.route))
+                router.start()
+                supervisor = asyncio.create_task(pool.supervise())
+                try:
+                    if mode == "webhook":
+                        server = WebhookServer(application, listen, port, path, secret_token)
+                        await server.serve(stop_event, webhook_url, drop_pending_updates)
+                    else:
+                        await application.initialize()
+                        await application.updater.start_polling(
+                            allowed_updates=Update.ALL_TYPES, drop_pending_updates=drop_pending_updates,
+                        )
+                        await application.start()
+                        logger.info("Главный процесс получает обновления (polling)")
+                        await stop_event.wait()
+                        await application.updater.stop()
+                        await application.stop()
+                        await application.shutdown()
+                finally:
+                    # Сначала рабочие получают всё, что уже принято от Telegram, потом останавливаются
+                    await router.stop()
+                    supervisor.cancel()
+            finally:
+                await asyncio.to_thread(pool.stop)
+
+    asyncio.run(main())